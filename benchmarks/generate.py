@@ -0,0 +1,303 @@
+import random
+
+# Generators of random, valid programs for the language levels, with
+# knobs for the size and shape of the programs:
+#
+#   statements       number of top-level statements (and the size of
+#                    the body of each function)
+#   depth            maximum nesting depth of expressions and of
+#                    if/while statements
+#   live_vars        number of integer variables that are live through
+#                    the whole program (all of them are printed at the end)
+#   functions        number of function definitions (Lfun and above)
+#   allocation_rate  probability that a statement allocates a tuple
+#                    (Ltup and above)
+#   iterations       number of iterations of each while loop
+#
+# Each generator extends the one for the previous language level, like
+# the interpreters and type checkers do. The programs are deterministic
+# for a given seed, every variable is defined before it is used and
+# every loop terminates. The generated programs only read from stdin
+# through input_int() when input_rate is non-zero.
+
+
+class GenLvar:
+    def __init__(
+        self,
+        statements=100,
+        depth=3,
+        live_vars=8,
+        functions=0,
+        allocation_rate=0.0,
+        iterations=10,
+        input_rate=0.0,
+        seed=0,
+    ):
+        self.statements = statements
+        self.depth = depth
+        self.live_vars = max(1, live_vars)
+        self.functions = functions
+        self.allocation_rate = allocation_rate
+        self.iterations = iterations
+        self.input_rate = input_rate
+        self.seed = seed
+
+    def program(self):
+        self.random = random.Random(self.seed)
+        self.lines = []
+        self.counter = 0
+        self.generate()
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def fresh(self, prefix):
+        self.counter += 1
+        return prefix + str(self.counter)
+
+    def chance(self, rate):
+        return self.random.random() < rate
+
+    def generate(self):
+        scope = self.top_scope()
+        self.define_variables(scope)
+        for i in range(self.statements):
+            self.gen_stmt(scope, 0, self.depth)
+        self.print_variables(scope)
+
+    # The names that expressions can refer to.
+    def top_scope(self):
+        return {"ints": ["v" + str(i) for i in range(self.live_vars)]}
+
+    def define_variables(self, scope):
+        for x in scope["ints"]:
+            self.emit(0, x + " = " + self.gen_leaf(scope, allow_vars=False))
+
+    def print_variables(self, scope):
+        for x in scope["ints"]:
+            self.emit(0, "print(" + x + ")")
+
+    def gen_leaf(self, scope, allow_vars=True):
+        if self.chance(self.input_rate):
+            return "input_int()"
+        if allow_vars and scope["ints"] and self.chance(0.7):
+            return self.random.choice(scope["ints"])
+        return str(self.random.randint(0, 100))
+
+    def gen_int_exp(self, scope, depth):
+        if depth <= 0 or self.chance(0.3):
+            return self.gen_leaf(scope)
+        k = self.random.randrange(3)
+        if k == 0:
+            return "-" + self.gen_int_exp(scope, depth - 1)
+        op = "+" if k == 1 else "-"
+        return (
+            "("
+            + self.gen_int_exp(scope, depth - 1)
+            + " "
+            + op
+            + " "
+            + self.gen_int_exp(scope, depth - 1)
+            + ")"
+        )
+
+    def gen_stmt(self, scope, indent, depth):
+        if self.chance(0.1):
+            self.emit(indent, "print(" + self.gen_int_exp(scope, depth) + ")")
+        else:
+            x = self.random.choice(scope["ints"])
+            self.emit(indent, x + " = " + self.gen_int_exp(scope, depth))
+
+
+class GenLif(GenLvar):
+    def gen_bool_exp(self, scope, depth):
+        if depth <= 0 or self.chance(0.2):
+            if self.chance(0.1):
+                return self.random.choice(["True", "False"])
+            op = self.random.choice(["<", "<=", ">", ">=", "==", "!="])
+            return (
+                self.gen_int_exp(scope, 0) + " " + op + " " + self.gen_int_exp(scope, 0)
+            )
+        k = self.random.randrange(3)
+        if k == 0:
+            return "not (" + self.gen_bool_exp(scope, depth - 1) + ")"
+        op = "and" if k == 1 else "or"
+        return (
+            "("
+            + self.gen_bool_exp(scope, depth - 1)
+            + " "
+            + op
+            + " "
+            + self.gen_bool_exp(scope, depth - 1)
+            + ")"
+        )
+
+    def gen_int_exp(self, scope, depth):
+        if depth > 0 and self.chance(0.1):
+            return (
+                "("
+                + self.gen_int_exp(scope, depth - 1)
+                + " if "
+                + self.gen_bool_exp(scope, depth - 1)
+                + " else "
+                + self.gen_int_exp(scope, depth - 1)
+                + ")"
+            )
+        return super().gen_int_exp(scope, depth)
+
+    def gen_block(self, scope, indent, depth):
+        for i in range(self.random.randint(1, 3)):
+            self.gen_stmt(scope, indent, depth)
+
+    def gen_stmt(self, scope, indent, depth):
+        if depth > 0 and self.chance(0.15):
+            self.emit(indent, "if " + self.gen_bool_exp(scope, depth - 1) + ":")
+            self.gen_block(scope, indent + 1, depth - 1)
+            self.emit(indent, "else:")
+            self.gen_block(scope, indent + 1, depth - 1)
+        else:
+            super().gen_stmt(scope, indent, depth)
+
+
+class GenLwhile(GenLif):
+    # Each loop has its own counter, so that nested loops and the
+    # statements in their bodies can't change how often a loop runs.
+    def gen_stmt(self, scope, indent, depth):
+        if depth > 0 and self.chance(0.1):
+            i = self.fresh("i")
+            self.emit(indent, i + " = 0")
+            self.emit(indent, "while " + i + " < " + str(self.iterations) + ":")
+            self.gen_block(scope, indent + 1, depth - 1)
+            self.emit(indent + 1, i + " = " + i + " + 1")
+        else:
+            super().gen_stmt(scope, indent, depth)
+
+
+class GenLtup(GenLwhile):
+    # The tuple variables have a fixed length each, so that they can be
+    # reassigned anywhere without changing their type.
+    def top_scope(self):
+        scope = super().top_scope()
+        count = max(1, self.live_vars // 4) if self.allocation_rate > 0 else 0
+        scope["tuples"] = [("t" + str(i), 1 + i % 3) for i in range(count)]
+        return scope
+
+    def define_variables(self, scope):
+        super().define_variables(scope)
+        ints = {"ints": scope["ints"]}
+        for t, n in scope.get("tuples", []):
+            self.emit(0, t + " = " + self.gen_tuple(ints, n, 0))
+
+    def print_variables(self, scope):
+        super().print_variables(scope)
+        for t, n in scope.get("tuples", []):
+            self.emit(0, "print(" + t + "[" + str(n - 1) + "])")
+
+    def gen_tuple(self, scope, n, depth):
+        elts = [self.gen_int_exp(scope, depth) for i in range(n)]
+        return "(" + ", ".join(elts) + ("," if n == 1 else "") + ")"
+
+    def gen_leaf(self, scope, allow_vars=True):
+        tuples = scope.get("tuples", [])
+        if allow_vars and tuples and self.chance(0.15):
+            t, n = self.random.choice(tuples)
+            if self.chance(0.2):
+                return "len(" + t + ")"
+            return t + "[" + str(self.random.randrange(n)) + "]"
+        return super().gen_leaf(scope, allow_vars)
+
+    def gen_stmt(self, scope, indent, depth):
+        tuples = scope.get("tuples", [])
+        if tuples and self.chance(self.allocation_rate):
+            t, n = self.random.choice(tuples)
+            self.emit(indent, t + " = " + self.gen_tuple(scope, n, depth - 1))
+        else:
+            super().gen_stmt(scope, indent, depth)
+
+
+class GenLfun(GenLtup):
+    # Functions only call the functions defined before them, so there
+    # is no recursion and every call terminates.
+    def generate(self):
+        self.defined = []
+        for i in range(self.functions):
+            self.gen_function(i)
+        super().generate()
+
+    def param(self, x):
+        return x + ": int"
+
+    def gen_function(self, i):
+        f = "f" + str(i)
+        arity = 1 + i % 3
+        params = ["p" + str(k) for k in range(arity)]
+        self.emit(
+            0,
+            "def "
+            + f
+            + "("
+            + ", ".join(self.param(x) for x in params)
+            + ")"
+            + self.return_annotation()
+            + ":",
+        )
+        scope = {"ints": params}
+        for k in range(max(1, self.statements // max(1, self.functions))):
+            self.gen_stmt(scope, 1, self.depth)
+        self.emit(1, "return " + self.gen_int_exp(scope, self.depth))
+        self.emit(0, "")
+        self.defined.append((f, arity))
+
+    def return_annotation(self):
+        return " -> int"
+
+    def gen_int_exp(self, scope, depth):
+        if depth > 0 and self.defined and self.chance(0.1):
+            f, arity = self.random.choice(self.defined)
+            args = [self.gen_int_exp(scope, depth - 1) for k in range(arity)]
+            return f + "(" + ", ".join(args) + ")"
+        return super().gen_int_exp(scope, depth)
+
+
+class GenLlambda(GenLfun):
+    # Defines one lambda per function (capturing live variables of the
+    # top level) after the live variables and calls them like functions.
+    def define_variables(self, scope):
+        super().define_variables(scope)
+        for i in range(self.functions):
+            g = "g" + str(i)
+            body = self.gen_int_exp({"ints": ["z"] + scope["ints"]}, 1)
+            self.emit(0, self.lambda_target(g) + " = lambda z: " + body)
+            self.defined.append((g, 1))
+
+    def lambda_target(self, g):
+        return g + " : Callable[[int], int]"
+
+
+# Ldyn is dynamically typed, so its programs are the Llambda programs
+# without the type annotations.
+class GenLdyn(GenLlambda):
+    def param(self, x):
+        return x
+
+    def return_annotation(self):
+        return ""
+
+    def lambda_target(self, g):
+        return g
+
+
+generators = {
+    "Lvar": GenLvar,
+    "Lif": GenLif,
+    "Lwhile": GenLwhile,
+    "Ltup": GenLtup,
+    "Lfun": GenLfun,
+    "Llambda": GenLlambda,
+    "Ldyn": GenLdyn,
+}
+
+
+def generate_program(level, **knobs):
+    return generators[level](**knobs).program()
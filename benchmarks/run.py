@@ -0,0 +1,249 @@
+import argparse
+import json
+import math
+import sys
+
+import compiler
+import compiler_register_allocator
+import type_check_Lfun
+import type_check_Lif
+import type_check_Llambda
+import type_check_Ltup
+import type_check_Lvar
+import type_check_Lwhile
+from benchmarks.generate import generate_program, generators
+from pass_pipeline import PassPipeline, ProfileHook, compiler_passes
+from pass_profiler import PassProfiler
+from utils import parse
+
+# Measures how the time of each pass of the compilers grows with the
+# size of the input program. For every size, a program is generated
+# with benchmarks.generate and compiled with a pass pipeline whose
+# ProfileHook records the time of each pass (not counting the time of
+# the phases measured inside it); the best time over a few repetitions
+# is kept. The exponent of each pass is the slope of the
+# log-log fit of its times against the size, so about 1 for a linear
+# pass and about 2 for a quadratic one.
+#
+# Usage (from the root of the repository):
+#
+#   python -m benchmarks.run --level Lvar --knob statements --sizes 25,50,100,200
+#
+# A pass that raises an exception (e.g. because the compiler doesn't
+# support the language level yet) is reported as an error for that
+# size, and the passes after it are not measured.
+
+compilers = {
+    "compiler": compiler.Compiler,
+    "compiler_register_allocator": compiler_register_allocator.Compiler,
+}
+
+type_checkers = {
+    "Lvar": type_check_Lvar.TypeCheckLvar,
+    "Lif": type_check_Lif.TypeCheckLif,
+    "Lwhile": type_check_Lwhile.TypeCheckLwhile,
+    "Ltup": type_check_Ltup.TypeCheckLtup,
+    "Lfun": type_check_Lfun.TypeCheckLfun,
+    "Llambda": type_check_Llambda.TypeCheckLlambda,
+}
+
+# Methods that are measured in addition to the passes when a compiler
+# has them, e.g. the phases of register allocation in assign_homes.
+phases = [
+    "uncover_live",
+    "build_interference",
+    "color_graph",
+    "allocate_registers",
+]
+
+
+def measured(method, measure, name):
+    def run(*args, **kwargs):
+        with measure("phase", name):
+            return method(*args, **kwargs)
+
+    return run
+
+
+def instrument(compiler, measure):
+    for name in phases:
+        method = getattr(compiler, name, None)
+        if method is not None:
+            setattr(compiler, name, measured(method, measure, name))
+
+
+# Compiles the program once and returns the profiler records together
+# with the error (if any) as "pass: exception".
+def compile_once(compiler_class, level, source, memory):
+    profiler = PassProfiler(trace_memory=memory)
+
+    def measure(kind, name):
+        return profiler.measure(level, kind, name)
+
+    program = parse(source)
+    if level in type_checkers:
+        with measure("type_check", "source"):
+            type_checkers[level]().type_check(program)
+    compiler = compiler_class()
+    instrument(compiler, measure)
+    pipeline = PassPipeline(compiler_passes, [ProfileHook(measure)])
+    error = None
+    try:
+        pipeline.run(compiler, program)
+    except Exception as e:
+        error = str(pipeline.current_pass) + ": " + repr(e)
+    finally:
+        profiler.stop()
+    return profiler.records, error
+
+
+def run_benchmark(
+    compiler_class, level, sizes, knob="statements", repeat=3, memory=False, **knobs
+):
+    results = []
+    for size in sizes:
+        source = generate_program(level, **dict(knobs, **{knob: size}))
+        best = {}
+        error = None
+        for i in range(repeat):
+            records, error = compile_once(compiler_class, level, source, memory)
+            for r in records:
+                key = r["kind"] + ":" + r["name"]
+                if key not in best or r["wall_time"] < best[key]["wall_time"]:
+                    best[key] = r
+        results.append(
+            {
+                "size": size,
+                "lines": source.count("\n"),
+                "times": {key: r["wall_time"] for key, r in best.items()},
+                "memory": {key: r["peak_memory"] for key, r in best.items()},
+                "error": error,
+            }
+        )
+    return results
+
+
+# The least-squares slope of log(time) against log(size), or None if
+# there are fewer than two sizes with a measurable time.
+def scaling_exponent(points):
+    points = [(math.log(n), math.log(t)) for n, t in points if n > 0 and t > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, y in points)
+    if var == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def scaling(results):
+    keys = []
+    for r in results:
+        for key in r["times"]:
+            if key not in keys:
+                keys.append(key)
+    curves = {}
+    for key in keys:
+        points = [(r["size"], r["times"][key]) for r in results if key in r["times"]]
+        curves[key] = {"points": points, "exponent": scaling_exponent(points)}
+    return curves
+
+
+def format_report(compiler_name, level, knob, results):
+    curves = scaling(results)
+    width = max([len(key) for key in curves] + [len("pass")])
+    lines = [compiler_name + " on " + level + ", " + knob + ":"]
+    header = "pass".ljust(width)
+    for r in results:
+        header += str(r["size"]).rjust(10)
+    lines.append(header + "  exponent")
+    for key, curve in curves.items():
+        line = key.ljust(width)
+        times = dict(curve["points"])
+        for r in results:
+            if r["size"] in times:
+                line += ("%.2fms" % (times[r["size"]] * 1000)).rjust(10)
+            else:
+                line += "-".rjust(10)
+        if curve["exponent"] is not None:
+            line += "  %.2f" % curve["exponent"]
+        lines.append(line)
+    for r in results:
+        if r["error"] is not None:
+            lines.append("error at size " + str(r["size"]) + ": " + r["error"])
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure how the passes of the compilers scale."
+    )
+    parser.add_argument(
+        "--compiler",
+        action="append",
+        choices=list(compilers),
+        help="compiler to measure (default: all of them)",
+    )
+    parser.add_argument("--level", default="Lvar", choices=list(generators))
+    parser.add_argument(
+        "--knob",
+        default="statements",
+        choices=["statements", "depth", "live_vars", "functions", "iterations"],
+        help="the knob that is set to each of the sizes",
+    )
+    parser.add_argument("--sizes", default="25,50,100,200")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--statements", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--live-vars", type=int, default=8)
+    parser.add_argument("--functions", type=int, default=0)
+    parser.add_argument("--allocation-rate", type=float, default=0.0)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--memory", action="store_true", help="also record peak memory (slower)"
+    )
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(10000)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    knobs = {
+        "statements": args.statements,
+        "depth": args.depth,
+        "live_vars": args.live_vars,
+        "functions": args.functions,
+        "allocation_rate": args.allocation_rate,
+        "iterations": args.iterations,
+        "seed": args.seed,
+    }
+    report = []
+    for compiler_name in args.compiler or list(compilers):
+        results = run_benchmark(
+            compilers[compiler_name],
+            args.level,
+            sizes,
+            args.knob,
+            args.repeat,
+            args.memory,
+            **knobs
+        )
+        print(format_report(compiler_name, args.level, args.knob, results))
+        report.append(
+            {
+                "compiler": compiler_name,
+                "level": args.level,
+                "knob": args.knob,
+                "knobs": knobs,
+                "results": results,
+                "scaling": scaling(results),
+            }
+        )
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from sys import platform
+
+# Building the executables of the test programs: the runtime is
+# recompiled when runtime.c changes, and the executables are cached by
+# the hash of their assembly code and of runtime.o, so that a test is
+# only assembled and linked again when its generated code changed.
+
+
+def gcc_command():
+    if platform == "darwin":
+        return ["gcc", "-arch", "x86_64"]
+    else:
+        return ["gcc"]
+
+
+def is_stale(target, sources):
+    if not os.path.exists(target):
+        return True
+    target_time = os.path.getmtime(target)
+    return any(os.path.exists(s) and os.path.getmtime(s) > target_time for s in sources)
+
+
+# Recompiles runtime.o from runtime.c when it is missing or older than
+# runtime.c or runtime.h.
+def ensure_runtime(runtime_c="runtime.c", runtime_o="runtime.o"):
+    runtime_h = os.path.splitext(runtime_c)[0] + ".h"
+    if is_stale(runtime_o, [runtime_c, runtime_h]):
+        # compile to a temporary name first so that a concurrent link
+        # never sees a half-written runtime.o
+        fd, tmp = tempfile.mkstemp(
+            suffix=".o", dir=os.path.dirname(os.path.abspath(runtime_o))
+        )
+        os.close(fd)
+        subprocess.run(
+            gcc_command() + ["-c", "-g", "-std=c99", runtime_c, "-o", tmp],
+            check=True,
+        )
+        os.replace(tmp, runtime_o)
+    return runtime_o
+
+
+# Returns the executable, or None if gcc failed to build it.
+def link_executable(x86_filename, executable, runtime_o="runtime.o"):
+    result = subprocess.run(gcc_command() + [runtime_o, x86_filename, "-o", executable])
+    if result.returncode != 0:
+        return None
+    return executable
+
+
+class BuildCache:
+    def __init__(self, directory=".test_cache/builds", runtime_o="runtime.o"):
+        self.directory = directory
+        self.runtime_o = os.path.abspath(ensure_runtime(runtime_o=runtime_o))
+        with open(self.runtime_o, "rb") as f:
+            self.runtime_digest = hashlib.sha256(f.read()).hexdigest()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, x86_filename):
+        h = hashlib.sha256(self.runtime_digest.encode("utf-8"))
+        with open(x86_filename, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    # Returns the path of the executable for the given assembly file,
+    # linking it only if it is not in the cache yet, or None if it
+    # could not be built.
+    def executable(self, x86_filename):
+        return self.build_all([x86_filename])[x86_filename]
+
+    # Returns a dictionary from each assembly file to the path of its
+    # executable, or to None if it could not be built. All the files
+    # that are not in the cache yet are assembled by a single gcc
+    # invocation and then linked.
+    def build_all(self, x86_filenames):
+        keys = {}
+        missing = {}
+        for x86_filename in x86_filenames:
+            key = keys[x86_filename] = self.key(x86_filename)
+            if not os.path.exists(self.path(key)):
+                missing[key] = x86_filename
+        if missing:
+            self.build(missing)
+        return {
+            x86_filename: self.path(key) if os.path.exists(self.path(key)) else None
+            for x86_filename, key in keys.items()
+        }
+
+    # Assembles and links the given assembly files (by key) into the
+    # cache. A file that gcc fails to assemble or link is left out.
+    def build(self, missing):
+        with tempfile.TemporaryDirectory(dir=self.directory) as scratch:
+            for key, x86_filename in missing.items():
+                shutil.copyfile(x86_filename, os.path.join(scratch, key + ".s"))
+            subprocess.run(
+                gcc_command() + ["-c"] + [key + ".s" for key in missing],
+                cwd=scratch,
+            )
+            for key in missing:
+                object_file = os.path.join(scratch, key + ".o")
+                if not os.path.exists(object_file):
+                    continue
+                executable = os.path.join(scratch, key)
+                if link_executable(object_file, executable, self.runtime_o):
+                    os.replace(executable, self.path(key))
@@ -0,0 +1,442 @@
+import argparse
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# A long-lived compile server. Starting a run of the tests costs the
+# Python startup, importing utils, lark and all the interpreters and
+# type checkers, and building the LALR parsers of the x86 emulator.
+# The server pays that once and then serves compile and test requests
+# from editors, CI scripts or the command line:
+#
+#   python compile_server.py serve                 (on a Unix socket)
+#   python compile_server.py serve --stdio         (on stdin/stdout)
+#   python compile_server.py test tests/var/add.py
+#   python compile_server.py run-tests var --jobs 8
+#   python compile_server.py shutdown
+#
+# The protocol is one JSON object per line. A request has an "op" and
+# the arguments of that operation (see `operations` below), and
+# optionally an "id" that is copied into every response. The server
+# answers with any number of events
+#
+#   {"event": "output", "text": ...}     what the driver printed
+#   {"event": "trace", "text": ...}      trace messages, if requested
+#   {"event": "artifact", "name": ..., "text": ...}   e.g. the .s file
+#
+# followed by {"event": "done", "result": ...} or
+# {"event": "done", "error": ...}.
+#
+# The compiler of a request is given as "module.Class" and is imported
+# by the server. When the source of a compiler module changes, it is
+# reloaded before the next request, so the server can be kept running
+# while the compiler is being worked on. Requests are served one at a
+# time, since the driver uses global state (sys.stdout, utils.name_id).
+
+default_socket = ".compile_server.sock"
+
+server_directory = os.path.dirname(os.path.abspath(__file__))
+
+# The modules imported by warm_up are kept as they are; only the
+# modules imported later (the compilers) are reloaded.
+startup_modules = set()
+module_mtimes = {}
+
+
+# Imports everything that the requests need, so that they don't pay
+# for it. (The client doesn't call this, so it starts quickly.)
+def warm_up():
+    global startup_modules
+    sys.path.append(os.path.join(server_directory, "interp_x86"))
+    import build_cache
+    import eval_x86
+    import pass_cache
+    import pass_pipeline
+    import pass_profiler
+    import utils
+
+    for lang, config in languages.items():
+        config()
+    startup_modules = set(sys.modules)
+
+
+# The type checkers and interpreters for each language, as in run-tests.py.
+def var_config():
+    import eval_x86
+    import interp_Lvar
+    import type_check_Lvar
+
+    type_check = type_check_Lvar.TypeCheckLvar().type_check
+    interp = interp_Lvar.InterpLvar().interp
+    type_check_dict = {
+        "source": type_check,
+        "remove_complex_operands": type_check,
+    }
+    interp_dict = {
+        "remove_complex_operands": interp,
+        "select_instructions": eval_x86.interp_x86,
+        "assign_homes": eval_x86.interp_x86,
+        "patch_instructions": eval_x86.interp_x86,
+    }
+    return type_check_dict, interp_dict
+
+
+languages = {"var": var_config}
+
+
+def module_mtime(module):
+    filename = getattr(module, "__file__", None)
+    if filename is None or not os.path.exists(filename):
+        return None
+    return os.path.getmtime(filename)
+
+
+def record_module_mtimes():
+    for name, module in list(sys.modules.items()):
+        if name not in startup_modules:
+            module_mtimes[name] = module_mtime(module)
+
+
+# Imports the module of a compiler, first reloading the compiler
+# modules whose source changed. The requested module is reloaded last,
+# so that it sees the reloaded versions of the modules it imports.
+def load_module(module_name):
+    if module_name in sys.modules and module_name not in startup_modules:
+        stale = [
+            name
+            for name, mtime in module_mtimes.items()
+            if name in sys.modules and module_mtime(sys.modules[name]) != mtime
+        ]
+        if stale:
+            for name in [n for n in stale if n != module_name] + [module_name]:
+                importlib.reload(sys.modules[name])
+    module = importlib.import_module(module_name)
+    record_module_mtimes()
+    return module
+
+
+def load_compiler(spec):
+    module_name, class_name = spec.rsplit(".", 1)
+    return getattr(load_module(module_name), class_name)()
+
+
+# A file-like object that sends what is written to it as events,
+# one line at a time.
+class EventStream(io.TextIOBase):
+    def __init__(self, connection, event):
+        self.connection = connection
+        self.event = event
+        self.buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.buffer += text
+        if "\n" in self.buffer:
+            lines, self.buffer = self.buffer.rsplit("\n", 1)
+            self.connection.send({"event": self.event, "text": lines + "\n"})
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.connection.send({"event": self.event, "text": self.buffer})
+            self.buffer = ""
+
+
+class TraceEventSink:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, text):
+        self.connection.send({"event": "trace", "text": text + "\n"})
+
+
+class Connection:
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.request_id = None
+
+    def send(self, message):
+        if self.request_id is not None:
+            message["id"] = self.request_id
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def send_artifact(self, filename):
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.send({"event": "artifact", "name": filename, "text": f.read()})
+
+
+# Runs a request in its working directory, with the output of the
+# driver (and its trace messages, if asked for) sent as events. The
+# global state is restored afterwards, also when the request fails.
+@contextmanager
+def request_context(request, connection):
+    import utils
+
+    saved_cwd = os.getcwd()
+    saved_stdout = sys.stdout
+    saved_tracing = (utils.tracing, utils.trace_level, utils.trace_sinks)
+    output = EventStream(connection, "output")
+    try:
+        os.chdir(request.get("cwd", saved_cwd))
+        sys.stdout = output
+        if request.get("trace"):
+            utils.enable_tracing(
+                request.get("trace_level", utils.trace_debug),
+                TraceEventSink(connection),
+            )
+        else:
+            utils.disable_tracing()
+        yield
+    finally:
+        output.flush()
+        sys.stdout = saved_stdout
+        utils.tracing, utils.trace_level, utils.trace_sinks = saved_tracing
+        os.chdir(saved_cwd)
+
+
+def language_config(request):
+    lang = request.get("lang", "var")
+    if lang not in languages:
+        raise Exception("unknown language " + lang)
+    return lang, languages[lang]()
+
+
+def op_ping(request, connection):
+    return {"pid": os.getpid(), "languages": list(languages)}
+
+
+def op_compile(request, connection):
+    from utils import compile
+
+    lang, (type_check_dict, interp_dict) = language_config(request)
+    filename = request["file"]
+    compile(
+        load_compiler(request.get("compiler", "compiler.Compiler")),
+        request.get("name", lang),
+        type_check_dict["source"],
+        None,
+        filename,
+        stop_at=request.get("stop_at"),
+    )
+    connection.send_artifact(os.path.splitext(filename)[0] + ".s")
+    return {}
+
+
+def op_test(request, connection):
+    from utils import compile_and_test
+
+    lang, (type_check_dict, interp_dict) = language_config(request)
+    filename = request["file"]
+    successful_passes, total_passes, successful_test = compile_and_test(
+        load_compiler(request.get("compiler", "compiler.Compiler")),
+        request.get("name", lang),
+        type_check_dict,
+        interp_dict,
+        filename,
+        cache_dir=request.get("cache_dir"),
+        stop_at=request.get("stop_at"),
+        skip_verification=request.get("skip_verification", False),
+    )
+    if request.get("artifacts"):
+        connection.send_artifact(os.path.splitext(filename)[0] + ".s")
+    return {
+        "successful_passes": successful_passes,
+        "total_passes": total_passes,
+        "successful_test": successful_test,
+    }
+
+
+def op_run_tests(request, connection):
+    from utils import run_tests
+
+    lang, (type_check_dict, interp_dict) = language_config(request)
+    successful_tests, total_tests, successful_passes, total_passes = run_tests(
+        lang,
+        load_compiler(request.get("compiler", "compiler.Compiler")),
+        request.get("name", lang),
+        type_check_dict,
+        interp_dict,
+        jobs=request.get("jobs", 1),
+        cache_dir=request.get("cache_dir"),
+        batch_link=request.get("batch_link", False),
+    )
+    return {
+        "successful_tests": successful_tests,
+        "total_tests": total_tests,
+        "successful_passes": successful_passes,
+        "total_passes": total_passes,
+    }
+
+
+class ShutdownRequest(Exception):
+    pass
+
+
+def op_shutdown(request, connection):
+    raise ShutdownRequest()
+
+
+operations = {
+    "ping": op_ping,
+    "compile": op_compile,
+    "test": op_test,
+    "run_tests": op_run_tests,
+    "shutdown": op_shutdown,
+}
+
+
+# Serves the requests of one connection until it is closed. Returns
+# False when the server was asked to shut down.
+def serve_connection(connection):
+    for line in connection.rfile:
+        if not line.strip():
+            continue
+        connection.request_id = None
+        try:
+            request = json.loads(line)
+            connection.request_id = request.get("id")
+            op = request.get("op")
+            if op not in operations:
+                raise Exception("unknown operation " + repr(op))
+            start = time.perf_counter()
+            with request_context(request, connection):
+                result = operations[op](request, connection)
+            result["time"] = time.perf_counter() - start
+            connection.send({"event": "done", "result": result})
+        except ShutdownRequest:
+            connection.send({"event": "done", "result": {}})
+            return False
+        except Exception as e:
+            connection.send({"event": "done", "error": repr(e)})
+    return True
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if not serve_connection(Connection(self.rfile, self.wfile)):
+            # shutdown() waits for serve_forever to return, so it can't
+            # be called from the thread that is serving
+            threading.Thread(target=self.server.shutdown).start()
+
+
+def serve_socket(socket_path):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with socketserver.UnixStreamServer(socket_path, RequestHandler) as server:
+        print("compile server listening on " + socket_path, file=sys.stderr)
+        try:
+            server.serve_forever(poll_interval=0.1)
+        finally:
+            os.unlink(socket_path)
+
+
+# The protocol uses the original stdout, and file descriptor 1 is
+# pointed to stderr so that the output of subprocesses such as gcc
+# can't get mixed into it.
+def serve_stdio():
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve_connection(Connection(sys.stdin.buffer, protocol_out))
+
+
+################################################################################
+# Client
+################################################################################
+
+
+# Sends a request to the server and yields the events of the response,
+# the last one being the "done" event.
+def request(message, socket_path=default_socket):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        with s.makefile("rwb") as f:
+            f.write((json.dumps(message) + "\n").encode("utf-8"))
+            f.flush()
+            for line in f:
+                event = json.loads(line)
+                yield event
+                if event["event"] == "done":
+                    return
+
+
+def run_client(message, socket_path):
+    status = 1
+    for event in request(message, socket_path):
+        match event["event"]:
+            case "output":
+                sys.stdout.write(event["text"])
+            case "trace":
+                sys.stderr.write(event["text"])
+            case "artifact":
+                print("artifact: " + event["name"], file=sys.stderr)
+            case "done":
+                if "error" in event:
+                    print("error: " + event["error"], file=sys.stderr)
+                else:
+                    print(json.dumps(event["result"]), file=sys.stderr)
+                    status = 0
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile server and client.")
+    parser.add_argument("--socket", default=default_socket)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve")
+    serve.add_argument("--stdio", action="store_true")
+    commands.add_parser("ping")
+    commands.add_parser("shutdown")
+    for name in ["compile", "test"]:
+        command = commands.add_parser(name)
+        command.add_argument("file")
+        command.add_argument("--lang", default="var")
+        command.add_argument("--compiler", default="compiler.Compiler")
+        command.add_argument("--stop-at")
+        command.add_argument("--trace", action="store_true")
+    command = commands.add_parser("run-tests")
+    command.add_argument("lang")
+    command.add_argument("--compiler", default="compiler.Compiler")
+    command.add_argument("--jobs", type=int, default=1)
+    command.add_argument("--cache-dir")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        warm_up()
+        if args.stdio:
+            serve_stdio()
+        else:
+            serve_socket(args.socket)
+        return 0
+    message = {"op": args.command.replace("-", "_"), "cwd": os.getcwd()}
+    if args.command in ["compile", "test"]:
+        message.update(
+            file=os.path.abspath(args.file),
+            lang=args.lang,
+            compiler=args.compiler,
+            stop_at=args.stop_at,
+            trace=args.trace,
+        )
+    elif args.command == "run-tests":
+        message.update(
+            lang=args.lang,
+            compiler=args.compiler,
+            jobs=args.jobs,
+            cache_dir=args.cache_dir,
+        )
+    return run_client(message, args.socket)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
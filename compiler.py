@@ -26,7 +26,7 @@ class Compiler:
                 else:
                     return Call(Name("input_int"), []), []
             case UnaryOp(USub(), exp):
-                (atm, temps) = self.rco_exp(exp, True)
+                atm, temps = self.rco_exp(exp, True)
                 usub = UnaryOp(USub(), atm)
                 if need_atomic:
                     tmp = Name(generate_name("tmp"))
@@ -34,8 +34,8 @@ class Compiler:
                 else:
                     return usub, temps
             case BinOp(exp1, Add(), exp2):
-                (atm1, temps1) = self.rco_exp(exp1, True)
-                (atm2, temps2) = self.rco_exp(exp2, True)
+                atm1, temps1 = self.rco_exp(exp1, True)
+                atm2, temps2 = self.rco_exp(exp2, True)
                 add = BinOp(atm1, Add(), atm2)
                 if need_atomic:
                     tmp = Name(generate_name("tmp"))
@@ -43,8 +43,8 @@ class Compiler:
                 else:
                     return add, temps1 + temps2
             case BinOp(exp1, Sub(), exp2):
-                (atm1, temps1) = self.rco_exp(exp1, True)
-                (atm2, temps2) = self.rco_exp(exp2, True)
+                atm1, temps1 = self.rco_exp(exp1, True)
+                atm2, temps2 = self.rco_exp(exp2, True)
                 sub = BinOp(atm1, Sub(), atm2)
                 if need_atomic:
                     tmp = Name(generate_name("tmp"))
@@ -59,15 +59,15 @@ class Compiler:
     def rco_stmt(self, s: stmt) -> List[stmt]:
         match s:
             case Expr(Call(Name("print"), [exp])):
-                (atm, temps) = self.rco_exp(exp, True)
+                atm, temps = self.rco_exp(exp, True)
                 return [Assign([var], init) for (var, init) in temps] + [
                     Expr(Call(Name("print"), [atm]))
                 ]
             case Expr(exp):
-                (atm, temps) = self.rco_exp(exp, False)
+                atm, temps = self.rco_exp(exp, False)
                 return [Assign([var], init) for (var, init) in temps]
             case Assign([Name(var)], exp):
-                (atm, temps) = self.rco_exp(exp, False)
+                atm, temps = self.rco_exp(exp, False)
                 return [Assign([x], init) for (x, init) in temps] + [
                     Assign([Name(var)], atm)
                 ]
@@ -98,7 +98,7 @@ class Compiler:
                 arg = self.select_arg(atm)
                 return [
                     Instr("movq", (arg, Reg("rdi"))),
-                    Callq(label_name("print_int"), 1)
+                    Callq(label_name("print_int"), 1),
                 ]
             case Assign([Name(var)], exp):
                 arg = self.select_arg(Name(var))
@@ -131,6 +131,8 @@ class Compiler:
                             Instr("subq", (arg2, Reg("rax"))),
                             Instr("movq", (Reg("rax"), arg)),
                         ]
+                    case Constant(_) | Name(_):
+                        return [Instr("movq", (self.select_arg(exp), arg))]
             case _:
                 raise Exception("select_stmt not implemented")
 
@@ -222,7 +224,7 @@ class Compiler:
 
         # x86-64 requires stack pointer to be 16-byte aligned in prelude
         if max_offset % 16 != 0:
-            max_offset += (16 - max_offset % 16)
+            max_offset += 16 - max_offset % 16
 
         prelude = [
             Instr("pushq", (Reg("rbp"),)),
@@ -3,7 +3,7 @@ from graph import UndirectedAdjList
 from typing import List, Tuple, Set, Dict
 from ast import *
 from x86_ast import *
-from typing import Set, Dict, Tuple
+from typing import List, Set, Dict, Tuple
 
 from priority_queue import PriorityQueue
 
@@ -102,7 +102,7 @@ class Compiler(compiler.Compiler):
         num_variables = len(variables)
         while len(coloring) < num_variables:
             # select max saturated variable
-            comparator = lambda x, y: len(x) < len(y)
+            comparator = lambda x, y: len(saturations[x.key]) < len(saturations[y.key])
             pqueue = PriorityQueue(comparator)
             for v in variables:
                 if v not in coloring:
@@ -122,7 +122,7 @@ class Compiler(compiler.Compiler):
         return coloring, variables
 
     def allocate_registers(self, p: X86Program, graph: UndirectedAdjList) -> X86Program:
-        variables = set(graph.vertices)
+        variables = set(graph.vertices())
         coloring, _ = self.color_graph(graph, variables)
 
         # get assignments
@@ -108,7 +108,7 @@ class InterpLdyn(InterpLlambda):
                 l = self.interp_exp(left, env)
                 match self.untag(l, "bool", e):
                     case True:
-                        return True
+                        return self.tag(True)
                     case False:
                         return self.interp_exp(right, env)
             case Compare(left, [cmp], [right]):
@@ -155,7 +155,7 @@ class InterpLdyn(InterpLlambda):
             case While(test, body, []):
                 v = self.interp_exp(test, env)
                 if self.untag(v, "bool", test):
-                    self.interp_stmts(body + [s] + cont, env)
+                    return self.interp_stmts(body + [s] + cont, env)
                 else:
                     return self.interp_stmts(cont, env)
 
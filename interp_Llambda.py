@@ -45,6 +45,8 @@ class InterpLlambda(InterpLfun):
             case FunRef(id, arity):
                 return env[id]
             case Lambda(params, body):
+                if isinstance(params, arguments):
+                    params = [p.arg for p in params.args]
                 return Function("lambda", params, [Return(body)], env)
             case UncheckedCast(exp, ty):
                 return self.interp_exp(exp, env)
@@ -9,7 +9,7 @@ class InterpLwhile(InterpLif):
         match s:
             case While(test, body, []):
                 if self.interp_exp(test, env):
-                    self.interp_stmts(body + [s] + cont, env)
+                    return self.interp_stmts(body + [s] + cont, env)
                 else:
                     return self.interp_stmts(cont, env)
             case _:
@@ -0,0 +1,286 @@
+import gc
+import re
+
+from x86_ast import (
+    ByteReg,
+    Callq,
+    Deref,
+    Global,
+    Immediate,
+    IndirectCallq,
+    IndirectJump,
+    Instr,
+    Jump,
+    JumpIf,
+    Reg,
+    Variable,
+)
+
+# A parser for the AT&T syntax that parser_x86 accepts, written by hand
+# for this small instruction set: the text is split into tokens by one
+# regular expression and parsed by recursive descent straight into
+# x86_ast instructions, which the emulator decodes like the programs of
+# the compiler (Decoder.decode_ast_block). It is much faster than going
+# through the Lark lexer and LALR parser and building parse trees.
+#
+# With check, the text is also parsed into x86_ast by the Lark parser
+# (parser_x86.x86_ast_parser) and the two results are compared, and a
+# difference is an error.
+
+token = re.compile(r"[A-Za-z_][A-Za-z_0-9]*|[0-9]+|\S")
+
+two_operands = {
+    "movq",
+    "addq",
+    "subq",
+    "cmpq",
+    "xorq",
+    "andq",
+    "testq",
+    "sarq",
+    "leaq",
+    "movzbq",
+}
+
+one_operand = {
+    "negq",
+    "pushq",
+    "popq",
+    "sete",
+    "setne",
+    "setl",
+    "setle",
+    "setg",
+    "setge",
+}
+
+jumps = {"je", "jne", "jl", "jle", "jg", "jge"}
+
+mnemonics = two_operands | one_operand | jumps | {"jmp", "callq", "retq"}
+
+registers = {
+    "rsp",
+    "rbp",
+    "rax",
+    "rbx",
+    "rcx",
+    "rdx",
+    "rsi",
+    "rdi",
+    "r8",
+    "r9",
+    "r10",
+    "r11",
+    "r12",
+    "r13",
+    "r14",
+    "r15",
+    "al",
+    "rip",
+}
+
+# The arguments are immutable, so each register is one shared object.
+register_args = {r: ByteReg(r) if r == "al" else Reg(r) for r in registers}
+
+
+class AsmParser:
+    def __init__(self, text):
+        self.tokens = token.findall(text)
+        self.end = len(self.tokens)
+        # an empty token after the end, so that looking at the next
+        # token never fails
+        self.tokens.append("")
+        self.i = 0
+
+    def error(self, expected):
+        near = " ".join(self.tokens[max(self.i - 3, 0) : self.i + 3])
+        found = repr(self.tokens[self.i]) if self.i < self.end else "end of input"
+        raise Exception(f"asm: expected {expected}, found {found} near {near!r}")
+
+    def next(self):
+        if self.i >= self.end:
+            self.error("more input")
+        t = self.tokens[self.i]
+        self.i += 1
+        return t
+
+    def expect(self, t):
+        if self.tokens[self.i] != t:
+            self.error(repr(t))
+        self.i += 1
+
+    def name(self):
+        t = self.tokens[self.i]
+        if not (t[:1].isalpha() or t[:1] == "_"):
+            self.error("a name")
+        self.i += 1
+        return t
+
+    def number(self):
+        t = self.tokens[self.i]
+        if not t.isdigit():
+            self.error("a number")
+        self.i += 1
+        return t
+
+    # The blocks by label. Like the parse trees of the Lark parser, a
+    # directive is a block without instructions (named after its
+    # argument).
+    def program(self):
+        blocks = {}
+        while self.i < self.end:
+            if self.tokens[self.i] == ".":
+                self.i += 1
+                directive = self.next()
+                if directive == "globl":
+                    blocks[self.name()] = []
+                elif directive == "align":
+                    blocks[self.number()] = []
+                else:
+                    self.error("a directive")
+            elif self.tokens[self.i] in mnemonics:
+                self.error("a label before the instruction")
+            else:
+                label = self.name()
+                if self.tokens[self.i] != ":":
+                    self.i -= 1
+                    self.error("an instruction or a label")
+                self.i += 1
+                blocks[label] = self.instrs()
+        return blocks
+
+    # The instructions up to the next label or directive.
+    def instrs(self):
+        tokens = self.tokens
+        instr = self.instr
+        instrs = []
+        while tokens[self.i] in mnemonics:
+            instrs.append(instr())
+        return instrs
+
+    def instr(self):
+        name = self.tokens[self.i]
+        self.i += 1
+        if name in two_operands:
+            a1 = self.arg()
+            if self.tokens[self.i] != ",":
+                self.error("','")
+            self.i += 1
+            return Instr(name, [a1, self.arg()])
+        elif name in one_operand:
+            return Instr(name, [self.arg()])
+        elif name in jumps:
+            return JumpIf(name[1:], self.name())
+        elif name == "jmp":
+            if self.tokens[self.i] == "*":
+                self.i += 1
+                return IndirectJump(self.arg())
+            return Jump(self.name())
+        elif name == "callq":
+            if self.tokens[self.i] == "*":
+                self.i += 1
+                return IndirectCallq(self.arg(), 0)
+            return Callq(self.name(), 0)
+        else:
+            return Instr("retq", [])
+
+    def arg(self):
+        t = self.tokens[self.i]
+        if t == "%":
+            self.i += 1
+            return self.register()
+        elif t == "$":
+            self.i += 1
+            return Immediate(self.atom())
+        elif t == "#":
+            self.i += 1
+            return Variable(self.name())
+        elif t == "(":
+            return Deref(self.base().id, 0)
+        elif t == "-" or t.isdigit():
+            offset = self.atom()
+            return Deref(self.base().id, offset)
+        else:
+            name = self.name()
+            if self.base().id != "rip":
+                self.error("%rip")
+            return Global(name)
+
+    def atom(self):
+        if self.tokens[self.i] == "-":
+            self.i += 1
+            return -self.atom()
+        return int(self.number())
+
+    def register(self):
+        reg = register_args.get(self.tokens[self.i])
+        if reg is None:
+            self.error("a register")
+        self.i += 1
+        return reg
+
+    # "(%reg)"
+    def base(self):
+        self.expect("(")
+        self.expect("%")
+        reg = self.register()
+        self.expect(")")
+        return reg
+
+
+# Parsing allocates many objects but no cycles, so the cyclic garbage
+# collector is paused (like in Decoder.decode_block).
+def parse_program(text, check=False):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        blocks = AsmParser(text).program()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if check:
+        from parser_x86 import x86_ast_parser
+
+        compare_blocks(blocks, x86_ast_parser.parse(text))
+    return blocks
+
+
+def parse_instrs(text, check=False):
+    parser = AsmParser(text)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        instrs = parser.instrs()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if parser.i < parser.end:
+        parser.error("an instruction")
+    if check:
+        from parser_x86 import x86_ast_parser_instrs
+
+        expected = x86_ast_parser_instrs.parse(text)
+        compare_blocks({"instrs": instrs}, {"instrs": expected})
+    return instrs
+
+
+# The x86_ast dataclasses of instructions compare by identity, so the
+# blocks are compared by their repr.
+def compare_blocks(blocks, expected):
+    if list(blocks.keys()) != list(expected.keys()):
+        raise Exception(
+            f"asm: labels {list(blocks.keys())} differ from the Lark parser's "
+            + f"{list(expected.keys())}"
+        )
+    for label, instrs in blocks.items():
+        for i, (a, b) in enumerate(zip(instrs, expected[label])):
+            if repr(a) != repr(b):
+                raise Exception(
+                    f"asm: instruction {i} of {label} is {a!r}, "
+                    + f"the Lark parser's is {b!r}"
+                )
+        if len(instrs) != len(expected[label]):
+            raise Exception(
+                f"asm: {label} has {len(instrs)} instructions, "
+                + f"the Lark parser's has {len(expected[label])}"
+            )
@@ -0,0 +1,428 @@
+# Decoding of x86 programs for the emulator. Each instruction, either
+# of a parse tree (for .s files) or of an x86_ast program (as produced
+# by the compiler passes), is turned once into a DecodedInstr that holds the id of its
+# opcode (an index into the emulator's dispatch table) and operand
+# accessors that are bound to the emulator's state, so that executing
+# an instruction doesn't look at the parse tree or convert tokens to
+# strings again.
+
+import gc
+import operator
+from dataclasses import dataclass
+
+from memory_x86 import byte_registers, page_bits, page_mask, register_ids, unaligned
+from utils import GlobalValue, is_int64, neg64
+from x86_ast import (
+    Callq,
+    Deref,
+    Global,
+    Immediate,
+    IndirectCallq,
+    IndirectJump,
+    Instr,
+    Jump,
+    JumpIf,
+    Reg,
+    TailJump,
+    Variable,
+)
+
+opcodes = [
+    "movq",
+    "movzbq",
+    "addq",
+    "subq",
+    "xorq",
+    "andq",
+    "sarq",
+    "negq",
+    "cmpq",
+    "testq",
+    "leaq",
+    "pushq",
+    "popq",
+    "jmp",
+    "je",
+    "jne",
+    "jl",
+    "jle",
+    "jg",
+    "jge",
+    "sete",
+    "setne",
+    "setl",
+    "setle",
+    "setg",
+    "setge",
+    "callq",
+    "indirect_callq",
+    "indirect_jmp",
+    "retq",
+    # ends a block that doesn't end with a jump or return (added by the
+    # emulator, not decoded); it returns like retq
+    "end",
+    # a cmpq and the jcc after it, fused by the decoder
+    "cmpq_jcc",
+    # the first instruction of a block of a file that is not decoded
+    # yet (see X86Emulator.eval_file)
+    "load_block",
+]
+
+opcode_ids = {name: i for i, name in enumerate(opcodes)}
+
+# The flags are evaluated lazily: the instructions that set them only
+# record the two values that they compare (for cmpq, the second
+# operand and the first; for the others, the result and 0), and each
+# condition code is the comparison of these values.
+conditions = {
+    "e": operator.eq,
+    "ne": operator.ne,
+    "l": operator.lt,
+    "le": operator.le,
+    "g": operator.gt,
+    "ge": operator.ge,
+}
+
+
+@dataclass(eq=False, slots=True)
+class Operand:
+    kind: str
+    load: object
+    store: object
+    # what the operand refers to, for the translator: (register, is
+    # byte register), (variable slot,), (value,), (register, offset)
+    # or (global name,)
+    detail: tuple = ()
+
+
+@dataclass(eq=False, slots=True)
+class DecodedInstr:
+    op: int
+    name: str
+    args: tuple
+    # the label of a jump or call (or of the block that load_block
+    # decodes)
+    target: str = None
+    # the comparison of the flags for which a jcc jumps or a setcc sets
+    cond: object = None
+    # the instruction it was decoded from, for logging
+    source: object = None
+    # filled in when the instruction is laid out in the emulator's code:
+    # the index of the next instruction and of the target of a jump or call
+    next: int = -1
+    jump: int = -1
+
+    def __str__(self):
+        if self.source is None:
+            return self.name
+        if isinstance(self.source, tuple):
+            return "; ".join(str(s) for s in self.source)
+        if hasattr(self.source, "pretty"):
+            return self.source.pretty()
+        return str(self.source)
+
+    # The instruction in AT&T syntax, on one line.
+    def text(self):
+        if self.source is None:
+            return self.name
+        if isinstance(self.source, tuple):
+            return "; ".join(s.text() for s in self.source)
+        if hasattr(self.source, "data"):
+            return tree_text(self.source)
+        return str(self.source).strip()
+
+
+def tree_text(t):
+    if not hasattr(t, "data"):
+        return str(t)
+    args = t.children
+    match t.data:
+        case "reg_a":
+            return "%" + str(args[0])
+        case "var_a":
+            return "#" + str(args[0])
+        case "int_a":
+            if hasattr(args[0], "data"):
+                return "$" + tree_text(args[0])
+            return str(args[0])
+        case "neg_a":
+            return "-" + tree_text(args[0]).lstrip("$")
+        case "mem_a":
+            return tree_text(args[0]).lstrip("$") + "(%" + str(args[1]) + ")"
+        case "direct_mem_a":
+            return "(%" + str(args[0]) + ")"
+        case "global_val_a":
+            return str(args[0]) + "(%" + str(args[1]) + ")"
+        case "indirect_callq":
+            return "callq *" + tree_text(args[0])
+        case "indirect_jmp":
+            return "jmp *" + tree_text(args[0])
+        case name:
+            return (name + " " + ", ".join(tree_text(a) for a in args)).strip()
+
+
+def immediate(value):
+    v = int(value)
+    if not is_int64(v):
+        raise Exception("eval_imm: invalid immediate:", v)
+    return v
+
+
+def cannot_store(kind):
+    def store(v):
+        raise RuntimeError("Unknown arg in store_arg: " + kind)
+
+    return store
+
+
+def arg_key(a):
+    children = a.children
+    if len(children) == 1 and not hasattr(children[0], "data"):
+        return (a.data, children[0])
+    return (a.data,) + tuple(arg_key(c) if hasattr(c, "data") else c for c in children)
+
+
+class Decoder:
+    def __init__(self, emulator):
+        self.emulator = emulator
+        # Programs use few distinct operands, so the accessors of each
+        # one are made once and shared by all the instructions using it.
+        self.operands = {}
+
+    # Decoding allocates many long-lived objects but no cycles, so the
+    # cyclic garbage collector is paused instead of letting it rescan
+    # the whole program again and again.
+    def decode_block(self, instrs):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.fuse([self.decode_instr(instr) for instr in instrs])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def decode_ast_block(self, instrs):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.fuse([self.decode_ast_instr(instr) for instr in instrs])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def instruction(self, name, args=(), target=None, source=None):
+        if name not in opcode_ids:
+            raise RuntimeError(f"Unknown instruction: {name}")
+        if name.startswith("set"):
+            cond = conditions.get(name[3:])
+        elif name.startswith("j"):
+            cond = conditions.get(name[1:])
+        else:
+            cond = None
+        return DecodedInstr(opcode_ids[name], name, args, target, cond, source)
+
+    # Replaces each cmpq that is followed by a jcc by a cmpq_jcc, which
+    # sets the flags and jumps in one dispatch. The jcc can't be the
+    # target of a jump, as only blocks are.
+    def fuse(self, block):
+        cmpq = opcode_ids["cmpq"]
+        fused = []
+        i = 0
+        while i < len(block):
+            instr = block[i]
+            if (
+                instr.op == cmpq
+                and i + 1 < len(block)
+                and block[i + 1].name[0] == "j"
+                and block[i + 1].cond is not None
+            ):
+                jcc = block[i + 1]
+                fused.append(
+                    DecodedInstr(
+                        opcode_ids["cmpq_jcc"],
+                        "cmpq_jcc",
+                        instr.args,
+                        jcc.target,
+                        jcc.cond,
+                        (instr, jcc),
+                    )
+                )
+                i += 2
+            else:
+                fused.append(instr)
+                i += 1
+        return fused
+
+    ############################################################################
+    # Operands
+    ############################################################################
+
+    def operand(self, key, make, *args):
+        operand = self.operands.get(key)
+        if operand is None:
+            operand = make(*args)
+            self.operands[key] = operand
+        return operand
+
+    def register_operand(self, name):
+        registers = self.emulator.registers
+        if name in byte_registers:
+            r = register_ids[byte_registers[name]]
+
+            def store(v):
+                registers[r] = (registers[r] & ~0xFF) | (v & 0xFF)
+
+            return Operand("reg", lambda: registers[r] & 0xFF, store, (r, True))
+        if name not in register_ids:
+            raise RuntimeError(f"Unknown register: {name}")
+        r = register_ids[name]
+
+        def store(v):
+            registers[r] = v
+
+        return Operand("reg", lambda: registers[r], store, (r, False))
+
+    # The variables are numbered in the order they are first decoded.
+    def variable_operand(self, name):
+        emulator = self.emulator
+        variables = emulator.variables
+        if name not in emulator.variable_slots:
+            emulator.variable_slots[name] = len(variables)
+            variables.append(0)
+        slot = emulator.variable_slots[name]
+
+        def store(v):
+            variables[slot] = v
+
+        return Operand("var", lambda: variables[slot], store, (slot,))
+
+    def immediate_operand(self, v):
+        return Operand("imm", lambda: v, cannot_store("imm"), (v,))
+
+    def memory_operand(self, reg, offset):
+        registers = self.emulator.registers
+        pages = self.emulator.memory
+        r = register_ids[reg]
+
+        def load():
+            a = registers[r] + offset
+            if a & 7:
+                unaligned(a)
+            return pages[a >> page_bits][(a & page_mask) >> 3]
+
+        def store(v):
+            a = registers[r] + offset
+            if a & 7:
+                unaligned(a)
+            pages[a >> page_bits][(a & page_mask) >> 3] = v
+
+        return Operand("mem", load, store, (r, offset))
+
+    def global_operand(self, name):
+        emulator = self.emulator
+
+        # global_vals is replaced by initialize, so it is looked up
+        # on every access
+        def load():
+            return emulator.global_vals[name]
+
+        def store(v):
+            emulator.global_vals[name] = v
+
+        return Operand("global", load, store, (name,))
+
+    ############################################################################
+    # Parse trees
+    ############################################################################
+
+    def decode_imm(self, e):
+        if e.data == "int_a":
+            # the parser nests the int_a of a number in that of "$"
+            if hasattr(e.children[0], "data"):
+                return self.decode_imm(e.children[0])
+            return immediate(e.children[0])
+        elif e.data == "neg_a":
+            return neg64(self.decode_imm(e.children[0]))
+        else:
+            raise Exception("eval_imm: unknown immediate:", e)
+
+    def decode_arg(self, a):
+        return self.operand(arg_key(a), self.make_operand, a)
+
+    def make_operand(self, a):
+        if a.data == "reg_a":
+            return self.register_operand(str(a.children[0]))
+        elif a.data == "var_a":
+            return self.variable_operand(str(a.children[0]))
+        elif a.data in ["int_a", "neg_a"]:
+            return self.immediate_operand(self.decode_imm(a))
+        elif a.data == "mem_a":
+            offset, reg = a.children
+            return self.memory_operand(str(reg), self.decode_imm(offset))
+        elif a.data == "direct_mem_a":
+            return self.memory_operand(str(a.children[0]), 0)
+        elif a.data == "global_val_a":
+            loc, reg = a.children
+            assert str(reg) == "rip", a
+            return self.global_operand(str(loc))
+        else:
+            raise RuntimeError(f"Unknown arg in eval_arg: {a}")
+
+    def decode_instr(self, instr):
+        name = instr.data
+        if name in ["jmp", "je", "jne", "jl", "jle", "jg", "jge", "callq"]:
+            return self.instruction(name, (), str(instr.children[0]), instr)
+        args = tuple(self.decode_arg(a) for a in instr.children)
+        return self.instruction(name, args, None, instr)
+
+    ############################################################################
+    # x86_ast
+    ############################################################################
+
+    # The x86_ast arguments are hashable, so they are their own keys.
+    def decode_ast_arg(self, a):
+        match a:
+            case Reg(id):  # also ByteReg
+                return self.operand(a, self.register_operand, id)
+            case Variable(id):
+                return self.operand(a, self.variable_operand, id)
+            case Immediate(value):
+                return self.operand(a, self.immediate_operand, immediate(value))
+            case Deref(reg, offset):
+                return self.operand(a, self.memory_operand, reg, immediate(offset))
+            case Global(name):
+                return self.operand(a, self.global_operand, name)
+            case GlobalValue(name):
+                return self.operand(
+                    ("global", str(name)), self.global_operand, str(name)
+                )
+            case _:
+                raise RuntimeError(f"Unknown arg in eval_arg: {a}")
+
+    def decode_ast_instr(self, instr):
+        match instr:
+            case Instr(name, args):
+                return self.instruction(
+                    name, tuple(self.decode_ast_arg(a) for a in args), None, instr
+                )
+            case Callq(func, num_args):
+                return self.instruction("callq", (), func, instr)
+            case IndirectCallq(func, num_args):
+                return self.instruction(
+                    "indirect_callq", (self.decode_ast_arg(func),), None, instr
+                )
+            case Jump(label):
+                return self.instruction("jmp", (), label, instr)
+            case JumpIf(cc, label):
+                return self.instruction("j" + cc, (), label, instr)
+            case IndirectJump(target):
+                return self.instruction(
+                    "indirect_jmp", (self.decode_ast_arg(target),), None, instr
+                )
+            case TailJump(func, arity):
+                # after prelude_and_conclusion this is an indirect jump
+                return self.instruction(
+                    "indirect_jmp", (self.decode_ast_arg(func),), None, instr
+                )
+            case _:
+                raise Exception("error in decode_ast_instr, unhandled " + repr(instr))
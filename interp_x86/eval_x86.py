@@ -1,88 +1,292 @@
 # Author: Joe Near
 # License: GPLv3
 
-from collections import defaultdict
-from dataclasses import dataclass
+import io
+import sys
 
 from utils import *
 
-from convert_x86 import convert_program
-from parser_x86 import x86_parser, x86_parser_instrs
-
-
-def interp_x86(program):
-    x86_program = convert_program(program)
-    emu = X86Emulator(logging=False)
-    x86_output = emu.eval_program(x86_program)
+from asm_x86 import parse_instrs, parse_program
+from decode_x86 import DecodedInstr, Decoder, opcode_ids, opcodes
+from gc_x86 import Collector
+from memory_x86 import (
+    Memory,
+    code_begin,
+    page_bits,
+    page_mask,
+    register_ids,
+    register_names,
+    rootstack_begin,
+    stack_top,
+)
+from parser_x86 import x86_ast_parser_instrs
+from profile_x86 import ExecutionProfile
+from stream_x86 import BlockFile
+from state_x86 import LoggedGlobals, LoggedMemory, LoggedRegisters, Table, WriteLog
+from translate_x86 import Translator
+from x86_ast import X86Program
+
+
+# With a profile filename, the execution profile of the program is
+# written there as JSON, and the hot-block report next to it (.txt).
+def interp_x86(program, profile=None, translate=False):
+    emu = X86Emulator(logging=False, profile=profile is not None, translate=translate)
+    x86_output = emu.eval_ast_program(program)
     for s in x86_output:
         print(s, end="")
+    if profile is not None:
+        emu.profile.write_report(profile)
+        with open(os.path.splitext(profile)[0] + ".txt", "w") as f:
+            f.write(emu.profile.hot_blocks())
+
+
+# Runs the program on each of the inputs (strings or file-like
+# objects) and returns the output of each run, or the exception that
+# ended it. With processes, the inputs are read and spread over a pool
+# of that many processes, each of which decodes the program once.
+def interp_x86_batch(program, inputs, processes=None, translate=False):
+    if processes is None:
+        emu = X86Emulator(logging=False, translate=translate)
+        return emu.eval_batch(program, inputs)
+    import multiprocessing
+
+    texts = [i if isinstance(i, str) else i.read() for i in inputs]
+    with multiprocessing.Pool(
+        processes, initializer=start_batch_worker, initargs=(program, translate)
+    ) as pool:
+        return pool.map(run_batch_worker, texts)
+
+
+# The emulator of a process of the pool of interp_x86_batch.
+batch_emulator = None
 
 
-@dataclass
-class FunPointer:
-    fun_name: str
+def start_batch_worker(program, translate):
+    global batch_emulator
+    batch_emulator = X86Emulator(logging=False, translate=translate)
+    batch_emulator.eval_batch(program, [])
+
+
+def run_batch_worker(text):
+    batch_emulator.reset()
+    return batch_emulator.eval_input(text)
+
+
+rax = register_ids["rax"]
+rdi = register_ids["rdi"]
+rsi = register_ids["rsi"]
+rsp = register_ids["rsp"]
+rbp = register_ids["rbp"]
 
 
 class X86Emulator:
-    def __init__(self, logging=True):
-        self.registers = defaultdict(lambda: None)
-        self.memory = defaultdict(lambda: None)
-        self.variables = defaultdict(lambda: None)
+    def __init__(
+        self,
+        logging=True,
+        profile=False,
+        translate=False,
+        track_writes=None,
+        check_parser=False,
+    ):
+        # with track_writes (by default when logging), the writes to the
+        # state are recorded in write_log, for the changes that are
+        # logged after each instruction and that eval_instructions
+        # returns (see state_x86)
+        if track_writes is None:
+            track_writes = logging
+        if track_writes:
+            self.write_log = WriteLog()
+            self.registers = LoggedRegisters(
+                [0] * len(register_names), self.write_log, "reg"
+            )
+            self.memory = LoggedMemory(self.write_log)
+            self.variables = LoggedRegisters([], self.write_log, "var")
+            self.global_vals = LoggedGlobals(self.write_log)
+        else:
+            self.write_log = None
+            self.registers = [0] * len(register_names)
+            self.memory = Memory()
+            # the values of the variables by slot (the slot of each
+            # variable is assigned by the decoder)
+            self.variables = []
+            self.global_vals = {}
+        self.variable_slots = {}
+        # the two values that the last flag-setting instruction compared
+        self.flags_left = 0
+        self.flags_right = 0
         self.logging = logging
-        self.registers["rbp"] = 1000
-        self.registers["rsp"] = 1000
-
-        self.global_vals = {}
+        self.registers[rbp] = stack_top
+        self.registers[rsp] = stack_top
+
+        self.collector = Collector(self.memory)
+        # the label of each function pointer
+        self.functions = {}
+
+        # the instructions of all the blocks, laid out one after the
+        # other, and the index of the first instruction of each block
+        self.code = []
+        self.labels = {}
+        self.return_stack = []
+        # an empty block, the target of jumps that return
+        self.return_block = -1
+        self.output = []
+        self.decoder = Decoder(self)
+        self.profile = ExecutionProfile(self) if profile else None
+        # with translate, the program is translated to Python functions
+        # (see translate_x86) before it runs, unless it is logged or
+        # profiled; units maps the start of each one to the function
+        self.translate = translate
+        self.units = None
+        # the BlockFile of the blocks that eval_file decodes as they run
+        self.lazy_blocks = None
+        # text is parsed by asm_x86; with check_parser, also by the Lark
+        # parser, and a difference is an error
+        self.check_parser = check_parser
+        self.dispatch = [getattr(self, "exec_" + name) for name in opcodes]
+        self.runtime_functions = {
+            label_name("print_int"): self.call_print_int,
+            label_name("read_int"): self.call_read_int,
+            "initialize": self.call_initialize,
+            "collect": self.call_collect,
+        }
 
     def log(self, s):
         if self.logging:
             print(s)
 
     def parse_and_eval_program(self, s):
-        p = x86_parser.parse(s)
+        p = X86Program(parse_program(s, self.check_parser))
+        return self.eval_ast_program(p)
 
     def eval_program(self, p):
+        return self.run_program(self.decode_program(p))
+
+    # Runs a .s file (a filename or a file object) like
+    # parse_and_eval_program, but only parses and decodes each block
+    # when it first runs (see stream_x86). The program is interpreted
+    # even with translate, which needs the whole code.
+    def eval_file(self, f):
+        blocks = BlockFile(f)
+        try:
+            self.load_lazy_blocks(blocks)
+            return self.run_main()
+        finally:
+            blocks.close()
+
+    # Runs an X86Program of x86_ast instructions directly, without
+    # converting it to a parse tree first.
+    def eval_ast_program(self, p):
+        return self.run_program(self.decode_ast_program(p))
+
+    def decode_program(self, p):
         assert p.data == "prog"
         blocks = {}
-        output = []
-
-        # transform the program into a dict of blocks
         for b in p.children:
             assert b.data == "block"
             block_name, *instrs = b.children
-            name = str(block_name)
-            blocks[name] = instrs
-            self.global_vals[name] = FunPointer(name)
+            blocks[str(block_name)] = self.decoder.decode_block(instrs)
+        return blocks
+
+    def decode_ast_program(self, p):
+        if isinstance(p.body, list):
+            body = {label_name("main"): p.body}
+        else:
+            body = p.body
+        blocks = {}
+        for name, instrs in body.items():
+            blocks[name] = self.decoder.decode_ast_block(instrs)
+        return blocks
+
+    def run_program(self, blocks):
+        self.load_program(blocks)
+        return self.run_main()
+
+    def load_program(self, blocks):
+        self.load_blocks(blocks)
+        if self.translate and not self.logging and self.profile is None:
+            self.units = Translator(self).translate()
+
+    def run_main(self):
+        output = []
+        self.output = output
 
         self.log("========== STARTING EXECUTION ==============================")
 
         # start evaluating at "main" or at "start"
-        if label_name("main") in blocks.keys():
-            self.eval_instrs(blocks[label_name("main")], blocks, output)
-        elif label_name("start") in blocks.keys():
-            self.eval_instrs(blocks[label_name("start")], blocks, output)
+        if label_name("main") in self.labels.keys():
+            self.run(self.labels[label_name("main")])
+        elif label_name("start") in self.labels.keys():
+            self.run(self.labels[label_name("start")])
 
         self.log("FINAL STATE:")
         if self.logging:
             print(self.print_state())
 
         self.log(f"OUTPUT: {output}")
+        if self.collector.initialized:
+            self.log(f"GC STATISTICS: {self.gc_statistics()}")
         self.log("========== FINISHED EXECUTION ==============================")
 
         return output
 
+    # Runs the program (an X86Program or the parse tree of a .s file)
+    # once per input, where an input is a string or a file-like object
+    # that read_int reads from. The program is decoded once, and the
+    # machine state is reset between the runs. Returns the output of
+    # each run, or the exception that ended it.
+    def eval_batch(self, p, inputs):
+        if hasattr(p, "data"):
+            self.load_program(self.decode_program(p))
+        else:
+            self.load_program(self.decode_ast_program(p))
+        results = []
+        for stream in inputs:
+            self.reset()
+            results.append(self.eval_input(stream))
+        return results
+
+    def eval_input(self, stream):
+        if isinstance(stream, str):
+            stream = io.StringIO(stream)
+        stdin = sys.stdin
+        sys.stdin = stream
+        try:
+            return self.run_main()
+        except Exception as e:
+            return e
+        finally:
+            sys.stdin = stdin
+
+    # Resets the machine state to what it is before a program runs,
+    # keeping the loaded (and translated) code and the variable slots.
+    def reset(self):
+        self.registers[:] = [0] * len(register_names)
+        self.registers[rbp] = stack_top
+        self.registers[rsp] = stack_top
+        self.memory.clear()
+        self.variables[:] = [0] * len(self.variables)
+        self.flags_left = 0
+        self.flags_right = 0
+        # the translated code holds on to global_vals, so it is kept
+        self.global_vals.clear()
+        for address, name in self.functions.items():
+            self.global_vals[name] = address
+        self.collector = Collector(self.memory)
+        self.return_stack = []
+        self.output = []
+
+    # Runs the instructions in s and returns the Table of the locations
+    # that they changed, with their old and new values. The emulator
+    # must track the writes (track_writes=True).
     def eval_instructions(self, s):
-        import pandas as pd
-
-        p = x86_parser_instrs.parse(s)
+        if self.write_log is None:
+            raise Exception("eval_instructions needs an emulator with track_writes")
 
-        assert p.data == "instrs"
+        instrs = x86_ast_parser_instrs.parse(s)
         blocks = {}
         output = []
 
-        orig_memory = self.memory.copy()
-        orig_registers = self.registers.copy()
-        orig_variables = self.variables.copy()
+        snapshot = self.snapshot()
 
         self.log("Executing instructions:")
         self.log(s)
@@ -90,7 +294,7 @@ class X86Emulator:
         self.log("========== STARTING EXECUTION ==============================")
 
         # start evaluating at "main"
-        self.eval_instrs(p.children, blocks, output)
+        self.eval_instrs(instrs, blocks, output)
 
         self.log("FINAL STATE:")
         if self.logging:
@@ -99,309 +303,432 @@ class X86Emulator:
         self.log(f"OUTPUT: {output}")
         self.log("========== FINISHED EXECUTION ==============================")
 
-        changes_memory = [
-            [f"mem {k}", orig_memory[k], self.memory[k]]
-            for k in self.diff_dicts(self.memory, orig_memory)
-        ]
-        changes_registers = [
-            [f"reg {k}", orig_registers[k], self.registers[k]]
-            for k in self.diff_dicts(self.registers, orig_registers)
-        ]
-        changes_variables = [
-            [f"var {k}", orig_variables[k], self.variables[k]]
-            for k in self.diff_dicts(self.variables, orig_variables)
-        ]
-
-        all_changes = changes_memory + changes_registers + changes_variables
-
-        changes_df = pd.DataFrame(all_changes, columns=["Location", "Old", "New"])
-
-        return changes_df
-
-    def diff_dicts(self, d_after, d_orig):
-        keys_diff = []
-        for k in d_after.keys():
-            if d_orig[k] != d_after[k]:
-                keys_diff.append(k)
-        return keys_diff
-
+        changes = self.changes(snapshot)
+        self.release(snapshot)
+        return Table(["Location", "Old", "New"], changes)
+
+    # A snapshot of the state, to find the changes since then with
+    # changes. It only holds the position in the write log and the
+    # flags, so it has to be released when it is no longer needed.
+    def snapshot(self):
+        return self.write_log.snapshot(), self.eflags()
+
+    def release(self, snapshot):
+        self.write_log.release(snapshot[0])
+
+    # The locations changed since the snapshot, as rows of name, old
+    # value and new value.
+    def changes(self, snapshot):
+        position, flags = snapshot
+        rows = []
+        for location, old in self.write_log.written(position).items():
+            new = self.read_location(location)
+            if new != old:
+                rows.append([self.location_name(location), old, new])
+        if self.eflags() != flags:
+            rows.append(["reg EFLAGS", flags, self.eflags()])
+        return rows
+
+    def read_location(self, location):
+        kind, key = location
+        if kind == "reg":
+            return self.registers[key]
+        elif kind == "var":
+            return self.variables[key]
+        elif kind == "mem":
+            # a page that was released reads as zeros, without
+            # allocating it again
+            words = self.memory.get(key >> page_bits)
+            return 0 if words is None else words[(key & page_mask) >> 3]
+        else:
+            return self.global_vals.get(key)
+
+    def location_name(self, location):
+        kind, key = location
+        if kind == "reg":
+            return f"reg {register_names[key]}"
+        elif kind == "var":
+            for name, slot in self.variable_slots.items():
+                if slot == key:
+                    return f"var {name}"
+        elif kind == "mem":
+            return f"mem {key}"
+        return str(key)
+
+    def register_values(self):
+        values = {name: self.registers[i] for i, name in enumerate(register_names)}
+        values["EFLAGS"] = self.eflags()
+        return values
+
+    def variable_values(self):
+        return {name: self.variables[i] for name, i in self.variable_slots.items()}
+
+    # The whole state, as a Table of locations and values.
     def print_state(self):
-        import pandas as pd
-
-        pd.set_option("display.max_rows", None)
-        memory = [[f"mem {k}", self.memory[k]] for k in sorted(self.memory.keys())]
-        registers = [[f"reg {k}", self.registers[k]] for k in self.registers.keys()]
-        variables = [[f"var {k}", self.variables[k]] for k in self.variables.keys()]
+        memory = [[f"mem {k}", v] for k, v in self.memory.words().items()]
+        registers = [[f"reg {k}", v] for k, v in self.register_values().items()]
+        variables = [[f"var {k}", v] for k, v in self.variable_values().items()]
         gvals = [[f"{k}", self.global_vals[k]] for k in self.global_vals.keys()]
 
-        all_state = memory + registers + variables + gvals
-
-        state_df = pd.DataFrame(all_state, columns=["Location", "Value"])
-
-        return state_df
+        return Table(["Location", "Value"], memory + registers + variables + gvals)
 
     def print_mem(self, mem):
         for k, v in mem.items():
             self.log(f" {k}:\t {v}")
 
-    def eval_imm(self, e) -> int:
-        if e.data == "int_a":
-            v = int(e.children[0])
-            if is_int64(v):
-                return v
-            else:
-                raise Exception("eval_imm: invalid immediate:", v)
-
-        # if e.data == 'int_a':
-        #     return int(e.children[0])
-        # elif e.data == 'neg_a':
-        #     return -self.eval_imm(e.children[0])
-        else:
-            raise Exception("eval_imm: unknown immediate:", e)
-
-    def eval_arg(self, a):
-        if a.data == "reg_a":
-            return self.registers[str(a.children[0])]
-        elif a.data == "var_a":
-            return self.variables[str(a.children[0])]
-        # elif a.data == 'int_a' or a.data == 'neg_a':
-        #     return self.eval_imm(a)
-        elif a.data == "int_a":
-            return self.eval_imm(a)
-        elif a.data == "neg_a":
-            return neg64(self.eval_imm(a.children[0]))
-        elif a.data == "mem_a":
-            offset, reg = a.children
-            addr = self.registers[reg]
-            offset_addr = add64(addr, self.eval_imm(offset))
-            # offset_addr = addr + self.eval_imm(offset)
-            return self.memory[offset_addr]
-        elif a.data == "global_val_a":
-            loc, reg = a.children
-            assert str(reg) == "rip", a
-            return self.global_vals[str(loc)]
-        else:
-            raise RuntimeError(f"Unknown arg in eval_arg: {a}")
-
-    def store_arg(self, a, v):
-        if a.data == "reg_a":
-            self.registers[str(a.children[0])] = v
-        elif a.data == "var_a":
-            self.variables[str(a.children[0])] = v
-        elif a.data == "mem_a":
-            offset, reg = a.children
-            addr = self.registers[reg]
-            # offset_addr = addr + self.eval_imm(offset)
-            offset_addr = add64(addr, self.eval_imm(offset))
-            self.memory[offset_addr] = v
-        elif a.data == "direct_mem_a":
-            reg = a.children[0]
-            addr = self.registers[reg]
-            self.memory[addr] = v
-        elif a.data == "global_val_a":
-            loc, reg = a.children
-            assert str(reg) == "rip", a
-            self.global_vals[str(loc)] = v
-
-        else:
-            raise RuntimeError(f"Unknown arg in store_arg: {a}")
-
     def eval_instrs(self, instrs, blocks, output):
-        for instr in instrs:
-            self.log(f"Evaluating instruction: {instr.pretty()}")
-            if instr.data == "pushq":
-                a = instr.children[0]
-                self.registers["rsp"] = self.registers["rsp"] - 8
-                v = self.eval_arg(a)
-                self.memory[self.registers["rsp"]] = v
-
-            elif instr.data == "popq":
-                a = instr.children[0]
-                v = self.memory[self.registers["rsp"]]
-                self.registers["rsp"] = self.registers["rsp"] + 8
-                self.store_arg(a, v)
-
-            elif instr.data == "movq":
-                a1, a2 = instr.children
-                v = self.eval_arg(a1)
-                self.store_arg(a2, v)
-
-            elif instr.data == "movzbq":
-                a1, a2 = instr.children
-                v = self.eval_arg(a1)
-                self.store_arg(a2, v)
-
-            elif instr.data == "addq":
-                a1, a2 = instr.children
-                v1 = self.eval_arg(a1)
-                v2 = self.eval_arg(a2)
-                self.store_arg(a2, add64(v1, v2))
-
-            elif instr.data == "subq":
-                a1, a2 = instr.children
-                v1 = self.eval_arg(a1)
-                v2 = self.eval_arg(a2)
-                self.store_arg(a2, sub64(v2, v1))
-
-            elif instr.data == "xorq":
-                a1, a2 = instr.children
-                v1 = self.eval_arg(a1)
-                v2 = self.eval_arg(a2)
-                self.store_arg(a2, xor64(v1, v2))
-
-            elif instr.data == "negq":
-                a1 = instr.children[0]
-                v1 = self.eval_arg(a1)
-                self.store_arg(a1, neg64(v1))
-
-            elif instr.data in ["jmp", "je", "jne", "jl", "jle", "jg", "jge"]:
-                target = str(instr.children[0])
-                perform_jump = False
-
-                if instr.data == "jmp":
-                    perform_jump = True
-                elif instr.data == "je" and self.registers["EFLAGS"] == "e":
-                    perform_jump = True
-                elif instr.data == "jne" and self.registers["EFLAGS"] in ["g", "l"]:
-                    perform_jump = True
-                elif instr.data == "jl" and self.registers["EFLAGS"] == "l":
-                    perform_jump = True
-                elif instr.data == "jle" and self.registers["EFLAGS"] in ["l", "e"]:
-                    perform_jump = True
-                elif instr.data == "jg" and self.registers["EFLAGS"] == "g":
-                    perform_jump = True
-                elif instr.data == "jge" and self.registers["EFLAGS"] in ["g", "e"]:
-                    perform_jump = True
-
-                if perform_jump:
-                    if target in blocks.keys():
-                        self.eval_instrs(blocks[target], blocks, output)
-                    elif target == label_name("conclusion"):
-                        return
-                    else:
-                        raise Exception("jump to invalid target " + target)
-                    return  # after jumping, toss continuation
-
-            elif instr.data in ["sete", "setne", "setl", "setle", "setg", "setge"]:
-                a1 = instr.children[0]
-
-                if instr.data == "sete" and self.registers["EFLAGS"] == "e":
-                    self.store_arg(a1, 1)
-                elif instr.data == "setne" and self.registers["EFLAGS"] != "e":
-                    self.store_arg(a1, 1)
-                elif instr.data == "setl" and self.registers["EFLAGS"] == "l":
-                    self.store_arg(a1, 1)
-                elif instr.data == "setle" and self.registers["EFLAGS"] in ["l", "e"]:
-                    self.store_arg(a1, 1)
-                elif instr.data == "setg" and self.registers["EFLAGS"] == "g":
-                    self.store_arg(a1, 1)
-                elif instr.data == "setge" and self.registers["EFLAGS"] in ["g", "e"]:
-                    self.store_arg(a1, 1)
-                else:
-                    self.store_arg(a1, 0)
-
-            elif instr.data == "callq":
-                target = str(instr.children[0])
-                if target == label_name("print_int"):
-                    self.log(f'CALL TO print_int: {self.registers["rdi"]}')
-                    output.append(self.registers["rdi"])
-                    if self.logging:
-                        print(self.print_state())
-
-                elif target == label_name("read_int"):
-                    self.registers["rax"] = input_int()
-                    self.log(f'CALL TO read_int: {self.registers["rax"]}')
-                    if self.logging:
-                        print(self.print_state())
-
-                elif target == "initialize":
-                    self.log(
-                        f'CALL TO initialize: {self.registers["rdi"]}, {self.registers["rsi"]}'
-                    )
-                    rootstack_size = self.registers["rdi"]
-                    heap_size = self.registers["rsi"]
-
-                    rs_begin = 2000
-                    rs_end = rs_begin + rootstack_size
-
-                    fromspace_begin = 100000
-                    fromspace_end = fromspace_begin + heap_size
-
-                    self.global_vals = {
-                        **self.global_vals,
-                        "rootstack_begin": rs_begin,
-                        "rootstack_end": rs_end,
-                        "free_ptr": fromspace_begin,
-                        "fromspace_begin": fromspace_begin,
-                        "fromspace_end": fromspace_end,
-                    }
-
-                    if self.logging:
-                        print(self.print_state())
-
-                elif target == "collect":
-                    self.log(f'CALL TO collect: need {self.registers["rsi"]} bytes')
-
-                    needed = self.registers["rsi"]
-                    fsb = self.global_vals["fromspace_begin"]
-                    fse = self.global_vals["fromspace_end"]
-
-                    current_space = fse - fsb
-
-                    new_space = current_space
-                    while new_space - current_space < needed:
-                        new_space = new_space * 2
-
-                    new_fse = fsb + new_space
-                    self.global_vals["fromspace_end"] = new_fse
-
-                    if self.logging:
-                        print(self.print_state())
-
-                else:
-                    self.eval_instrs(blocks[target], blocks, output)
-
-            elif instr.data == "retq":
-                return
-
-            elif instr.data == "cmpq":
-                a1, a2 = instr.children
-                v1 = self.eval_arg(a1)
-                v2 = self.eval_arg(a2)
-
-                if v1 == v2:
-                    self.registers["EFLAGS"] = "e"
-                elif v2 < v1:
-                    self.registers["EFLAGS"] = "l"
-                elif v2 > v1:
-                    self.registers["EFLAGS"] = "g"
-                else:
-                    raise RuntimeError(f"failed comparison: {instr}")
-
-            elif instr.data == "leaq":
-                a1, a2 = instr.children
-                v1 = self.eval_arg(a1)
-                assert isinstance(v1, FunPointer)
-                self.store_arg(a2, v1)
-
-            elif instr.data == "indirect_callq":
-                v = self.eval_arg(instr.children[0])
-                assert isinstance(v, FunPointer)
-                target = v.fun_name
-                self.eval_instrs(blocks[target], blocks, output)
-
-            elif instr.data == "indirect_jmp":
-                v = self.eval_arg(instr.children[0])
-                assert isinstance(v, FunPointer)
-                target = v.fun_name
-                self.eval_instrs(blocks[target], blocks, output)
-                return  # after jumping, toss continuation
-
+        self.output = output
+        decoded = {}
+        for name, block in blocks.items():
+            if name not in self.labels:
+                decoded[name] = self.decoder.decode_ast_block(block)
+        self.load_blocks(decoded)
+        self.run(self.load_block(self.decoder.decode_ast_block(instrs)))
+
+    # Adds the decoded blocks (a dictionary from labels to lists of
+    # DecodedInstr) to the code.
+    def load_blocks(self, blocks):
+        for name, block in blocks.items():
+            if name not in self.labels:
+                self.labels[name] = self.load_block(block)
+                address = code_begin + self.labels[name]
+                self.global_vals[name] = address
+                self.functions[address] = name
+        self.link()
+
+    # Adds a decoded block to the code and returns the index of its
+    # first instruction. A block is ended by an "end" instruction, so
+    # that running off its end returns, as it always did.
+    def load_block(self, block):
+        start = len(self.code)
+        self.code.extend(block)
+        self.code.append(DecodedInstr(opcode_ids["end"], "end", ()))
+        for i in range(start, len(self.code)):
+            self.code[i].next = i + 1
+        return start
+
+    # Resolves the targets of the jumps and calls to indices in the
+    # code. A jump to a missing conclusion block returns, and the other
+    # missing targets are reported when they are jumped to.
+    def link(self):
+        for instr in self.code:
+            self.link_instr(instr)
+
+    def link_instr(self, instr):
+        if instr.target is not None:
+            if instr.target in self.labels:
+                instr.jump = self.labels[instr.target]
+            elif instr.target == label_name("conclusion"):
+                instr.jump = self.return_index()
             else:
-                raise RuntimeError(f"Unknown instruction: {instr.data}")
-
+                instr.jump = -1
+
+    # Lays out a load_block instruction for each block of the BlockFile,
+    # followed by room for the rest of the block, so that the labels and
+    # function pointers are known before the blocks are decoded.
+    def load_lazy_blocks(self, blocks):
+        self.lazy_blocks = blocks
+        for name in blocks.names():
+            if name not in self.labels:
+                stub = DecodedInstr(
+                    opcode_ids["load_block"], "load_block", (), target=name
+                )
+                padding = [
+                    DecodedInstr(opcode_ids["end"], "end", ())
+                    for i in range(blocks.sizes[name])
+                ]
+                self.labels[name] = self.load_block([stub] + padding)
+                address = code_begin + self.labels[name]
+                self.global_vals[name] = address
+                self.functions[address] = name
+        self.link()
+
+    def return_index(self):
+        if self.return_block < 0:
+            self.return_block = self.load_block([])
+        return self.return_block
+
+    # Runs the code starting at index pc until the outermost block
+    # returns. The handlers return the index of the next instruction,
+    # or -1 to stop; calls push their return address on return_stack.
+    def run(self, pc):
+        code = self.code
+        dispatch = self.dispatch
+        saved_return_stack = self.return_stack
+        self.return_stack = []
+        try:
             if self.logging:
-                print(self.print_state())
+                while pc >= 0:
+                    instr = code[pc]
+                    self.log(f"Evaluating instruction: {instr}")
+                    if self.write_log is None:
+                        pc = dispatch[instr.op](instr)
+                        continue
+                    snapshot = self.snapshot()
+                    pc = dispatch[instr.op](instr)
+                    changes = self.changes(snapshot)
+                    self.release(snapshot)
+                    if changes:
+                        print(Table(["Location", "Old", "New"], changes))
+            elif self.profile is not None:
+                self.run_profiled(pc)
+            elif self.units is not None:
+                units = self.units
+                while pc >= 0:
+                    unit = units.get(pc)
+                    if unit is None:
+                        instr = code[pc]
+                        pc = dispatch[instr.op](instr)
+                    else:
+                        pc = unit()
+            else:
+                while pc >= 0:
+                    instr = code[pc]
+                    pc = dispatch[instr.op](instr)
+        finally:
+            self.return_stack = saved_return_stack
+
+    # Runs the code like run, counting the executions of each
+    # instruction and the calls, and tracking the depth of the stack.
+    def run_profiled(self, pc):
+        code = self.code
+        dispatch = self.dispatch
+        registers = self.registers
+        profile = self.profile
+        profile.grow(len(code))
+        counts = profile.counts
+        calls = profile.calls
+        call_ops = {
+            opcode_ids["callq"],
+            opcode_ids["indirect_callq"],
+            opcode_ids["indirect_jmp"],
+        }
+        min_sp = profile.min_stack_pointer
+        max_depth = profile.max_call_depth
+        try:
+            while pc >= 0:
+                instr = code[pc]
+                counts[pc] += 1
+                next_pc = dispatch[instr.op](instr)
+                if instr.op in call_ops:
+                    # a call of a runtime function continues at the
+                    # next instruction
+                    callee = instr.target if next_pc == instr.next else next_pc
+                    calls[(pc, callee)] = calls.get((pc, callee), 0) + 1
+                    max_depth = max(max_depth, len(self.return_stack))
+                if registers[rsp] < min_sp:
+                    min_sp = registers[rsp]
+                pc = next_pc
+        finally:
+            profile.min_stack_pointer = min_sp
+            profile.max_call_depth = max_depth
+
+    def jump_target(self, instr):
+        if instr.jump < 0:
+            raise Exception("jump to invalid target " + instr.target)
+        return instr.jump
+
+    def call(self, return_address, target):
+        self.return_stack.append(return_address)
+        return target
+
+    ############################################################################
+    # Instructions
+    ############################################################################
+
+    def exec_pushq(self, instr):
+        registers = self.registers
+        registers[rsp] = registers[rsp] - 8
+        self.memory.store(registers[rsp], instr.args[0].load())
+        return instr.next
+
+    def exec_popq(self, instr):
+        registers = self.registers
+        v = self.memory.load(registers[rsp])
+        registers[rsp] = registers[rsp] + 8
+        instr.args[0].store(v)
+        return instr.next
+
+    def exec_movq(self, instr):
+        a1, a2 = instr.args
+        a2.store(a1.load())
+        return instr.next
+
+    exec_movzbq = exec_movq
+
+    def exec_addq(self, instr):
+        a1, a2 = instr.args
+        a2.store(add64(a1.load(), a2.load()))
+        return instr.next
+
+    def exec_subq(self, instr):
+        a1, a2 = instr.args
+        a2.store(sub64(a2.load(), a1.load()))
+        return instr.next
+
+    def exec_xorq(self, instr):
+        a1, a2 = instr.args
+        a2.store(xor64(a1.load(), a2.load()))
+        return instr.next
+
+    def exec_andq(self, instr):
+        a1, a2 = instr.args
+        v = a1.load() & a2.load()
+        a2.store(v)
+        self.flags_left = v
+        self.flags_right = 0
+        return instr.next
+
+    def exec_sarq(self, instr):
+        a1, a2 = instr.args
+        v = a2.load() >> (a1.load() & 63)
+        a2.store(v)
+        self.flags_left = v
+        self.flags_right = 0
+        return instr.next
+
+    def exec_negq(self, instr):
+        a1 = instr.args[0]
+        a1.store(neg64(a1.load()))
+        return instr.next
+
+    def exec_cmpq(self, instr):
+        a1, a2 = instr.args
+        self.flags_left = a2.load()
+        self.flags_right = a1.load()
+        return instr.next
+
+    def exec_testq(self, instr):
+        a1, a2 = instr.args
+        self.flags_left = a1.load() & a2.load()
+        self.flags_right = 0
+        return instr.next
+
+    def exec_cmpq_jcc(self, instr):
+        a1, a2 = instr.args
+        left = self.flags_left = a2.load()
+        right = self.flags_right = a1.load()
+        if instr.cond(left, right):
+            return self.jump_target(instr)
+        return instr.next
+
+    # The EFLAGS as they used to be shown: "e", "l" or "g".
+    def eflags(self):
+        if self.flags_left == self.flags_right:
+            return "e"
+        elif self.flags_left < self.flags_right:
+            return "l"
+        else:
+            return "g"
+
+    def exec_leaq(self, instr):
+        a1, a2 = instr.args
+        v1 = a1.load()
+        assert v1 in self.functions
+        a2.store(v1)
+        return instr.next
+
+    def exec_jmp(self, instr):
+        return self.jump_target(instr)
+
+    def exec_jcc(self, instr):
+        if instr.cond(self.flags_left, self.flags_right):
+            return self.jump_target(instr)
+        return instr.next
+
+    exec_je = exec_jne = exec_jl = exec_jle = exec_jg = exec_jge = exec_jcc
+
+    def exec_setcc(self, instr):
+        instr.args[0].store(1 if instr.cond(self.flags_left, self.flags_right) else 0)
+        return instr.next
+
+    exec_sete = exec_setne = exec_setl = exec_setle = exec_setg = exec_setge = (
+        exec_setcc
+    )
+
+    def exec_callq(self, instr):
+        target = instr.target
+        if target in self.runtime_functions:
+            self.runtime_functions[target]()
+            return instr.next
+        return self.call(instr.next, self.jump_target(instr))
+
+    def exec_indirect_callq(self, instr):
+        return self.call(instr.next, self.function_target(instr.args[0].load()))
+
+    def exec_indirect_jmp(self, instr):
+        return self.function_target(instr.args[0].load())
+
+    def function_target(self, v):
+        if v not in self.functions:
+            raise Exception("call to invalid function pointer " + str(v))
+        return v - code_begin
+
+    # Decodes the block in place of the load_block instruction and the
+    # room after it, and continues at its first instruction. (A block
+    # with several instructions on a line may not fit; it is then added
+    # to the end of the code and jumped to.)
+    def exec_load_block(self, instr):
+        start = self.labels[instr.target]
+        text = self.lazy_blocks.text(instr.target)
+        block = self.decoder.decode_ast_block(parse_instrs(text, self.check_parser))
+        if len(block) <= self.lazy_blocks.sizes[instr.target]:
+            self.code[start : start + len(block)] = block
+            for i in range(start, start + len(block)):
+                self.code[i].next = i + 1
+        else:
+            jump = DecodedInstr(opcode_ids["jmp"], "jmp", ())
+            jump.jump = self.load_block(block)
+            jump.next = start + 1
+            self.code[start] = jump
+            if self.profile is not None:
+                self.profile.grow(len(self.code))
+        for i in block:
+            self.link_instr(i)
+        if self.profile is not None:
+            # the block is counted when its first instruction runs
+            self.profile.counts[start] -= 1
+        return start
+
+    def exec_retq(self, instr):
+        if self.return_stack:
+            return self.return_stack.pop()
+        return -1
+
+    exec_end = exec_retq
+
+    ############################################################################
+    # Runtime functions
+    ############################################################################
+
+    def call_print_int(self):
+        self.log(f"CALL TO print_int: {self.registers[rdi]}")
+        self.output.append(self.registers[rdi])
+
+    def call_read_int(self):
+        self.registers[rax] = input_int()
+        self.log(f"CALL TO read_int: {self.registers[rax]}")
+
+    def call_initialize(self):
+        self.log(f"CALL TO initialize: {self.registers[rdi]}, {self.registers[rsi]}")
+        rootstack_size = self.registers[rdi]
+        heap_size = self.registers[rsi]
+        self.collector.initialize(rootstack_begin, rootstack_size, heap_size)
+        self.global_vals.update(self.collector.globals())
+
+    def call_collect(self):
+        self.log(f"CALL TO collect: need {self.registers[rsi]} bytes")
+        # the compiled code allocates by bumping free_ptr itself
+        self.collector.free_ptr = self.global_vals["free_ptr"]
+        self.collector.collect(self.registers[rdi], self.registers[rsi])
+        self.global_vals.update(self.collector.globals())
+        self.log(f"GC STATISTICS: {self.collector.statistics()}")
+
+    def gc_statistics(self):
+        if not self.collector.initialized:
+            return None
+        self.collector.free_ptr = self.global_vals["free_ptr"]
+        return self.collector.statistics()
 
 
 prog1 = """
@@ -528,14 +855,46 @@ instrs = [
     "addq $2, %rax",
     "addq $3, %rax",
     "addq $5, %rax\n movq %rax, %rdi",
-    "movq $42, (%rax)",
+    "movq $42, 5(%rax)",
 ]
 
+# Usage: python eval_x86.py [file.s [--profile report.json]]
+#
+# Without a file, runs the example programs above with logging.
 if __name__ == "__main__":
-    for prog in prog1, prog2, prog3, prog4, prog5:
-        emu = X86Emulator(logging=True)
-        emu.eval_program(prog)
-
-    emu = X86Emulator(logging=False)
-    for i in instrs:
-        print(emu.eval_instructions(i))
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run an x86 assembly file.")
+    parser.add_argument("file", nargs="?", help="the .s file to run")
+    parser.add_argument(
+        "--profile",
+        help="write the execution profile to this JSON file "
+        + "and print the hot blocks",
+    )
+    parser.add_argument(
+        "--check-parser",
+        action="store_true",
+        help="also parse the file with the Lark parser and compare",
+    )
+    args = parser.parse_args()
+
+    if args.file is None:
+        for prog in prog1, prog2, prog3, prog4, prog5:
+            emu = X86Emulator(logging=True)
+            emu.parse_and_eval_program(prog)
+
+        emu = X86Emulator(logging=False, track_writes=True)
+        for i in instrs:
+            print(emu.eval_instructions(i))
+    else:
+        emu = X86Emulator(
+            logging=False,
+            profile=args.profile is not None,
+            check_parser=args.check_parser,
+        )
+        output = emu.eval_file(args.file)
+        for s in output:
+            print(s)
+        if args.profile is not None:
+            emu.profile.write_report(args.profile)
+            print(emu.profile.hot_blocks(), end="")
@@ -0,0 +1,298 @@
+# A port of the copying garbage collector of runtime.c (initialize,
+# collect, cheney, copy_vector and process_vector) that works on the
+# memory of the emulator. The heap is made of two semispaces in the
+# address space above heap_begin; after a collection the pages of the
+# old fromspace are released, so the memory used by the emulator is
+# bounded by the live data of the program like with the real runtime.
+#
+# The tuple tags and the tagged pointers of the dynamically typed
+# languages are interpreted like runtime.c does; see the comment on the
+# tags there.
+
+import time
+
+from memory_x86 import heap_begin, page_bits, page_mask
+
+tag_is_not_forward_mask = 1
+tag_vec_length_mask = 126
+tag_vec_length_rshift = 1
+tag_vec_ptr_bitfield_rshift = 7
+tag_vecof_length_rshift = 2
+tag_vecof_ptr_bitfield_rshift = 1
+tag_vecof_rshift = 62
+
+any_tag_mask = 7
+any_tag_ptr = 0
+any_tag_vec = 2
+any_tag_vecof = 6
+
+
+def is_forwarding(tag):
+    return not (tag & tag_is_not_forward_mask)
+
+
+def is_vecof(tag):
+    return 1 & (tag >> tag_vecof_rshift)
+
+
+def get_vector_length(tag):
+    return (tag & tag_vec_length_mask) >> tag_vec_length_rshift
+
+
+def get_vec_ptr_bitfield(tag):
+    return tag >> tag_vec_ptr_bitfield_rshift
+
+
+# ((tag << 2) >> 2) in C: the tag without the top two bits, sign
+# extended from bit 61.
+def get_vecof_length(tag):
+    v = tag & ((1 << 62) - 1)
+    if v >= 1 << 61:
+        v -= 1 << 62
+    return v >> tag_vecof_length_rshift
+
+
+def get_vecof_ptr_bitfield(tag):
+    return 1 & (tag >> tag_vecof_ptr_bitfield_rshift)
+
+
+def get_vec_length(tag):
+    if is_vecof(tag):
+        return get_vecof_length(tag)
+    else:
+        return get_vector_length(tag)
+
+
+def any_tag(v):
+    return v & any_tag_mask
+
+
+def is_ptr(v):
+    if v == 0:
+        return False
+    t = any_tag(v)
+    return t == any_tag_ptr or t == any_tag_vec or t == any_tag_vecof
+
+
+def to_ptr(v):
+    if any_tag(v) == any_tag_ptr:
+        return v
+    else:
+        return v & ~any_tag_mask
+
+
+class Collector:
+    def __init__(self, memory, validate=True):
+        self.memory = memory
+        # check the invariants that runtime.c checks unless NDEBUG
+        self.validate = validate
+        self.initialized = False
+        # the start of the next semispace in the address space
+        self.next_space = heap_begin
+        self.rootstack_begin = 0
+        self.rootstack_end = 0
+        self.fromspace_begin = 0
+        self.fromspace_end = 0
+        self.tospace_begin = 0
+        self.tospace_end = 0
+        self.free_ptr = 0
+
+        self.collections = 0
+        self.resizes = 0
+        self.objects_copied = 0
+        self.bytes_copied = 0
+        self.bytes_allocated = 0
+        self.live_bytes = 0
+        self.max_heap_size = 0
+        self.gc_time = 0.0
+        # free_ptr after the last collection, to count the allocations
+        self.last_free_ptr = 0
+
+    # Reserves a semispace of the given size in the address space. Each
+    # semispace starts on a page of its own, so its pages can be released.
+    def new_space(self, size):
+        begin = self.next_space
+        end = begin + size
+        self.next_space = (end + page_mask) & ~page_mask
+        return begin, end
+
+    def release_space(self, begin, end):
+        for page in range(begin >> page_bits, (end + page_mask) >> page_bits):
+            self.memory.pop(page, None)
+
+    # The variables of the runtime that the compiled code refers to.
+    def globals(self):
+        return {
+            "rootstack_begin": self.rootstack_begin,
+            "rootstack_end": self.rootstack_end,
+            "free_ptr": self.free_ptr,
+            "fromspace_begin": self.fromspace_begin,
+            "fromspace_end": self.fromspace_end,
+        }
+
+    def initialize(self, rootstack_begin, rootstack_size, heap_size):
+        assert heap_size % 8 == 0
+        assert rootstack_size % 8 == 0
+        self.fromspace_begin, self.fromspace_end = self.new_space(heap_size)
+        self.tospace_begin, self.tospace_end = self.new_space(heap_size)
+        self.rootstack_begin = rootstack_begin
+        self.rootstack_end = rootstack_begin + rootstack_size
+        self.free_ptr = self.fromspace_begin
+        self.last_free_ptr = self.free_ptr
+        self.max_heap_size = heap_size
+        self.initialized = True
+
+    def collect(self, rootstack_ptr, bytes_requested):
+        start = time.perf_counter()
+        assert self.initialized
+        assert rootstack_ptr >= self.rootstack_begin
+        assert rootstack_ptr < self.rootstack_end
+        if self.validate:
+            self.validate_roots(rootstack_ptr)
+
+        self.collections += 1
+        self.bytes_allocated += self.free_ptr - self.last_free_ptr
+        self.cheney(rootstack_ptr)
+
+        if self.fromspace_end - self.free_ptr < bytes_requested:
+            # double the heap until the live data and the requested
+            # bytes fit, then copy the live data into the bigger heap
+            occupied_bytes = self.free_ptr - self.fromspace_begin
+            needed_bytes = occupied_bytes + bytes_requested
+            new_bytes = self.fromspace_end - self.fromspace_begin
+            while new_bytes <= needed_bytes:
+                new_bytes = 2 * new_bytes
+            self.resizes += 1
+            self.max_heap_size = max(self.max_heap_size, new_bytes)
+
+            self.release_space(self.tospace_begin, self.tospace_end)
+            self.tospace_begin, self.tospace_end = self.new_space(new_bytes)
+            self.cheney(rootstack_ptr)
+            self.release_space(self.tospace_begin, self.tospace_end)
+            self.tospace_begin, self.tospace_end = self.new_space(new_bytes)
+
+        assert self.free_ptr < self.fromspace_end
+        assert self.free_ptr >= self.fromspace_begin
+        if self.validate:
+            self.validate_roots(rootstack_ptr)
+            scan_ptr = self.fromspace_begin
+            while scan_ptr != self.free_ptr:
+                scan_ptr = self.validate_vector(scan_ptr)
+
+        self.live_bytes = self.free_ptr - self.fromspace_begin
+        self.last_free_ptr = self.free_ptr
+        self.gc_time += time.perf_counter() - start
+
+    def validate_roots(self, rootstack_ptr):
+        for root_loc in range(self.rootstack_begin, rootstack_ptr, 8):
+            root = self.memory.load(root_loc)
+            if is_ptr(root):
+                a_root = to_ptr(root)
+                assert self.fromspace_begin <= a_root < self.fromspace_end
+
+    # Checks that the pointers of the vector at scan_ptr point into
+    # fromspace and returns the address of the next vector. (runtime.c
+    # gives up on vectorofs here; their elements are checked instead.)
+    def validate_vector(self, scan_ptr):
+        tag = self.memory.load(scan_ptr)
+        length = get_vec_length(tag)
+        if is_vecof(tag):
+            is_ptr_bits = -get_vecof_ptr_bitfield(tag)
+        else:
+            is_ptr_bits = get_vec_ptr_bitfield(tag)
+        for i in range(length):
+            if (is_ptr_bits >> i) & 1:
+                ptr = self.memory.load(scan_ptr + 8 * (i + 1))
+                if is_ptr(ptr):
+                    real_ptr = to_ptr(ptr)
+                    assert self.fromspace_begin <= real_ptr < self.fromspace_end
+        return scan_ptr + 8 * (length + 1)
+
+    def cheney(self, rootstack_ptr):
+        scan_ptr = self.tospace_begin
+        self.free_ptr = self.tospace_begin
+
+        # the roots are the initial queue
+        for root_loc in range(self.rootstack_begin, rootstack_ptr, 8):
+            self.copy_vector(root_loc)
+
+        # the vectors between scan_ptr and free_ptr are the queue of a
+        # breadth first traversal of the live data
+        while scan_ptr != self.free_ptr:
+            scan_ptr = self.process_vector(scan_ptr)
+
+        # flip, and release the pages of the data that is left behind
+        self.release_space(self.fromspace_begin, self.fromspace_end)
+        self.tospace_begin, self.fromspace_begin = (
+            self.fromspace_begin,
+            self.tospace_begin,
+        )
+        self.tospace_end, self.fromspace_end = self.fromspace_end, self.tospace_end
+
+    # Copies the vectors that the vector at scan_addr points to and
+    # returns the address of the next vector.
+    def process_vector(self, scan_addr):
+        tag = self.memory.load(scan_addr)
+        if is_vecof(tag):
+            length = get_vecof_length(tag)
+            elts_are_pointers = get_vecof_ptr_bitfield(tag)
+            next_ptr = scan_addr + 8 * (length + 1)
+            scan_addr += 8
+            while scan_addr != next_ptr:
+                if elts_are_pointers == 1:
+                    self.copy_vector(scan_addr)
+                scan_addr += 8
+        else:
+            length = get_vector_length(tag)
+            next_ptr = scan_addr + 8 * (length + 1)
+            is_pointer_bits = get_vec_ptr_bitfield(tag)
+            scan_addr += 8
+            while scan_addr != next_ptr:
+                if (is_pointer_bits & 1) == 1:
+                    self.copy_vector(scan_addr)
+                is_pointer_bits = is_pointer_bits >> 1
+                scan_addr += 8
+        return next_ptr
+
+    # Copies the vector that the pointer at vector_ptr_loc points to
+    # into tospace (unless it was already copied) and updates the
+    # pointer to the copy.
+    def copy_vector(self, vector_ptr_loc):
+        memory = self.memory
+        old_vector_ptr = memory.load(vector_ptr_loc)
+        old_tag = any_tag(old_vector_ptr)
+        if not is_ptr(old_vector_ptr):
+            return
+        old_vector_ptr = to_ptr(old_vector_ptr)
+
+        tag = memory.load(old_vector_ptr)
+        if is_forwarding(tag):
+            # already copied: the tag is the address of the copy
+            memory.store(vector_ptr_loc, tag | old_tag)
+        else:
+            new_vector_ptr = self.free_ptr
+            length = get_vec_length(tag)
+            for i in range(length + 1):
+                memory.store(
+                    new_vector_ptr + 8 * i, memory.load(old_vector_ptr + 8 * i)
+                )
+            self.free_ptr = self.free_ptr + 8 * (length + 1)
+            self.objects_copied += 1
+            self.bytes_copied += 8 * (length + 1)
+            memory.store(old_vector_ptr, new_vector_ptr)
+            memory.store(vector_ptr_loc, new_vector_ptr | old_tag)
+
+    def statistics(self):
+        return {
+            "collections": self.collections,
+            "resizes": self.resizes,
+            "objects_copied": self.objects_copied,
+            "bytes_copied": self.bytes_copied,
+            "bytes_allocated": self.bytes_allocated
+            + self.free_ptr
+            - self.last_free_ptr,
+            "live_bytes": self.live_bytes,
+            "heap_size": self.fromspace_end - self.fromspace_begin,
+            "max_heap_size": self.max_heap_size,
+            "gc_time": self.gc_time,
+        }
@@ -0,0 +1,97 @@
+# The machine state of the emulator: the register file and a paged
+# memory. Registers are numbered and held in a list, and memory is made
+# of pages of 64-bit words that are allocated (zeroed) when they are
+# first touched, so a program can use megabytes of heap without every
+# word being a separate dictionary entry.
+
+from array import array
+
+register_names = [
+    "rax",
+    "rbx",
+    "rcx",
+    "rdx",
+    "rsi",
+    "rdi",
+    "rbp",
+    "rsp",
+    "r8",
+    "r9",
+    "r10",
+    "r11",
+    "r12",
+    "r13",
+    "r14",
+    "r15",
+]
+
+register_ids = {name: i for i, name in enumerate(register_names)}
+
+# The byte registers are the lowest byte of a register.
+byte_registers = {
+    "al": "rax",
+    "bl": "rbx",
+    "cl": "rcx",
+    "dl": "rdx",
+    "sil": "rsi",
+    "dil": "rdi",
+    "bpl": "rbp",
+    "spl": "rsp",
+    "r8b": "r8",
+    "r9b": "r9",
+    "r10b": "r10",
+    "r11b": "r11",
+    "r12b": "r12",
+    "r13b": "r13",
+    "r14b": "r14",
+    "r15b": "r15",
+}
+
+# The layout of the address space. The stack grows down from stack_top
+# and the heap (the fromspace of the garbage collector) grows up from
+# heap_begin, so they only meet after hundreds of megabytes. Function
+# pointers are the index of the first instruction of a function plus
+# code_begin, so they can be stored in memory like any other value.
+code_begin = 0x1000
+rootstack_begin = 0x10000000
+heap_begin = 0x20000000
+stack_top = 0x40000000
+
+# A page holds 4096 words (32KB). Accesses are to whole, aligned words;
+# an access to an address that is not a multiple of 8 is an error (see
+# unaligned) rather than rounded down to the word that contains it.
+page_bits = 15
+page_mask = (1 << page_bits) - 1
+page_words = 1 << (page_bits - 3)
+
+
+def unaligned(address):
+    raise Exception("unaligned memory access at " + hex(address))
+
+
+class Memory(dict):
+    # The pages by page number, allocated on the first access.
+    def __missing__(self, page):
+        words = array("q", bytes(8 * page_words))
+        self[page] = words
+        return words
+
+    def load(self, address):
+        if address & 7:
+            unaligned(address)
+        return self[address >> page_bits][(address & page_mask) >> 3]
+
+    def store(self, address, value):
+        if address & 7:
+            unaligned(address)
+        self[address >> page_bits][(address & page_mask) >> 3] = value
+
+    # The non-zero words of the memory by address.
+    def words(self):
+        result = {}
+        for page in sorted(self.keys()):
+            words = self[page]
+            for i in range(page_words):
+                if words[i] != 0:
+                    result[(page << page_bits) + 8 * i] = words[i]
+        return result
@@ -1,25 +1,56 @@
 # Author: Joe Near
 # License: GPLv3
 
-from lark import Lark
+import hashlib
+import os
+import pickle
+import stat
+import sys
+import tempfile
 
-x86_parser = Lark(
-    r"""
+from x86_ast import (
+    ByteReg,
+    Callq,
+    Deref,
+    Global,
+    Immediate,
+    IndirectCallq,
+    IndirectJump,
+    Instr,
+    Jump,
+    JumpIf,
+    Reg,
+    Variable,
+)
+
+# The grammar of x86 assembly files (start symbol prog) and of lists
+# of instructions (start symbol instrs). Both are parsed by one LALR
+# parser, which is only built when something is first parsed: the
+# tables are built once and saved (with Lark.save) to a cache file in
+# the user's cache directory, and later processes load them from there.
+# With the same tables, x86_ast_parser builds x86_ast instructions
+# while it parses instead of a parse tree (see AstBuilder).
+x86_grammar = r"""
     ?instr: "movq" arg "," arg -> movq
           | "addq" arg "," arg -> addq
           | "subq" arg "," arg -> subq
           | "cmpq" arg "," arg -> cmpq
           | "xorq" arg "," arg -> xorq
+          | "andq" arg "," arg -> andq
+          | "testq" arg "," arg -> testq
+          | "sarq" arg "," arg -> sarq
           | "leaq" arg "," arg -> leaq
           | "negq" arg -> negq
           | "jmp" CNAME -> jmp
           | "jmp" "*" arg -> indirect_jmp
           | "je" CNAME -> je
+          | "jne" CNAME -> jne
           | "jl" CNAME -> jl
           | "jle" CNAME -> jle
           | "jg" CNAME -> jg
           | "jge" CNAME -> jge
           | "sete" arg -> sete
+          | "setne" arg -> setne
           | "setl" arg -> setl
           | "setle" arg -> setle
           | "setg" arg -> setg
@@ -52,67 +83,239 @@ x86_parser = Lark(
 
     prog: block*
 
+    instrs: instr*
+
     %import common.NUMBER
     %import common.CNAME
 
     %import common.WS
     %ignore WS
-    """,
-    start="prog",
-    parser="lalr",
-)
+"""
 
-x86_parser_instrs = Lark(
-    r"""
-    ?instr: "movq" arg "," arg -> movq
-          | "addq" arg "," arg -> addq
-          | "subq" arg "," arg -> subq
-          | "cmpq" arg "," arg -> cmpq
-          | "xorq" arg "," arg -> xorq
-          | "leaq" arg "," arg -> leaq
-          | "negq" arg -> negq
-          | "jmp" CNAME -> jmp
-          | "jmp" "*" arg -> indirect_jmp
-          | "je" CNAME -> je
-          | "jl" CNAME -> jl
-          | "jle" CNAME -> jle
-          | "jg" CNAME -> jg
-          | "jge" CNAME -> jge
-          | "sete" arg -> sete
-          | "setl" arg -> setl
-          | "setle" arg -> setle
-          | "setg" arg -> setg
-          | "setge" arg -> setge
-          | "movzbq" arg "," arg -> movzbq
-          | "xorq" arg "," arg -> xorq
-          | "callq" CNAME -> callq
-          | "callq" "*" arg -> indirect_callq
-          | "pushq" arg -> pushq
-          | "popq" arg -> popq
-          | "retq" -> retq
+x86_starts = ["prog", "instrs"]
 
-    instrs: instr*
+# The parsers, once they are loaded: the one that builds parse trees
+# and the one that builds x86_ast (with AstBuilder).
+lalr_parser = None
+ast_parser = None
 
-    ?arg: "$" atom -> int_a
-        | "%" reg -> reg_a
-        | "#" CNAME -> var_a
-        | "(" "%" reg ")" -> direct_mem_a
-        | atom "(" "%" reg ")" -> mem_a
-        | CNAME "(" "%" reg ")" -> global_val_a
 
-    ?atom: NUMBER -> int_a
-         | "-" atom  -> neg_a
+# The directory of the cache file. Loading the tables unpickles them,
+# so the directory is private to the user: it is created with mode
+# 0o700, and a directory that belongs to someone else or that others
+# can write to is not used (None).
+def cache_directory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    directory = os.path.join(base, "interp_x86")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError:
+        return None
+    return directory if is_private(directory) else None
 
-    !?reg: "rsp" | "rbp" | "rax" | "rbx" | "rcx" | "rdx" | "rsi" | "rdi" 
-         | "r8" | "r9" | "r10" | "r11" | "r12" | "r13" | "r14" | "r15"
-         | "al" | "rip"
 
-    %import common.NUMBER
-    %import common.CNAME
+# Whether the file belongs to the user and only the user can write it.
+def is_private(filename):
+    try:
+        st = os.lstat(filename)
+    except OSError:
+        return False
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return False
+    return not stat.S_ISLNK(st.st_mode) and not st.st_mode & 0o022
 
-    %import common.WS
-    %ignore WS
-    """,
-    start="instrs",
-    parser="lalr",
-)
+
+# The cache file depends on the grammar and on the versions of lark
+# and Python (the tables are pickled).
+def cache_filename(directory, lark_version):
+    key = x86_grammar + repr(x86_starts) + lark_version + str(sys.version_info[:2])
+    digest = hashlib.sha256(key.encode("utf8")).hexdigest()
+    return os.path.join(directory, "x86_grammar_" + digest[:24] + ".lark")
+
+
+# The parser with the cached tables and the given options (those that
+# Lark.load allows), or None if the tables are missing, unreadable or
+# not the user's own.
+def read_parser(**options):
+    from lark import Lark, __version__
+
+    directory = cache_directory()
+    if directory is None:
+        return None
+    filename = cache_filename(directory, __version__)
+    if not is_private(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            return Lark.load(f, **options)
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError):
+        return None
+
+
+def load_parser():
+    global lalr_parser
+    if lalr_parser is not None:
+        return lalr_parser
+    from lark import CompactTree, Lark, __version__
+
+    # the trees of big programs are big, so they are CompactTrees
+    lalr_parser = read_parser(tree_class=CompactTree)
+    if lalr_parser is not None:
+        return lalr_parser
+    lalr_parser = Lark(
+        x86_grammar, start=x86_starts, parser="lalr", tree_class=CompactTree
+    )
+    directory = cache_directory()
+    if directory is None:
+        return lalr_parser
+    # write to a temporary name first so that a concurrent process
+    # never loads a half-written file (mkstemp creates it with mode
+    # 0o600)
+    try:
+        fd, tmp = tempfile.mkstemp(suffix=".lark", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            lalr_parser.save(f)
+        os.replace(tmp, cache_filename(directory, __version__))
+    except OSError:
+        pass
+    return lalr_parser
+
+
+# The parser with the same tables that builds x86_ast while it parses.
+def load_ast_parser():
+    global ast_parser
+    if ast_parser is not None:
+        return ast_parser
+    ast_parser = read_parser(transformer=AstBuilder())
+    if ast_parser is None:
+        from lark import Lark
+
+        # the tables could not be cached; load_parser has built them
+        load_parser()
+        ast_parser = Lark(
+            x86_grammar, start=x86_starts, parser="lalr", transformer=AstBuilder()
+        )
+    return ast_parser
+
+
+class X86Parser:
+    def __init__(self, start, ast=False):
+        self.start = start
+        self.ast = ast
+
+    def parse(self, s):
+        if self.ast:
+            return load_ast_parser().parse(s, start=self.start)
+        return load_parser().parse(s, start=self.start)
+
+
+x86_parser = X86Parser("prog")
+x86_parser_instrs = X86Parser("instrs")
+# These return a dictionary from labels to lists of instructions and a
+# list of instructions, in x86_ast.
+x86_ast_parser = X86Parser("prog", ast=True)
+x86_ast_parser_instrs = X86Parser("instrs", ast=True)
+
+
+def instruction(name):
+    def build(self, children):
+        return Instr(name, children)
+
+    return build
+
+
+def jump_if(name):
+    def build(self, children):
+        return JumpIf(name[1:], str(children[0]))
+
+    return build
+
+
+# The callbacks of the rules of the grammar, which the LALR parser
+# calls as it reduces them (instead of building a Tree), so the x86_ast
+# of a program is built in one pass without a parse tree.
+class AstBuilder:
+    movq = instruction("movq")
+    addq = instruction("addq")
+    subq = instruction("subq")
+    cmpq = instruction("cmpq")
+    xorq = instruction("xorq")
+    andq = instruction("andq")
+    testq = instruction("testq")
+    sarq = instruction("sarq")
+    leaq = instruction("leaq")
+    movzbq = instruction("movzbq")
+    negq = instruction("negq")
+    pushq = instruction("pushq")
+    popq = instruction("popq")
+    retq = instruction("retq")
+    sete = instruction("sete")
+    setne = instruction("setne")
+    setl = instruction("setl")
+    setle = instruction("setle")
+    setg = instruction("setg")
+    setge = instruction("setge")
+
+    je = jump_if("je")
+    jne = jump_if("jne")
+    jl = jump_if("jl")
+    jle = jump_if("jle")
+    jg = jump_if("jg")
+    jge = jump_if("jge")
+
+    def jmp(self, children):
+        return Jump(str(children[0]))
+
+    def indirect_jmp(self, children):
+        return IndirectJump(children[0])
+
+    def callq(self, children):
+        return Callq(str(children[0]), 0)
+
+    def indirect_callq(self, children):
+        return IndirectCallq(children[0], 0)
+
+    # A number is an int_a of its token, and an immediate is an int_a
+    # of a number.
+    def int_a(self, children):
+        v = children[0]
+        if isinstance(v, int):
+            return Immediate(v)
+        return int(v)
+
+    def neg_a(self, children):
+        return -children[0]
+
+    def reg_a(self, children):
+        reg = str(children[0])
+        return ByteReg(reg) if reg == "al" else Reg(reg)
+
+    def var_a(self, children):
+        return Variable(str(children[0]))
+
+    def direct_mem_a(self, children):
+        return Deref(str(children[0]), 0)
+
+    def mem_a(self, children):
+        offset, reg = children
+        return Deref(str(reg), offset)
+
+    def global_val_a(self, children):
+        name, reg = children
+        if str(reg) != "rip":
+            raise Exception(f"global {name} must be relative to %rip")
+        return Global(str(name))
+
+    # A directive is a block without instructions, named after its
+    # argument.
+    def block(self, children):
+        label, *instrs = children
+        return str(label), instrs
+
+    def prog(self, children):
+        return dict(children)
+
+    def instrs(self, children):
+        return children
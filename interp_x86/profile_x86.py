@@ -0,0 +1,256 @@
+import json
+from bisect import bisect_right
+
+from memory_x86 import stack_top
+
+# Profiles the execution of a program by the emulator. While running,
+# only the number of executions of each instruction, the calls and the
+# depth of the stack are recorded (see X86Emulator.run); everything
+# else (the executions of each block, the opcode histogram and the
+# memory accesses) is derived from the instruction counts afterwards.
+#
+# Usage:
+#
+#   emu = X86Emulator(logging=False, profile=True)
+#   emu.eval_ast_program(program)
+#   emu.profile.write_report("prog.profile.json")
+#   print(emu.profile.hot_blocks())
+
+# How each operand of an instruction is accessed: read, written or both.
+operand_accesses = {
+    "movq": ("r", "w"),
+    "movzbq": ("r", "w"),
+    "leaq": ("", "w"),
+    "addq": ("r", "rw"),
+    "subq": ("r", "rw"),
+    "xorq": ("r", "rw"),
+    "andq": ("r", "rw"),
+    "sarq": ("r", "rw"),
+    "cmpq": ("r", "r"),
+    "testq": ("r", "r"),
+    "cmpq_jcc": ("r", "r"),
+    "negq": ("rw",),
+    "pushq": ("r",),
+    "popq": ("w",),
+    "indirect_callq": ("r",),
+    "indirect_jmp": ("r",),
+}
+
+# The stack accesses of pushq and popq themselves.
+stack_accesses = {"pushq": (0, 1), "popq": (1, 0)}
+
+
+def accesses(instr):
+    counts = {
+        "memory_reads": 0,
+        "memory_writes": 0,
+        "global_reads": 0,
+        "global_writes": 0,
+    }
+    modes = operand_accesses.get(instr.name)
+    if modes is None and instr.name.startswith("set"):
+        modes = ("w",)
+    for a, mode in zip(instr.args, modes or ()):
+        if a.kind == "mem":
+            prefix = "memory_"
+        elif a.kind == "global":
+            prefix = "global_"
+        else:
+            continue
+        if "r" in mode:
+            counts[prefix + "reads"] += 1
+        if "w" in mode:
+            counts[prefix + "writes"] += 1
+    reads, writes = stack_accesses.get(instr.name, (0, 0))
+    counts["memory_reads"] += reads
+    counts["memory_writes"] += writes
+    return counts
+
+
+# The number of program instructions that a decoded instruction stands
+# for (two for a fused cmpq and jcc).
+def size(instr):
+    if isinstance(instr.source, tuple):
+        return len(instr.source)
+    return 1
+
+
+class ExecutionProfile:
+    def __init__(self, emulator):
+        self.emulator = emulator
+        # the number of executions of each instruction of the code
+        self.counts = []
+        # the number of calls by (index of the call, callee), where the
+        # callee is the index of the function or the name of a runtime
+        # function
+        self.calls = {}
+        self.min_stack_pointer = stack_top
+        self.max_call_depth = 0
+
+    # Makes room for the counts of the instructions loaded since the
+    # last run.
+    def grow(self, size):
+        if len(self.counts) < size:
+            self.counts.extend([0] * (size - len(self.counts)))
+
+    def block_starts(self):
+        starts = sorted((start, name) for name, start in self.emulator.labels.items())
+        return [s for s, n in starts], [n for s, n in starts]
+
+    def block_of(self, index, starts, names):
+        i = bisect_right(starts, index) - 1
+        return names[i] if i >= 0 else "<instructions>"
+
+    # The blocks that were executed, by the number of instructions
+    # executed in them. A block runs as often as its first instruction.
+    def blocks(self):
+        code = self.emulator.code
+        starts, names = self.block_starts()
+        blocks = []
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(self.counts)
+            executed = 0
+            for index in range(start, min(end, len(self.counts))):
+                # the "end" instructions are not part of the program
+                if code[index].name != "end":
+                    executed += self.counts[index] * size(code[index])
+            if start < len(self.counts) and self.counts[start] > 0:
+                blocks.append(
+                    {
+                        "label": names[i],
+                        "executions": self.counts[start],
+                        "instructions": executed,
+                    }
+                )
+        return sorted(blocks, key=lambda b: b["instructions"], reverse=True)
+
+    def opcodes(self):
+        histogram = {}
+        for instr, count in zip(self.emulator.code, self.counts):
+            if count == 0 or instr.name == "end":
+                continue
+            if instr.name == "cmpq_jcc":
+                names = ["cmpq", instr.source[1].name]
+            else:
+                names = [instr.name]
+            for name in names:
+                histogram[name] = histogram.get(name, 0) + count
+        return dict(sorted(histogram.items(), key=lambda kv: kv[1], reverse=True))
+
+    def memory(self):
+        totals = {
+            "memory_reads": 0,
+            "memory_writes": 0,
+            "global_reads": 0,
+            "global_writes": 0,
+        }
+        for instr, count in zip(self.emulator.code, self.counts):
+            if count == 0:
+                continue
+            for key, n in accesses(instr).items():
+                totals[key] += n * count
+        return totals
+
+    def call_graph(self):
+        starts, names = self.block_starts()
+        edges = {}
+        for (index, callee), count in self.calls.items():
+            caller = self.block_of(index, starts, names)
+            if not isinstance(callee, str):
+                callee = self.block_of(callee, starts, names)
+            edges[(caller, callee)] = edges.get((caller, callee), 0) + count
+        return [
+            {"caller": caller, "callee": callee, "count": count}
+            for (caller, callee), count in sorted(
+                edges.items(), key=lambda kv: kv[1], reverse=True
+            )
+        ]
+
+    def instructions(self):
+        starts, names = self.block_starts()
+        return [
+            {
+                "block": self.block_of(index, starts, names),
+                "index": index,
+                "instr": instr.text(),
+                "count": count,
+            }
+            for index, (instr, count) in enumerate(zip(self.emulator.code, self.counts))
+            if count > 0 and instr.name != "end"
+        ]
+
+    def report(self):
+        blocks = self.blocks()
+        executed = sum(b["instructions"] for b in blocks)
+        memory = self.memory()
+        memory["accesses_per_instruction"] = (
+            (memory["memory_reads"] + memory["memory_writes"]) / executed
+            if executed > 0
+            else 0.0
+        )
+        return {
+            "instructions_executed": executed,
+            "blocks": blocks,
+            "opcodes": self.opcodes(),
+            "memory": memory,
+            "calls": self.call_graph(),
+            "max_stack_depth": stack_top - self.min_stack_pointer,
+            "max_call_depth": self.max_call_depth,
+            "instructions": self.instructions(),
+        }
+
+    def write_report(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    # A text report of the blocks that execute the most instructions,
+    # with the count of each of their instructions.
+    def hot_blocks(self, limit=10):
+        report = self.report()
+        executed = report["instructions_executed"]
+        lines = [
+            f"{executed} instructions executed, "
+            + f"max stack depth {report['max_stack_depth']} bytes, "
+            + f"max call depth {report['max_call_depth']}"
+        ]
+        memory = report["memory"]
+        lines.append(
+            f"memory: {memory['memory_reads']} reads, "
+            + f"{memory['memory_writes']} writes "
+            + f"({memory['accesses_per_instruction']:.2f} per instruction), "
+            + f"globals: {memory['global_reads']} reads, "
+            + f"{memory['global_writes']} writes"
+        )
+        lines.append("")
+        lines.append(
+            "block".ljust(24) + "runs".rjust(12) + "instrs".rjust(14) + "%".rjust(8)
+        )
+        instructions = report["instructions"]
+        for block in report["blocks"][:limit]:
+            share = 100.0 * block["instructions"] / executed if executed > 0 else 0.0
+            lines.append(
+                block["label"].ljust(24)
+                + str(block["executions"]).rjust(12)
+                + str(block["instructions"]).rjust(14)
+                + ("%.1f" % share).rjust(8)
+            )
+            for i in instructions:
+                if i["block"] == block["label"]:
+                    lines.append(str(i["count"]).rjust(12) + "    " + i["instr"])
+        lines.append("")
+        lines.append("opcodes:")
+        for name, count in report["opcodes"].items():
+            lines.append("  " + name.ljust(16) + str(count).rjust(12))
+        if report["calls"]:
+            lines.append("")
+            lines.append("calls:")
+            for edge in report["calls"]:
+                lines.append(
+                    "  "
+                    + edge["caller"]
+                    + " -> "
+                    + edge["callee"]
+                    + ": "
+                    + str(edge["count"])
+                )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,122 @@
+from array import array
+
+from memory_x86 import Memory, page_bits, page_words
+
+# Tracking of the changes to the state of the emulator, for logging and
+# for eval_instructions. When writes are tracked, the registers,
+# variables, memory pages and globals of the emulator are the Logged*
+# containers below, which record the location and the old value of
+# every write in a WriteLog. A snapshot of the state is then only a
+# position in the log: the changes since a snapshot are the locations
+# written after it, with their first old value and their current value,
+# so computing them costs O(writes) instead of copying and comparing the
+# whole state. Without tracking, the emulator uses the plain containers
+# and pays nothing for this.
+#
+# Locations are tuples: ("reg", register number), ("var", slot),
+# ("mem", address), ("global", name) and ("flags",).
+
+
+class WriteLog:
+    def __init__(self):
+        self.entries = []
+        # the number of snapshots in use; the log is only kept while
+        # there is one
+        self.snapshots = 0
+
+    def record(self, location, old):
+        if self.snapshots > 0:
+            self.entries.append((location, old))
+
+    def snapshot(self):
+        self.snapshots += 1
+        return len(self.entries)
+
+    def release(self, snapshot):
+        self.snapshots -= 1
+        if self.snapshots == 0:
+            self.entries.clear()
+
+    # The first old value of each location written since the snapshot,
+    # in the order of the first writes.
+    def written(self, snapshot):
+        old = {}
+        for location, value in self.entries[snapshot:]:
+            if location not in old:
+                old[location] = value
+        return old
+
+
+class LoggedRegisters(list):
+    def __init__(self, values, log, kind):
+        super().__init__(values)
+        self.log = log
+        self.kind = kind
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            for k in range(*i.indices(len(self))):
+                self.log.record((self.kind, k), self[k])
+        else:
+            self.log.record((self.kind, i), self[i])
+        super().__setitem__(i, v)
+
+
+class LoggedPage(array):
+    def __setitem__(self, i, v):
+        self.log.record(("mem", self.base + 8 * i), self[i])
+        super().__setitem__(i, v)
+
+
+class LoggedMemory(Memory):
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+
+    def __missing__(self, page):
+        words = LoggedPage("q", bytes(8 * page_words))
+        words.log = self.log
+        words.base = page << page_bits
+        self[page] = words
+        return words
+
+    # Releasing a page (as the collector does) clears its words.
+    def pop(self, page, default=None):
+        words = super().pop(page, default)
+        if words is not None:
+            for i, v in enumerate(words):
+                if v != 0:
+                    self.log.record(("mem", (page << page_bits) + 8 * i), v)
+        return words
+
+
+class LoggedGlobals(dict):
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+
+    def __setitem__(self, name, v):
+        self.log.record(("global", name), self.get(name))
+        super().__setitem__(name, v)
+
+    def update(self, values):
+        for name, v in values.items():
+            self[name] = v
+
+
+# A table of values, printed with aligned columns.
+class Table:
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __str__(self):
+        cells = [self.columns] + [[str(v) for v in row] for row in self.rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(self.columns))]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in cells
+        )
@@ -0,0 +1,87 @@
+import re
+
+# Splits a .s file into its blocks without parsing it, so that the
+# emulator can parse and decode each block when it first runs (see
+# X86Emulator.eval_file). A block is a label line and the instruction
+# lines after it, up to the next label or directive. Only the position
+# of each block in the file is kept (or its lines, for a stream that
+# can't be read again), and the text of a block is dropped once it is
+# decoded, so a big file with few hot blocks is mostly never parsed.
+
+label_line = re.compile(r"\s*([A-Za-z_][A-Za-z_0-9]*)\s*:")
+
+
+class BlockFile:
+    # f is a filename, a binary file that can seek, or any other
+    # file-like object or iterable of lines.
+    def __init__(self, f):
+        if isinstance(f, str):
+            f = open(f, "rb")
+            self.owned = True
+        else:
+            self.owned = False
+        self.file = f
+        self.seekable = (
+            hasattr(f, "seekable") and f.seekable() and "b" in getattr(f, "mode", "")
+        )
+        # the blocks by label: (begin, end) offsets in the file, or
+        # the list of lines
+        self.blocks = {}
+        # the number of instruction lines of each block, an upper bound
+        # on the number of its instructions
+        self.sizes = {}
+        self.scan()
+
+    def scan(self):
+        name = None
+        lines = []
+        begin = position = self.file.tell() if self.seekable else 0
+        for line in self.file:
+            text = line.decode() if isinstance(line, bytes) else line
+            stripped = text.strip()
+            match = label_line.match(text)
+            if match or stripped.startswith("."):
+                if name is not None:
+                    self.add(name, begin, position, lines)
+                name = match.group(1) if match else None
+                lines = []
+                begin = position
+                # the rest of a label line is part of the block
+                if match and text[match.end() :].strip():
+                    self.sizes[name] = 1
+                elif match:
+                    self.sizes[name] = 0
+            elif stripped:
+                if name is None:
+                    raise Exception("instruction outside of a block: " + stripped)
+                self.sizes[name] += 1
+            if name is not None and not self.seekable:
+                lines.append(text)
+            position += len(line)
+        if name is not None:
+            self.add(name, begin, position, lines)
+
+    def add(self, name, begin, end, lines):
+        if self.seekable:
+            self.blocks[name] = (begin, end)
+        else:
+            self.blocks[name] = lines
+
+    def names(self):
+        return list(self.blocks.keys())
+
+    # The instructions of the block, as text. A block is only read once.
+    def text(self, name):
+        block = self.blocks.pop(name)
+        if self.seekable:
+            begin, end = block
+            self.file.seek(begin)
+            text = self.file.read(end - begin).decode()
+        else:
+            text = "".join(block)
+        # leave out the label
+        return text[label_line.match(text).end() :]
+
+    def close(self):
+        if self.owned:
+            self.file.close()
@@ -0,0 +1,360 @@
+import hashlib
+
+from memory_x86 import page_bits, page_mask, register_names, unaligned
+from utils import add64, neg64, sub64, xor64
+
+# Translates the decoded code of the emulator into Python functions,
+# one per translation unit: a straight-line run of instructions that
+# starts at a block or at the return address of a call and ends at a
+# jump, call or return. Inside a unit the registers, variables and
+# flags it uses are Python locals, which are loaded from the emulator
+# when the unit starts and written back when it exits (or calls a
+# runtime function), and each instruction is a line or two of Python
+# instead of a dispatch through the handlers. A unit that jumps back to
+# its own start (the usual shape of a while loop) loops in Python
+# without leaving the function.
+#
+# Each unit returns the index of the next instruction like the
+# handlers do, so X86Emulator.run (with translate=True) runs the code
+# by calling units and falls back to the handlers for anything without
+# a unit.
+#
+# The generated source of a program only depends on the program, so
+# the compiled code is cached by the hash of the source.
+
+compiled_programs = {}
+
+max_compiled_programs = 64
+
+comparisons = {"e": "==", "ne": "!=", "l": "<", "le": "<=", "g": ">", "ge": ">="}
+
+# The instructions that leave a unit (except for calls of runtime
+# functions, which return to the unit).
+unit_ends = {"jmp", "callq", "indirect_callq", "indirect_jmp", "retq", "end"}
+
+
+class Translator:
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def translate(self):
+        source = self.program_source()
+        key = hashlib.sha256(source.encode()).hexdigest()
+        code = compiled_programs.get(key)
+        if code is None:
+            code = compile(source, "<x86 translation>", "exec")
+            if len(compiled_programs) >= max_compiled_programs:
+                del compiled_programs[next(iter(compiled_programs))]
+            compiled_programs[key] = code
+        namespace = {
+            "add64": add64,
+            "sub64": sub64,
+            "neg64": neg64,
+            "xor64": xor64,
+            "unaligned": unaligned,
+        }
+        exec(code, namespace)
+        return namespace["make_units"](self.emulator)
+
+    def is_runtime_call(self, instr):
+        return instr.name == "callq" and instr.target in self.emulator.runtime_functions
+
+    # The units start at the blocks and after the calls, which return
+    # to the instruction after them.
+    def unit_starts(self):
+        emulator = self.emulator
+        starts = set(emulator.labels.values())
+        if emulator.return_block >= 0:
+            starts.add(emulator.return_block)
+        for instr in emulator.code:
+            if instr.name in ["callq", "indirect_callq"]:
+                if not self.is_runtime_call(instr):
+                    starts.add(instr.next)
+        return sorted(s for s in starts if s < len(emulator.code))
+
+    def program_source(self):
+        lines = [
+            "def make_units(emu):",
+            "    R = emu.registers",
+            "    V = emu.variables",
+            "    P = emu.memory",
+            "    G = emu.global_vals",
+            "    RT = emu.runtime_functions",
+        ]
+        starts = self.unit_starts()
+        for start in starts:
+            lines.append("")
+            lines.extend("    " + line for line in self.unit_source(start))
+        lines.append("")
+        lines.append(
+            "    return {"
+            + ", ".join(str(start) + ": u" + str(start) for start in starts)
+            + "}"
+        )
+        return "\n".join(lines) + "\n"
+
+    ############################################################################
+    # Units
+    ############################################################################
+
+    def unit_source(self, start):
+        self.start = start
+        # the locals that the unit reads or writes, and those it writes
+        self.touched = []
+        self.assigned = []
+        self.body = []
+        code = self.emulator.code
+        i = start
+        while True:
+            instr = code[i]
+            if not self.instr_source(instr):
+                # no translation: leave the unit through the handler
+                self.emit("WRITEBACK")
+                self.emit("_i = emu.code[" + str(i) + "]")
+                self.emit("return emu.dispatch[_i.op](_i)")
+                break
+            if instr.name in unit_ends and not self.is_runtime_call(instr):
+                break
+            i = instr.next
+
+        lines = ["def u" + str(start) + "():"]
+        for name in self.touched:
+            lines.append("    " + name + " = " + self.location(name))
+        lines.append("    while True:")
+        for line in self.body:
+            indent, text = line
+            if text == "WRITEBACK":
+                lines.extend(indent + s for s in self.writeback())
+            elif text == "RELOAD":
+                lines.extend(
+                    indent + name + " = " + self.location(name) for name in self.touched
+                )
+            else:
+                lines.append(indent + text)
+        return lines
+
+    def location(self, name):
+        if name.startswith("r_"):
+            return "R[" + str(register_names.index(name[2:])) + "]"
+        elif name.startswith("v_"):
+            return "V[" + name[2:] + "]"
+        elif name == "fl":
+            return "emu.flags_left"
+        else:
+            return "emu.flags_right"
+
+    def writeback(self):
+        return [self.location(name) + " = " + name for name in self.assigned]
+
+    def use(self, name):
+        if name not in self.touched:
+            self.touched.append(name)
+        return name
+
+    def assign(self, name):
+        self.use(name)
+        if name not in self.assigned:
+            self.assigned.append(name)
+        return name
+
+    def emit(self, text, indent="        "):
+        self.body.append((indent, text))
+
+    # Leaves the unit for the instruction at index target (an
+    # expression), or loops if that is the start of the unit.
+    def exit(self, target, indent):
+        if target == str(self.start):
+            self.emit("continue", indent)
+        else:
+            self.emit("WRITEBACK", indent)
+            self.emit("return " + target, indent)
+
+    def jump(self, instr, indent="        "):
+        if instr.jump < 0:
+            self.emit("WRITEBACK", indent)
+            self.emit(
+                "raise Exception("
+                + repr("jump to invalid target " + str(instr.target))
+                + ")",
+                indent,
+            )
+        else:
+            self.exit(str(instr.jump), indent)
+
+    ############################################################################
+    # Operands
+    ############################################################################
+
+    def address(self, a):
+        r, offset = a.detail
+        reg = self.use("r_" + register_names[r])
+        if offset == 0:
+            return reg
+        return "(" + reg + " + " + str(offset) + ")"
+
+    # A local that holds the address of the memory operand a. An offset
+    # from a register is added once per instruction into an _a local
+    # (the registers don't change before the instruction's own store),
+    # since page uses the address several times.
+    def address_local(self, a):
+        if a.detail[1] == 0:
+            return self.address(a)
+        name = self.addresses.get(a.detail)
+        if name is None:
+            name = "_a" + str(len(self.addresses))
+            self.addresses[a.detail] = name
+            self.emit(name + " = " + self.address(a))
+        return name
+
+    # The word at address (a local); an unaligned address is an error
+    # like in the handlers.
+    def page(self, address):
+        return (
+            "P["
+            + address
+            + " >> "
+            + str(page_bits)
+            + "][("
+            + address
+            + " & "
+            + str(page_mask)
+            + ") >> 3 if not "
+            + address
+            + " & 7 else unaligned("
+            + address
+            + ")]"
+        )
+
+    def load(self, a):
+        if a.kind == "reg":
+            r, byte = a.detail
+            reg = self.use("r_" + register_names[r])
+            return "(" + reg + " & 255)" if byte else reg
+        elif a.kind == "var":
+            return self.use("v_" + str(a.detail[0]))
+        elif a.kind == "imm":
+            return repr(a.detail[0])
+        elif a.kind == "mem":
+            return self.page(self.address_local(a))
+        elif a.kind == "global":
+            return "G[" + repr(a.detail[0]) + "]"
+        raise Exception("translate: unknown operand " + a.kind)
+
+    def store(self, a, value):
+        if a.kind == "reg":
+            r, byte = a.detail
+            reg = self.assign("r_" + register_names[r])
+            if byte:
+                self.emit(reg + " = (" + reg + " & -256) | ((" + value + ") & 255)")
+            else:
+                self.emit(reg + " = " + value)
+        elif a.kind == "var":
+            self.emit(self.assign("v_" + str(a.detail[0])) + " = " + value)
+        elif a.kind == "mem":
+            self.emit("_v = " + value)
+            self.emit(self.page(self.address_local(a)) + " = _v")
+        elif a.kind == "global":
+            self.emit("G[" + repr(a.detail[0]) + "] = " + value)
+        else:
+            raise Exception("translate: cannot store to " + a.kind)
+
+    def condition(self, name):
+        cc = name[3:] if name.startswith("set") else name[1:]
+        self.use("fl")
+        self.use("fr")
+        return "fl " + comparisons[cc] + " fr"
+
+    def set_flags(self, left, right):
+        self.emit(self.assign("fl") + " = " + left)
+        self.emit(self.assign("fr") + " = " + right)
+
+    ############################################################################
+    # Instructions
+    ############################################################################
+
+    # Adds the Python code of the instruction to the unit, or returns
+    # False if it has no translation.
+    def instr_source(self, instr):
+        name = instr.name
+        args = instr.args
+        # the _a locals of the memory operands of this instruction
+        self.addresses = {}
+        if name in ["movq", "movzbq", "leaq"]:
+            self.store(args[1], self.load(args[0]))
+        elif name == "addq":
+            self.store(
+                args[1], "add64(" + self.load(args[0]) + ", " + self.load(args[1]) + ")"
+            )
+        elif name == "subq":
+            self.store(
+                args[1], "sub64(" + self.load(args[1]) + ", " + self.load(args[0]) + ")"
+            )
+        elif name == "xorq":
+            self.store(
+                args[1], "xor64(" + self.load(args[0]) + ", " + self.load(args[1]) + ")"
+            )
+        elif name == "andq":
+            self.emit("_f = " + self.load(args[0]) + " & " + self.load(args[1]))
+            self.store(args[1], "_f")
+            self.set_flags("_f", "0")
+        elif name == "sarq":
+            self.emit(
+                "_f = " + self.load(args[1]) + " >> (" + self.load(args[0]) + " & 63)"
+            )
+            self.store(args[1], "_f")
+            self.set_flags("_f", "0")
+        elif name == "negq":
+            self.store(args[0], "neg64(" + self.load(args[0]) + ")")
+        elif name == "cmpq":
+            self.set_flags(self.load(args[1]), self.load(args[0]))
+        elif name == "testq":
+            self.set_flags(self.load(args[0]) + " & " + self.load(args[1]), "0")
+        elif name == "cmpq_jcc":
+            self.set_flags(self.load(args[1]), self.load(args[0]))
+            self.emit("if " + self.condition(instr.source[1].name) + ":")
+            self.jump(instr, "            ")
+        elif name.startswith("set"):
+            self.store(args[0], "(1 if " + self.condition(name) + " else 0)")
+        elif name == "pushq":
+            self.emit("_v = " + self.load(args[0]))
+            rsp = self.assign("r_rsp")
+            self.emit(rsp + " = " + rsp + " - 8")
+            self.emit(self.page(rsp) + " = _v")
+        elif name == "popq":
+            rsp = self.assign("r_rsp")
+            self.emit("_v = " + self.page(rsp))
+            self.emit(rsp + " = " + rsp + " + 8")
+            self.store(args[0], "_v")
+        elif name == "jmp":
+            self.jump(instr)
+        elif name.startswith("j") and instr.cond is not None:
+            self.emit("if " + self.condition(name) + ":")
+            self.jump(instr, "            ")
+        elif name == "callq":
+            if self.is_runtime_call(instr):
+                self.emit("WRITEBACK")
+                self.emit("RT[" + repr(instr.target) + "]()")
+                self.emit("RELOAD")
+            elif instr.jump < 0:
+                self.jump(instr)
+            else:
+                self.emit("WRITEBACK")
+                self.emit(
+                    "return emu.call(" + str(instr.next) + ", " + str(instr.jump) + ")"
+                )
+        elif name == "indirect_callq":
+            self.emit("_v = " + self.load(args[0]))
+            self.emit("WRITEBACK")
+            self.emit(
+                "return emu.call(" + str(instr.next) + ", emu.function_target(_v))"
+            )
+        elif name == "indirect_jmp":
+            self.emit("_v = " + self.load(args[0]))
+            self.emit("WRITEBACK")
+            self.emit("return emu.function_target(_v)")
+        elif name in ["retq", "end"]:
+            self.emit("WRITEBACK")
+            self.emit("return emu.return_stack.pop() if emu.return_stack else -1")
+        else:
+            return False
+        return True
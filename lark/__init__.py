@@ -1,5 +1,5 @@
 from .utils import logger
-from .tree import Tree
+from .tree import Tree, TreeBase, CompactTree
 from .visitors import Transformer, Visitor, v_args, Discard, Transformer_NonRecursive
 from .visitors import InlineTransformer, inline_args  # XXX Deprecated
 from .exceptions import (
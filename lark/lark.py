@@ -514,13 +514,16 @@ class Lark(Serialize):
         pickle.dump({"data": data, "memo": m}, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     @classmethod
-    def load(cls, f):
+    def load(cls, f, **kwargs):
         """Loads an instance from the given file object
 
         Useful for caching and multiprocessing.
+
+        The options that are allowed when loading a parser (such as
+        ``transformer``) may be given as keyword arguments.
         """
         inst = cls.__new__(cls)
-        return inst._load(f)
+        return inst._load(f, **kwargs)
 
     def _deserialize_lexer_conf(self, data, memo, options):
         lexer_conf = LexerConf.deserialize(data["lexer_conf"], memo)
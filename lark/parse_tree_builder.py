@@ -1,6 +1,6 @@
 from .exceptions import GrammarError, ConfigurationError
 from .lexer import Token
-from .tree import Tree
+from .tree import Tree, TreeBase
 from .visitors import InlineTransformer  # XXX Deprecated
 from .visitors import Transformer_InPlace
 from .visitors import _vargs_meta, _vargs_meta_inline
@@ -29,7 +29,7 @@ class PropagatePositions:
     def __call__(self, children):
         res = self.node_builder(children)
 
-        if isinstance(res, Tree):
+        if isinstance(res, TreeBase):
             # Calculate positions while the tree is streaming, according to the rule:
             # - nodes start at the start of their first child's container,
             #   and end at the end of their last child's container.
@@ -86,7 +86,7 @@ class PropagatePositions:
         for c in children:
             if self.node_filter is not None and not self.node_filter(c):
                 continue
-            if isinstance(c, Tree):
+            if isinstance(c, TreeBase):
                 if not c.meta.empty:
                     return c.meta
             elif isinstance(c, Token):
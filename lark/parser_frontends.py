@@ -11,7 +11,7 @@ from .lexer import (
 )
 from .parsers import earley, xearley, cyk
 from .parsers.lalr_parser import LALR_Parser
-from .tree import Tree
+from .tree import Tree, TreeBase
 from .common import LexerConf, ParserConf
 
 try:
@@ -275,7 +275,7 @@ class CYK_FrontEnd:
         subtrees = list(tree.iter_subtrees())
         for subtree in subtrees:
             subtree.children = [
-                self._apply_callback(c) if isinstance(c, Tree) else c
+                self._apply_callback(c) if isinstance(c, TreeBase) else c
                 for c in subtree.children
             ]
 
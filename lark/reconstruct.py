@@ -2,7 +2,7 @@
 
 import unicodedata
 
-from .tree import Tree
+from .tree import Tree, TreeBase
 from .visitors import Transformer_InPlace
 from .lexer import Token, PatternStr
 from .grammar import Terminal, NonTerminal
@@ -85,7 +85,7 @@ class Reconstructor(TreeMatcher):
 
         res = self.write_tokens.transform(unreduced_tree)
         for item in res:
-            if isinstance(item, Tree):
+            if isinstance(item, TreeBase):
                 # TODO use orig_expansion.rulename to support templates
                 for x in self._reconstruct(item):
                     yield x
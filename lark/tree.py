@@ -3,6 +3,7 @@ try:
 except ImportError:
     pass
 
+import sys
 from copy import deepcopy
 
 
@@ -15,19 +16,16 @@ class Meta:
         self.empty = True
 
 
-class Tree(object):
-    """The main tree class.
-
-    Creates a new tree, and stores "data" and "children" in attributes of the same name.
-    Trees can be hashed and compared.
+class TreeBase(object):
+    """The behaviour of the trees, without their attributes (see Tree).
 
-    Parameters:
-        data: The name of the rule or alias
-        children: List of matched sub-rules and terminals
-        meta: Line & Column numbers (if ``propagate_positions`` is enabled).
-            meta attributes: line, column, start_pos, end_line, end_column, end_pos
+    It has no ``__dict__``, so subclasses that define ``__slots__`` for
+    ``data``, ``children`` and ``_meta`` (like CompactTree) have none
+    either. Check for a tree with ``isinstance(x, TreeBase)``.
     """
 
+    __slots__ = ()
+
     def __init__(self, data, children, meta=None):
         self.data = data
         self.children = children
@@ -46,7 +44,7 @@ class Tree(object):
         return self.data
 
     def _pretty(self, level, indent_str):
-        if len(self.children) == 1 and not isinstance(self.children[0], Tree):
+        if len(self.children) == 1 and not isinstance(self.children[0], TreeBase):
             return [
                 indent_str * level,
                 self._pretty_label(),
@@ -57,7 +55,7 @@ class Tree(object):
 
         l = [indent_str * level, self._pretty_label(), "\n"]
         for n in self.children:
-            if isinstance(n, Tree):
+            if isinstance(n, TreeBase):
                 l += n._pretty(level + 1, indent_str)
             else:
                 l += [indent_str * (level + 1), "%s" % (n,), "\n"]
@@ -95,7 +93,7 @@ class Tree(object):
             queue += [
                 c
                 for c in reversed(subtree.children)
-                if isinstance(c, Tree) and id(c) not in subtrees
+                if isinstance(c, TreeBase) and id(c) not in subtrees
             ]
 
         del queue
@@ -128,7 +126,7 @@ class Tree(object):
             >>> all_tokens = tree.scan_values(lambda v: isinstance(v, Token))
         """
         for c in self.children:
-            if isinstance(c, Tree):
+            if isinstance(c, TreeBase):
                 for t in c.scan_values(pred):
                     yield t
             else:
@@ -143,7 +141,7 @@ class Tree(object):
         stack = [self]
         while stack:
             node = stack.pop()
-            if not isinstance(node, Tree):
+            if not isinstance(node, TreeBase):
                 continue
             yield node
             for n in reversed(node.children):
@@ -177,10 +175,43 @@ class Tree(object):
         return self.meta.end_column
 
 
+class Tree(TreeBase):
+    """The main tree class.
+
+    Creates a new tree, and stores "data" and "children" in attributes of the same name.
+    Trees can be hashed and compared.
+
+    Parameters:
+        data: The name of the rule or alias
+        children: List of matched sub-rules and terminals
+        meta: Line & Column numbers (if ``propagate_positions`` is enabled).
+            meta attributes: line, column, start_pos, end_line, end_column, end_pos
+    """
+
+
 class SlottedTree(Tree):
     __slots__ = "data", "children", "rule", "_meta"
 
 
+class CompactTree(TreeBase):
+    """A tree with slots and no ``__dict__``, for large parse trees.
+
+    Pass ``tree_class=CompactTree`` to Lark to opt in. It behaves like
+    Tree but is not a subclass of it (``isinstance(t, TreeBase)`` holds
+    for both), and it can't have other attributes. Its ``meta`` is only
+    created when it is first read, and its ``data`` strings are
+    interned, so trees that are built or transformed by other code
+    share them too.
+    """
+
+    __slots__ = "data", "children", "_meta"
+
+    def __init__(self, data, children, meta=None):
+        self.data = sys.intern(data) if type(data) is str else data
+        self.children = children
+        self._meta = meta
+
+
 def pydot__tree_to_png(tree, filename, rankdir="LR", **kwargs):
     graph = pydot__tree_to_graph(tree, rankdir, **kwargs)
     graph.write_png(filename)
@@ -219,7 +250,7 @@ def pydot__tree_to_graph(tree, rankdir="LR", **kwargs):
         color |= 0x808080
 
         subnodes = [
-            _to_pydot(child) if isinstance(child, Tree) else new_leaf(child)
+            _to_pydot(child) if isinstance(child, TreeBase) else new_leaf(child)
             for child in subtree.children
         ]
         node = pydot.Node(
@@ -3,7 +3,7 @@
 import re
 from collections import defaultdict
 
-from . import Tree, Token
+from . import Tree, TreeBase, Token
 from .common import ParserConf
 from .parsers import earley
 from .grammar import Rule, Terminal, NonTerminal
@@ -46,7 +46,7 @@ def _best_rules_from_group(rules):
 
 
 def _match(term, token):
-    if isinstance(token, Tree):
+    if isinstance(token, TreeBase):
         name, _args = parse_rulename(term.name)
         return token.data == name
     elif isinstance(token, Token):
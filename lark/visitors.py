@@ -1,7 +1,7 @@
 from functools import wraps
 
 from .utils import smart_decorator, combine_alternatives
-from .tree import Tree
+from .tree import Tree, TreeBase
 from .exceptions import VisitError, GrammarError
 from .lexer import Token
 
@@ -119,7 +119,7 @@ class Transformer(_Decoratable):
     def _transform_children(self, children):
         for c in children:
             try:
-                if isinstance(c, Tree):
+                if isinstance(c, TreeBase):
                     yield self._transform_tree(c)
                 elif self.__visit_tokens__ and isinstance(c, Token):
                     yield self._call_userfunc_token(c)
@@ -211,13 +211,13 @@ class Transformer_NonRecursive(Transformer):
         while q:
             t = q.pop()
             rev_postfix.append(t)
-            if isinstance(t, Tree):
+            if isinstance(t, TreeBase):
                 q += t.children
 
         # Postfix to tree
         stack = []
         for x in reversed(rev_postfix):
-            if isinstance(x, Tree):
+            if isinstance(x, TreeBase):
                 size = len(x.children)
                 if size:
                     args = stack[-size:]
@@ -290,7 +290,7 @@ class Visitor_Recursive(VisitorBase):
     def visit(self, tree):
         "Visits the tree, starting with the leaves and finally the root (bottom-up)"
         for child in tree.children:
-            if isinstance(child, Tree):
+            if isinstance(child, TreeBase):
                 self.visit(child)
 
         self._call_userfunc(tree)
@@ -301,7 +301,7 @@ class Visitor_Recursive(VisitorBase):
         self._call_userfunc(tree)
 
         for child in tree.children:
-            if isinstance(child, Tree):
+            if isinstance(child, TreeBase):
                 self.visit_topdown(child)
 
         return tree
@@ -340,7 +340,7 @@ class Interpreter(_Decoratable):
 
     def visit_children(self, tree):
         return [
-            self.visit(child) if isinstance(child, Tree) else child
+            self.visit(child) if isinstance(child, TreeBase) else child
             for child in tree.children
         ]
 
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import types
+
+# A persistent, content-addressed cache of the programs produced by
+# each pass of a compiler, used by compile_and_test to skip passes
+# whose inputs have not changed since the last run.
+#
+# The key of a pass output is a hash chain: it hashes the key of the
+# previous pass together with a fingerprint of the code of the pass
+# (and of its type checker), starting from a hash of the source text.
+# So changing a pass invalidates that pass and every later one, while
+# the earlier passes are still served from the cache.
+
+cache_format = "1"
+
+
+def hash_bytes(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        h.update(len(p).to_bytes(8, "little"))
+        h.update(p)
+    return h.hexdigest()
+
+
+def hash_file(filename):
+    h = hashlib.sha256()
+    try:
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+    except OSError:
+        return "missing"
+    return h.hexdigest()
+
+
+def update_with_code(h, code, names):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode("utf-8"))
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            update_with_code(h, c, names)
+        else:
+            h.update(repr(c).encode("utf-8"))
+    names.update(code.co_names)
+
+
+# The directory of the project, whose modules the fingerprints below
+# cover.
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_project_file(filename):
+    return filename is not None and os.path.abspath(filename).startswith(
+        project_root + os.sep
+    )
+
+
+# The hashes of the project's source files by name, with the size and
+# modification time they had, so that a long-running process (such as
+# compile_server) only hashes a file again after it changes.
+file_hashes = {}
+
+
+def hash_source_file(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return "missing"
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = file_hashes.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    digest = hash_file(filename)
+    file_hashes[filename] = (stamp, digest)
+    return digest
+
+
+# The source files of the module that defines a class, function or
+# module `value`, if it is part of the project.
+def project_source(value):
+    if isinstance(value, types.ModuleType):
+        filename = getattr(value, "__file__", None)
+    else:
+        module = sys.modules.get(getattr(value, "__module__", None))
+        filename = getattr(module, "__file__", None)
+    return filename if is_project_file(filename) else None
+
+
+# The definitions of the method `name` in every class of the MRO of
+# `cls` that defines it, by qualified name: the method of `cls` may
+# call the ones it overrides through super().
+def method_definitions(cls, name):
+    definitions = []
+    for c in cls.__mro__:
+        f = c.__dict__.get(name)
+        if isinstance(f, (staticmethod, classmethod)):
+            f = f.__func__
+        if isinstance(f, types.FunctionType):
+            definitions.append((c.__module__ + "." + c.__qualname__ + "." + name, f))
+    return definitions
+
+
+# Fingerprints the method `name` of class `cls` together with all the
+# methods of `cls` that it (transitively) refers to, e.g. the
+# `rco_exp` and `rco_stmt` helpers of `remove_complex_operands`, and
+# the module-level functions of the project that they call, e.g.
+# `generate_name` from utils. A method is hashed in every class of the
+# MRO that defines it, so a change to an overridden method that is
+# reached through super() is noticed. The classes and modules of the
+# project that they refer to are covered by the hash of their source
+# file.
+def method_fingerprint(cls, name):
+    digests = {}
+    todo = method_definitions(cls, name)
+    while todo:
+        n, f = todo.pop()
+        if n in digests:
+            continue
+        if not isinstance(f, types.FunctionType):
+            filename = project_source(f) if f is not None else None
+            if filename is not None:
+                digests[n] = hash_source_file(filename)
+            continue
+        h = hashlib.sha256()
+        names = set()
+        update_with_code(h, f.__code__, names)
+        digests[n] = h.hexdigest()
+        for m in sorted(names):
+            definitions = method_definitions(cls, m)
+            if definitions:
+                todo.extend(definitions)
+            elif m in f.__globals__:
+                value = f.__globals__[m]
+                if isinstance(value, types.FunctionType):
+                    if is_project_file(value.__code__.co_filename):
+                        todo.append(("global " + value.__qualname__, value))
+                elif project_source(value) is not None:
+                    todo.append(("global " + m, value))
+    return hash_bytes(*[n + ":" + d for n, d in sorted(digests.items())])
+
+
+# The source files of the project: every Python file under the
+# project root, except the tests and hidden directories such as the
+# cache itself.
+def project_files():
+    files = []
+    for directory, subdirectories, filenames in os.walk(project_root):
+        subdirectories[:] = sorted(
+            d
+            for d in subdirectories
+            if not d.startswith(".") and d not in ("__pycache__", "tests")
+        )
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                files.append(os.path.join(directory, filename))
+    return files
+
+
+# Fingerprints an arbitrary function such as a type checker or an
+# interpreter. It may reach any module of the project, directly or
+# through imports made only when it runs (like interp_x86 does with
+# parser_x86 and lark), so all of the project's source files are
+# hashed, not just the module that defines it.
+def callable_fingerprint(f):
+    if f is None:
+        return "none"
+    return hash_bytes(
+        getattr(f, "__qualname__", repr(f)),
+        *[
+            os.path.relpath(name, project_root) + ":" + hash_source_file(name)
+            for name in project_files()
+        ],
+    )
+
+
+class PassCache:
+    def __init__(self, directory=".test_cache/passes"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def source_key(self, source_text, type_checker=None):
+        return hash_bytes(
+            cache_format,
+            sys.version,
+            source_text,
+            callable_fingerprint(type_checker),
+        )
+
+    def pass_key(self, previous_key, compiler, passname, type_checker=None):
+        return hash_bytes(
+            previous_key,
+            passname,
+            method_fingerprint(type(compiler), passname),
+            callable_fingerprint(type_checker),
+        )
+
+    # The key under which the verdict of running `interpreter` on the
+    # output of the pass with key `pass_key` is stored.
+    def verdict_key(self, pass_key, interpreter, input_file, golden_file):
+        return hash_bytes(
+            pass_key,
+            callable_fingerprint(interpreter),
+            hash_file(input_file),
+            hash_file(golden_file),
+        )
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, key[:2], key + "." + kind)
+
+    def contains(self, key):
+        return os.path.exists(self.path(key, "pass"))
+
+    def read(self, key, kind):
+        try:
+            with open(self.path(key, kind), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+    # Writes to a temporary file first and then renames it, so that
+    # concurrent test workers never see a partially written entry.
+    def write(self, key, kind, value):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        filename = self.path(key, kind)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, filename)
+        return True
+
+    # A pass entry holds the output program together with the global
+    # name counter and the compiler's own state, which is what the
+    # following passes depend on besides the program.
+    def load_pass(self, key):
+        return self.read(key, "pass")
+
+    def store_pass(self, key, program, name_id, compiler_state):
+        return self.write(key, "pass", (program, name_id, compiler_state))
+
+    def load_verdict(self, key):
+        return self.read(key, "verdict")
+
+    def store_verdict(self, key, verdict):
+        return self.write(key, "verdict", verdict)
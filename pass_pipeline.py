@@ -0,0 +1,315 @@
+from dataclasses import dataclass
+
+import utils
+from utils import test_pass, trace, trace_debug
+
+# The passes of the compilers and a small executor that runs them in
+# order. Everything besides running the passes themselves (tracing,
+# type checking, caching, profiling and checking the output with the
+# interpreters) is done by hooks, so each of these is written once
+# instead of once per pass.
+
+
+@dataclass(frozen=True)
+class CompilerPass:
+    name: str
+    # the output is type checked (when there is a type checker for it)
+    type_checked: bool = False
+    # the AST of the output is traced, not only its concrete syntax
+    trace_repr: bool = False
+
+    def run(self, compiler, program):
+        return getattr(compiler, self.name)(program)
+
+
+# All the passes, in the order in which they run. A compiler only has
+# the passes for the languages it supports; the others are skipped.
+compiler_passes = [
+    CompilerPass("shrink", type_checked=True),
+    CompilerPass("uniquify", type_checked=True),
+    CompilerPass("reveal_functions", type_checked=True),
+    CompilerPass("resolve", type_checked=True),
+    CompilerPass("check_bounds", type_checked=True),
+    CompilerPass("erase_types", type_checked=True),
+    CompilerPass("cast_insert", type_checked=True),
+    CompilerPass("lower_casts", type_checked=True),
+    CompilerPass("differentiate_proxies", type_checked=True),
+    CompilerPass("reveal_casts", type_checked=True),
+    CompilerPass("convert_assignments", type_checked=True),
+    CompilerPass("convert_to_closures", type_checked=True),
+    CompilerPass("limit_functions", type_checked=True),
+    CompilerPass("expose_allocation", type_checked=True),
+    CompilerPass("remove_complex_operands", type_checked=True, trace_repr=True),
+    CompilerPass("explicate_control", type_checked=True, trace_repr=True),
+    CompilerPass("select_instructions"),
+    CompilerPass("assign_homes"),
+    CompilerPass("patch_instructions"),
+    CompilerPass("prelude_and_conclusion"),
+]
+
+
+def find_passes(names):
+    return [p for p in compiler_passes if p.name in names]
+
+
+# A program that is only computed (e.g. parsed, or loaded from the
+# pass cache) the first time something needs it.
+class DeferredProgram:
+    def __init__(self, load):
+        self.load = load
+        self.loaded = False
+        self.program = None
+
+    def force(self):
+        if not self.loaded:
+            self.program = self.load()
+            self.loaded = True
+        return self.program
+
+
+def force(program):
+    if isinstance(program, DeferredProgram):
+        return program.force()
+    return program
+
+
+# The hooks run in the order in which they were added to the pipeline:
+# before_pass and after_pass are called in that order, and the first
+# hook's around_pass is the outermost wrapper of running the pass.
+class PipelineHook:
+    def before_pass(self, pipeline, compiler_pass, program):
+        pass
+
+    # Returns the output of the pass, normally by calling run(program).
+    def around_pass(self, pipeline, compiler_pass, program, run):
+        return run(program)
+
+    def after_pass(self, pipeline, compiler_pass, program):
+        pass
+
+
+class PassPipeline:
+    # Passes named in `required` are run even if the compiler doesn't
+    # define them (so that a missing one is an error). With stop_at,
+    # the pipeline stops after running the pass of that name.
+    def __init__(self, passes=compiler_passes, hooks=(), stop_at=None, required=()):
+        self.passes = list(passes)
+        self.hooks = list(hooks)
+        self.stop_at = stop_at
+        self.required = set(required)
+        self.compiler = None
+        self.passes_run = []
+        # the pass that is running (or that raised an exception)
+        self.current_pass = None
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @property
+    def last_pass(self):
+        return self.passes_run[-1] if self.passes_run else None
+
+    def run(self, compiler, program):
+        self.compiler = compiler
+        self.passes_run = []
+        for compiler_pass in self.passes:
+            if compiler_pass.name not in self.required and not hasattr(
+                compiler, compiler_pass.name
+            ):
+                continue
+            self.current_pass = compiler_pass.name
+            for hook in self.hooks:
+                hook.before_pass(self, compiler_pass, program)
+            program = self.run_pass(compiler_pass, program)
+            self.passes_run.append(compiler_pass.name)
+            for hook in self.hooks:
+                hook.after_pass(self, compiler_pass, program)
+            if compiler_pass.name == self.stop_at:
+                break
+        return program
+
+    def run_pass(self, compiler_pass, program):
+        def run(program):
+            return compiler_pass.run(self.compiler, force(program))
+
+        def wrap(hook, run):
+            return lambda program: hook.around_pass(self, compiler_pass, program, run)
+
+        for hook in reversed(self.hooks):
+            run = wrap(hook, run)
+        return run(program)
+
+
+################################################################################
+# Hooks
+################################################################################
+
+
+class TraceHook(PipelineHook):
+    # trace_program, if given, replaces the default tracing of the
+    # output of each pass
+    def __init__(self, trace_program=None):
+        self.trace_program = trace_program
+
+    def before_pass(self, pipeline, compiler_pass, program):
+        trace("\n# {}\n", compiler_pass.name)
+
+    def after_pass(self, pipeline, compiler_pass, program):
+        if isinstance(program, DeferredProgram):
+            trace("(cached)")
+        elif self.trace_program is not None:
+            self.trace_program(program)
+        else:
+            trace(program, level=trace_debug)
+            if compiler_pass.trace_repr:
+                trace(repr, program, level=trace_debug)
+            trace("", level=trace_debug)
+
+
+# Type checks the output of the passes that have a type checker in
+# type_check_dict.
+class TypeCheckHook(PipelineHook):
+    def __init__(self, type_check_dict, measure=None):
+        self.type_check_dict = type_check_dict
+        self.measure = measure
+
+    def type_checker(self, compiler_pass):
+        if compiler_pass.type_checked:
+            return self.type_check_dict.get(compiler_pass.name)
+        return None
+
+    def around_pass(self, pipeline, compiler_pass, program, run):
+        program = run(program)
+        type_checker = self.type_checker(compiler_pass)
+        if type_checker is not None:
+            trace("type checking after {}\n", compiler_pass.name)
+            if self.measure is not None:
+                with self.measure("type_check", compiler_pass.name):
+                    type_checker(program)
+            else:
+                type_checker(program)
+            trace("type checking passed")
+        return program
+
+
+# Type checks the input of the passes given in `checks`, a dictionary
+# from pass names to type checkers.
+class CheckInputHook(PipelineHook):
+    def __init__(self, checks):
+        self.checks = checks
+
+    def before_pass(self, pipeline, compiler_pass, program):
+        if compiler_pass.name in self.checks:
+            self.checks[compiler_pass.name](force(program))
+
+
+# Measures each pass that actually runs (see PassProfiler.measure).
+class ProfileHook(PipelineHook):
+    def __init__(self, measure):
+        self.measure = measure
+
+    def around_pass(self, pipeline, compiler_pass, program, run):
+        with self.measure("pass", compiler_pass.name):
+            return run(program)
+
+
+# Serves the output of the passes from a PassCache and stores the
+# output of those that had to run. It must come before the hooks that
+# check the output of a pass (like TypeCheckHook) so that only checked
+# output is cached.
+class CacheHook(PipelineHook):
+    def __init__(self, cache, source_text, type_check_dict):
+        self.cache = cache
+        self.type_check_dict = type_check_dict
+        self.key = cache.source_key(source_text, type_check_dict.get("source"))
+
+    def load(self, compiler, key):
+        entry = self.cache.load_pass(key)
+        if entry is None:
+            raise Exception("unreadable pass cache entry " + key)
+        program, utils.name_id, compiler_state = entry
+        compiler.__dict__.clear()
+        compiler.__dict__.update(compiler_state)
+        return program
+
+    def around_pass(self, pipeline, compiler_pass, program, run):
+        type_checker = None
+        if compiler_pass.type_checked:
+            type_checker = self.type_check_dict.get(compiler_pass.name)
+        compiler = pipeline.compiler
+        key = self.cache.pass_key(self.key, compiler, compiler_pass.name, type_checker)
+        self.key = key
+        if self.cache.contains(key):
+            return DeferredProgram(lambda: self.load(compiler, key))
+        program = run(program)
+        self.cache.store_pass(key, program, utils.name_id, dict(vars(compiler)))
+        return program
+
+
+# Checks the output of each pass with the interpreter for it in
+# interp_dict (see test_pass, which keeps the interpreter's input and
+# output in memory when given a TestData) and counts the passes that
+# succeed. The output of prelude_and_conclusion is checked by running
+# it instead.
+class VerifyHook(PipelineHook):
+    def __init__(
+        self,
+        compiler_name,
+        interp_dict,
+        program_root,
+        cache_hook=None,
+        measure=None,
+        test_data=None,
+    ):
+        self.compiler_name = compiler_name
+        self.interp_dict = interp_dict
+        self.program_root = program_root
+        self.cache_hook = cache_hook
+        self.measure = measure
+        self.test_data = test_data
+        self.successful_passes = 0
+
+    def after_pass(self, pipeline, compiler_pass, program):
+        passname = compiler_pass.name
+        if passname == "prelude_and_conclusion":
+            return
+        verdict = None
+        cache = self.cache_hook.cache if self.cache_hook is not None else None
+        if cache is not None and passname in self.interp_dict.keys():
+            verdict_key = cache.verdict_key(
+                self.cache_hook.key,
+                self.interp_dict[passname],
+                self.program_root + ".in",
+                self.program_root + ".golden",
+            )
+            verdict = cache.load_verdict(verdict_key)
+            if verdict == 0:
+                print(
+                    "compiler "
+                    + self.compiler_name
+                    + " failed pass "
+                    + passname
+                    + " on test (cached):\n"
+                    + self.program_root
+                    + "\n"
+                )
+        if verdict is None:
+            program = force(program)
+            if self.measure is not None and passname in self.interp_dict.keys():
+                with self.measure("interp", passname):
+                    verdict = self.test(passname, program)
+            else:
+                verdict = self.test(passname, program)
+            if cache is not None and passname in self.interp_dict.keys():
+                cache.store_verdict(verdict_key, verdict)
+        self.successful_passes += verdict
+
+    def test(self, passname, program):
+        return test_pass(
+            passname,
+            self.interp_dict,
+            self.program_root,
+            program,
+            self.compiler_name,
+            self.test_data,
+        )
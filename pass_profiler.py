@@ -0,0 +1,113 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Records the wall time, CPU time and peak memory (as seen by
+# tracemalloc) of each pass, type check and interpreter run performed
+# by compile_and_test, and writes them out as a JSON report. Tracing
+# the memory slows everything down, so it can be turned off when only
+# the times are of interest (peak_memory is then None).
+#
+# Measurements can be nested (e.g. the phases of register allocation
+# inside a pass). The time of a nested measurement is charged to it
+# only, not to the measurements around it, so the times of the records
+# add up to the total. The peak memory of a measurement includes the
+# ones nested in it.
+
+
+class PassProfiler:
+    def __init__(self, trace_memory=True):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        # the measurements in progress, innermost last: the peak memory
+        # seen before their nested measurements reset it, and the time
+        # spent in their nested measurements
+        self.stack = []
+
+    @contextmanager
+    def measure(self, test, kind, name):
+        frame = {"peak": 0, "nested_wall_time": 0.0, "nested_cpu_time": 0.0}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                outer = self.stack[-1]
+                outer["peak"] = max(outer["peak"], peak)
+            tracemalloc.reset_peak()
+            start_memory = current
+        self.stack.append(frame)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_wall
+            cpu_time = time.process_time() - start_cpu
+            self.stack.pop()
+            peak_memory = None
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+                peak_memory = peak - start_memory
+            if self.stack:
+                outer = self.stack[-1]
+                outer["nested_wall_time"] += wall_time
+                outer["nested_cpu_time"] += cpu_time
+                if self.trace_memory:
+                    outer["peak"] = max(outer["peak"], peak)
+            self.records.append(
+                {
+                    "test": test,
+                    "kind": kind,
+                    "name": name,
+                    "wall_time": wall_time - frame["nested_wall_time"],
+                    "cpu_time": cpu_time - frame["nested_cpu_time"],
+                    "peak_memory": peak_memory,
+                }
+            )
+
+    # Stops tracemalloc if this profiler was the one that started it.
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def merge(self, records):
+        self.records.extend(records)
+
+    # Aggregates the records per pass (or interpreter), slowest first.
+    def summary(self):
+        totals = {}
+        for r in self.records:
+            key = (r["kind"], r["name"])
+            if key not in totals:
+                totals[key] = {
+                    "kind": r["kind"],
+                    "name": r["name"],
+                    "count": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "max_wall_time": 0.0,
+                    "max_peak_memory": 0,
+                    "slowest_test": None,
+                }
+            t = totals[key]
+            t["count"] += 1
+            t["wall_time"] += r["wall_time"]
+            t["cpu_time"] += r["cpu_time"]
+            if r["wall_time"] >= t["max_wall_time"]:
+                t["max_wall_time"] = r["wall_time"]
+                t["slowest_test"] = r["test"]
+            if r["peak_memory"] is not None:
+                t["max_peak_memory"] = max(t["max_peak_memory"], r["peak_memory"])
+        return sorted(totals.values(), key=lambda t: t["wall_time"], reverse=True)
+
+    def report(self):
+        return {"summary": self.summary(), "records": self.records}
+
+    def write_report(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -145,7 +145,7 @@ class TypeCheckLgeneric(TypeCheckLlambda):
     def check_stmts(self, ss, return_ty, env):
         if len(ss) == 0:
             return
-        trace("*** Lgeneric check_stmts " + repr(ss[0]) + "\n")
+        trace("*** Lgeneric check_stmts {!r}\n", ss[0], level=trace_debug)
         match ss[0]:
             case ImportFrom():
                 # ignore for now
@@ -159,7 +159,7 @@ class TypeCheckLgeneric(TypeCheckLlambda):
     def type_check_stmts(self, ss, env):
         if len(ss) == 0:
             return
-        trace("*** Lgeneric type_check_stmts " + repr(ss[0]) + "\n")
+        trace("*** Lgeneric type_check_stmts {!r}\n", ss[0], level=trace_debug)
         match ss[0]:
             case ImportFrom():
                 # ignore for now
@@ -297,7 +297,7 @@ class TypeCheckLgrad(TypeCheckLlambda):
     def check_exp(self, e, ty, env):
         match e:
             case Lambda(params, body):
-                trace("check_exp: " + str(e) + "\nexpected type: " + str(ty))
+                trace("check_exp: {}\nexpected type: {}", e, ty, level=trace_debug)
                 if isinstance(params, ast.arguments):
                     new_params = [a.arg for a in params.args]
                     e.args = new_params
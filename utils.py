@@ -3,7 +3,12 @@ import sys
 from sys import platform
 import ast
 from ast import *
+import io
+import re
+from collections import deque
+from contextlib import ExitStack, contextmanager, nullcontext
 from dataclasses import dataclass
+from itertools import zip_longest
 
 # move these to the compilers, use a method with overrides -Jeremy
 builtin_functions = {
@@ -1303,17 +1308,95 @@ def label_name(n: str) -> str:
         return n
 
 
+################################################################################
+# Tracing
+################################################################################
+
+# Trace messages have a level; only those at or below the level given
+# to enable_tracing are rendered. Pass headers and verdicts are at the
+# info level, whole programs at the debug level.
+trace_info = 1
+trace_debug = 2
+
 tracing = False
+trace_level = 0
+trace_sinks = []
+
+
+# Writes trace messages to a stream, by default the current sys.stderr.
+class StreamSink:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, text):
+        print(text, file=self.stream if self.stream is not None else sys.stderr)
+
+
+# Appends trace messages to a file.
+class FileSink:
+    def __init__(self, filename):
+        self.file = open(filename, "a")
 
+    def write(self, text):
+        print(text, file=self.file)
+        self.file.flush()
 
-def enable_tracing():
-    global tracing
+    def close(self):
+        self.file.close()
+
+
+# Keeps only the last `capacity` trace messages in memory, e.g. to show
+# what happened just before a failure.
+class RingBufferSink:
+    def __init__(self, capacity=1000):
+        self.buffer = deque(maxlen=capacity)
+
+    def write(self, text):
+        self.buffer.append(text)
+
+    def messages(self):
+        return list(self.buffer)
+
+    def dump(self, file=None):
+        for text in self.buffer:
+            print(text, file=file if file is not None else sys.stderr)
+
+
+# Turns on tracing up to the given level. The messages go to the given
+# sinks, by default to standard error.
+def enable_tracing(level=trace_debug, *sinks):
+    global tracing, trace_level, trace_sinks
     tracing = True
+    trace_level = level
+    trace_sinks = list(sinks) if sinks else [StreamSink()]
+
 
+def disable_tracing():
+    global tracing, trace_level
+    tracing = False
+    trace_level = 0
 
-def trace(msg):
-    if tracing:
-        print(msg, file=sys.stderr)
+
+def add_trace_sink(sink):
+    trace_sinks.append(sink)
+
+
+# Traces a message. Rendering is deferred until tracing is known to be
+# enabled for the message's level, so that nothing is computed for
+# disabled traces:
+#   trace(program)              str(program) is only called if enabled
+#   trace(repr, program)        a callable is called on the arguments
+#   trace("{} on {}", p, test)  a format string is formatted
+def trace(msg, *args, level=trace_info):
+    if not tracing or level > trace_level:
+        return
+    if callable(msg):
+        msg = msg(*args)
+    elif args:
+        msg = msg.format(*args)
+    text = str(msg)
+    for sink in trace_sinks:
+        sink.write(text)
 
 
 def is_python_extension(filename):
@@ -1324,33 +1407,206 @@ def is_python_extension(filename):
         return False
 
 
+################################################################################
+# Comparing program output against the golden files
+################################################################################
+
+# Number of characters read at a time when comparing output files.
+compare_chunk_size = 1 << 16
+
+# The characters that `diff -b` treats as whitespace: only the ASCII
+# blanks, not the other characters that str.isspace accepts (such as
+# "\xa0" or "\u2003").
+whitespace_chars = " \t\r\f\v"
+whitespace_run = re.compile("[" + whitespace_chars + "]+")
+
+
+@dataclass
+class OutputMismatch:
+    line: int
+    column: int
+    output_line: str | None
+    golden_line: str | None
+    error: str | None = None
+
+    def __str__(self):
+        if self.error is not None:
+            return "could not compare output with golden: " + self.error
+        return (
+            "output differs from golden at line "
+            + str(self.line)
+            + ", column "
+            + str(self.column)
+            + "\n  output: "
+            + ("<end of file>" if self.output_line is None else self.output_line)
+            + "\n  golden: "
+            + ("<end of file>" if self.golden_line is None else self.golden_line)
+        )
+
+
+# Yields the lines of a file (without the newline), reading it in
+# chunks so that large outputs are never held in memory at once.
+# A missing newline at the end of the file is ignored, like diff does.
+def read_lines_chunked(file, chunk_size=compare_chunk_size):
+    partial = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        lines = (partial + chunk).split("\n")
+        partial = lines.pop()
+        yield from lines
+    if partial:
+        yield partial
+
+
+# Normalizes a line the way `diff -b` sees it: trailing whitespace is
+# dropped and every other run of whitespace counts as a single space.
+def normalize_whitespace(line):
+    return whitespace_run.sub(" ", line.rstrip(whitespace_chars))
+
+
+# The (1-based) column of `line` at which it stops agreeing with
+# `other` once runs of whitespace are collapsed.
+def mismatch_column(line, other):
+    normal_other = normalize_whitespace(other)
+    n = 0
+    i = 0
+    while i < len(line):
+        if line[i] in whitespace_chars:
+            start = i
+            while i < len(line) and line[i] in whitespace_chars:
+                i += 1
+            if i == len(line):
+                break
+            if n >= len(normal_other) or normal_other[n] != " ":
+                return start + 1
+            n += 1
+        else:
+            if n >= len(normal_other) or normal_other[n] != line[i]:
+                return i + 1
+            n += 1
+            i += 1
+    return len(line) + 1
+
+
+def open_for_compare(file):
+    if isinstance(file, str):
+        return open(file, "r", newline="")
+    return nullcontext(file)
+
+
+# Compares program output against a golden file with the same
+# whitespace-insensitive semantics as `diff -b`, stopping at the first
+# mismatch. Either argument may be a file name or an open text stream
+# (use io.StringIO to compare in-memory output without writing it to
+# disk). Returns None when they agree and an OutputMismatch otherwise.
+def compare_output(output, golden, chunk_size=compare_chunk_size):
+    try:
+        with open_for_compare(output) as out, open_for_compare(golden) as gold:
+            out_lines = read_lines_chunked(out, chunk_size)
+            gold_lines = read_lines_chunked(gold, chunk_size)
+            for lineno, (out_line, gold_line) in enumerate(
+                zip_longest(out_lines, gold_lines), start=1
+            ):
+                if out_line == gold_line:
+                    continue
+                if out_line is None or gold_line is None:
+                    return OutputMismatch(lineno, 1, out_line, gold_line)
+                if normalize_whitespace(out_line) != normalize_whitespace(gold_line):
+                    column = mismatch_column(out_line, gold_line)
+                    return OutputMismatch(lineno, column, out_line, gold_line)
+    except OSError as e:
+        return OutputMismatch(0, 0, None, None, error=str(e))
+    return None
+
+
+################################################################################
+# Running the interpreters on a test
+################################################################################
+
+
+# The input and the golden output of a test, read once and then
+# reused by every pass that is checked, together with the in-memory
+# buffers that stand in for standard input and output.
+class TestData:
+    def __init__(self, program_root):
+        self.input_text = read_if_exists(program_root + ".in")
+        self.golden_text = read_if_exists(program_root + ".golden")
+        self.golden_file = program_root + ".golden"
+        self.input_buffer = io.StringIO(self.input_text or "")
+        self.output_buffer = io.StringIO()
+
+    def golden(self):
+        if self.golden_text is None:
+            return self.golden_file  # so that the error names the file
+        return io.StringIO(self.golden_text)
+
+
+def read_if_exists(filename):
+    try:
+        with open(filename, "r", newline="") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# Runs the body with standard input and output redirected, restoring
+# the original streams even if the body raises an exception. Standard
+# input and output are either the in-memory buffers of a TestData,
+# which are rewound first, or the given files.
+@contextmanager
+def redirect_io(test_data=None, input_file=None, output_file=None):
+    stdin = sys.stdin
+    stdout = sys.stdout
+    with ExitStack() as files:
+        if test_data is not None:
+            test_data.input_buffer.seek(0)
+            test_data.output_buffer.seek(0)
+            test_data.output_buffer.truncate()
+            new_stdin = test_data.input_buffer
+            new_stdout = test_data.output_buffer
+        else:
+            new_stdin = files.enter_context(open(input_file, "r"))
+            new_stdout = files.enter_context(open(output_file, "w"))
+        sys.stdin = new_stdin
+        sys.stdout = new_stdout
+        try:
+            yield new_stdout
+        finally:
+            sys.stdin = stdin
+            sys.stdout = stdout
+
+
 # Given the `ast` output of a pass and a test program (root) name,
 # runs the interpreter on the program and compares the output to the
-# expected "golden" output.
-def test_pass(passname, interp_dict, program_root, ast, compiler_name):
+# expected "golden" output. Given the TestData of the test, the
+# interpreter's input and output stay in memory; the output is only
+# written to the .out file when it doesn't match.
+def test_pass(passname, interp_dict, program_root, ast, compiler_name, test_data=None):
     if passname in interp_dict.keys():
         input_file = program_root + ".in"
         output_file = program_root + ".out"
-        stdin = sys.stdin
-        stdout = sys.stdout
-        sys.stdin = open(input_file, "r")
-        sys.stdout = open(output_file, "w")
-        interp_dict[passname](ast)
-        print()  # print a newline to make diff happy
-        sys.stdin = stdin
-        sys.stdout = stdout
-        result = os.system(
-            "diff" + " -b " + output_file + " " + program_root + ".golden"
-        )
-        if result == 0:
+        if test_data is not None:
+            with redirect_io(test_data) as output:
+                interp_dict[passname](ast)
+                print()  # print a newline to make diff happy
+            output.seek(0)
+            mismatch = compare_output(output, test_data.golden())
+            if mismatch is not None:
+                with open(output_file, "w") as f:
+                    f.write(output.getvalue())
+        else:
+            with redirect_io(input_file=input_file, output_file=output_file):
+                interp_dict[passname](ast)
+                print()  # print a newline to make diff happy
+            mismatch = compare_output(output_file, program_root + ".golden")
+        if mismatch is None:
             trace(
-                "compiler "
-                + compiler_name
-                + " success on pass "
-                + passname
-                + " on test\n"
-                + program_root
-                + "\n"
+                "compiler {} success on pass {} on test\n{}\n",
+                compiler_name,
+                passname,
+                program_root,
             )
             return 1
         else:
@@ -1363,339 +1619,206 @@ def test_pass(passname, interp_dict, program_root, ast, compiler_name):
                 + program_root
                 + "\n"
             )
+            print(mismatch)
             return 0
     else:
         trace(
-            "compiler "
-            + compiler_name
-            + " skip test on pass "
-            + passname
-            + " on test\n"
-            + program_root
-            + "\n"
+            "compiler {} skip test on pass {} on test\n{}\n",
+            compiler_name,
+            passname,
+            program_root,
         )
         return 0  # ??
 
 
+# Runs every pass of the compiler on the given test program, checking
+# the output of each pass with the interpreters in interp_dict and
+# finally running the generated x86 program. Returns the number of
+# successful passes, the total number of passes, and whether the
+# whole test succeeded. The passes are run by a PassPipeline; with
+# stop_at the pipeline stops after the pass of that name, and with
+# skip_verification the interpreters are not run.
+#
+# If cache_dir is given, the output of each pass and the verdict of
+# each interpreter run are kept in a PassCache in that directory, so
+# a rerun resumes from the first pass whose code changed, and the
+# executables are kept in a BuildCache there.
+#
+# With execute=False the generated x86 program is only written to the
+# .s file; the caller is then responsible for running it (see
+# test_executable), which is how run_tests links in batches.
+#
+# If a PassProfiler is given, the time and memory used by each pass,
+# type check and interpreter run is recorded in it.
+#
+# With in_memory=True (the default) the test's input and golden output
+# are read once and the interpreters run on in-memory streams (see
+# TestData); otherwise they go through the .in and .out files.
 def compile_and_test(
-    compiler, compiler_name, type_check_dict, interp_dict, program_filename
+    compiler,
+    compiler_name,
+    type_check_dict,
+    interp_dict,
+    program_filename,
+    executable="./a.out",
+    cache_dir=None,
+    execute=True,
+    profiler=None,
+    stop_at=None,
+    skip_verification=False,
+    in_memory=True,
 ):
-    total_passes = 0
-    successful_passes = 0
-    successful_test = 0
     from eval_x86 import interp_x86
+    from pass_pipeline import (
+        CacheHook,
+        DeferredProgram,
+        PassPipeline,
+        ProfileHook,
+        TraceHook,
+        TypeCheckHook,
+        VerifyHook,
+        compiler_passes,
+        force,
+    )
 
+    successful_test = 0
     program_root = os.path.splitext(program_filename)[0]
     with open(program_filename) as source:
-        program = parse(source.read())
-
-    trace("\n# source program: " + os.path.basename(program_root) + "\n")
-    trace(program)
-    trace("")
-    trace(repr(program))
-    trace("")
-
-    if "source" in type_check_dict.keys():
-        trace("\n# type checking source program\n")
-        type_check_dict["source"](program)
-
-    passname = "shrink"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.shrink(program)
-        trace(program)
-        trace("")
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "uniquify"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.uniquify(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "reveal_functions"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.reveal_functions(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "resolve"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.resolve(program)
-        trace(program)
-        trace("")
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "check_bounds"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.check_bounds(program)
-        trace(program)
-        trace("")
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "erase_types"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.erase_types(program)
-        trace(program)
-        trace("")
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "cast_insert"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.cast_insert(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "lower_casts"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.lower_casts(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "differentiate_proxies"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.differentiate_proxies(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
-
-    passname = "reveal_casts"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.reveal_casts(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
+        source_text = source.read()
+
+    def measure(kind, name):
+        if profiler is None:
+            return nullcontext()
+        return profiler.measure(os.path.basename(program_root), kind, name)
+
+    def parse_source():
+        program = parse(source_text)
+        trace("\n# source program: {}\n", os.path.basename(program_root))
+        trace(program, level=trace_debug)
+        trace("", level=trace_debug)
+        trace(repr, program, level=trace_debug)
+        trace("", level=trace_debug)
+
+        if "source" in type_check_dict.keys():
+            trace("\n# type checking source program\n")
+            with measure("type_check", "source"):
+                type_check_dict["source"](program)
+        return program
+
+    hooks = [TraceHook()]
+    cache_hook = None
+    if cache_dir is not None:
+        from pass_cache import PassCache
+
+        cache = PassCache(os.path.join(cache_dir, "passes"))
+        cache_hook = CacheHook(cache, source_text, type_check_dict)
+        hooks.append(cache_hook)
+        # only parse the source if the first pass isn't cached
+        program = DeferredProgram(parse_source)
+    else:
+        program = parse_source()
+    hooks.append(TypeCheckHook(type_check_dict, measure))
+    if profiler is not None:
+        hooks.append(ProfileHook(measure))
+    verify_hook = None
+    if not skip_verification:
+        test_data = TestData(program_root) if in_memory else None
+        verify_hook = VerifyHook(
+            compiler_name, interp_dict, program_root, cache_hook, measure, test_data
         )
+        hooks.append(verify_hook)
 
-    passname = "convert_assignments"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.convert_assignments(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+    pipeline = PassPipeline(compiler_passes, hooks, stop_at=stop_at)
+    program = pipeline.run(compiler, program)
+    total_passes = len(pipeline.passes_run)
+    successful_passes = 0
+    if verify_hook is not None:
+        successful_passes = verify_hook.successful_passes
 
-    passname = "convert_to_closures"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.convert_to_closures(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+    if pipeline.last_pass != "prelude_and_conclusion":
+        return (successful_passes, total_passes, successful_test)
 
-    passname = "limit_functions"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.limit_functions(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            trace("type checking after " + passname + "\n")
-            type_check_dict[passname](program)
-            trace("type checking passed")
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+    # The last pass, prelude_and_conclusion, yields the final x86
+    # program; assemble, link and run it.
+    program = force(program)
+    x86_filename = program_root + ".s"
+    with open(x86_filename, "w") as dest:
+        dest.write(str(program))
 
-    passname = "expose_allocation"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.expose_allocation(program)
-        trace(program)
-        if passname in type_check_dict.keys():
-            trace("type checking after " + passname + "\n")
-            type_check_dict[passname](program)
-            trace("type checking passed")
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+    if not execute:
+        return (successful_passes, total_passes, successful_test)
 
-    passname = "remove_complex_operands"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.remove_complex_operands(program)
-        trace(program)
-        trace(repr(program))
-        if passname in type_check_dict.keys():
-            trace("type checking after " + passname + "\n")
-            type_check_dict[passname](program)
-            trace("type checking passed")
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+    # Run the final x86 program
+    emulate_x86 = False
+    if emulate_x86:
+        with redirect_io(
+            input_file=program_root + ".in", output_file=program_root + ".out"
+        ):
+            interp_x86(program)
+        successful_test = check_executable_output(compiler_name, program_root)
+    else:
+        from build_cache import BuildCache, ensure_runtime, link_executable
 
-    passname = "explicate_control"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.explicate_control(program)
-        trace(program)
-        trace(repr(program))
-        if passname in type_check_dict.keys():
-            trace("type checking after " + passname + "\n")
-            type_check_dict[passname](program)
-            trace("type checking passed")
+        if cache_dir is not None:
+            build_cache = BuildCache(os.path.join(cache_dir, "builds"))
+            executable = build_cache.executable(x86_filename)
         else:
-            trace("skipped type checking")
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
+            executable = link_executable(x86_filename, executable, ensure_runtime())
+        successful_test = test_executable(compiler_name, program_root, executable)
+    successful_passes += successful_test
+    return (successful_passes, total_passes, successful_test)
 
-    passname = "select_instructions"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.select_instructions(program)
-        trace(program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
 
-    passname = "assign_homes"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.assign_homes(program)
-        trace(program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
+# Runs a test's executable on the test's input and compares its output
+# to the golden file. Returns 1 on success and 0 otherwise (also when
+# the executable could not be built, i.e. is None).
+def test_executable(compiler_name, program_root, executable):
+    if executable is None:
+        print(
+            "compiler "
+            + compiler_name
+            + ", failed to build the executable of test "
+            + program_root
         )
+        return 0
+    input_file = program_root + ".in"
+    output_file = program_root + ".out"
+    os.system(executable + " < " + input_file + " > " + output_file)
+    return check_executable_output(compiler_name, program_root)
 
-    passname = "patch_instructions"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.patch_instructions(program)
-        trace(program)
-        total_passes += 1
-        successful_passes += test_pass(
-            passname, interp_dict, program_root, program, compiler_name
-        )
 
-    passname = "prelude_and_conclusion"
-    if hasattr(compiler, passname):
-        trace("\n# " + passname + "\n")
-        program = compiler.prelude_and_conclusion(program)
-        trace(program)
-        trace("")
-
-        x86_filename = program_root + ".s"
-        with open(x86_filename, "w") as dest:
-            dest.write(str(program))
-
-        total_passes += 1
-
-        # Run the final x86 program
-        emulate_x86 = False
-        if emulate_x86:
-            stdin = sys.stdin
-            stdout = sys.stdout
-            sys.stdin = open(program_root + ".in", "r")
-            sys.stdout = open(program_root + ".out", "w")
-            interp_x86(program)
-            sys.stdin = stdin
-            sys.stdout = stdout
-        else:
-            if platform == "darwin":
-                os.system("gcc -arch x86_64 runtime.o " + x86_filename)
-            else:
-                os.system("gcc runtime.o " + x86_filename)
-            input_file = program_root + ".in"
-            output_file = program_root + ".out"
-            os.system("./a.out < " + input_file + " > " + output_file)
-
-        result = os.system(
-            "diff" + " -b " + program_root + ".out " + program_root + ".golden"
-        )
-        if result == 0:
-            successful_passes += 1
-            successful_test = 1
-        else:
-            print(
-                "compiler "
-                + compiler_name
-                + ", executable failed"
-                + " on test "
-                + program_root
-            )
-    return (successful_passes, total_passes, successful_test)
+def check_executable_output(compiler_name, program_root):
+    mismatch = compare_output(program_root + ".out", program_root + ".golden")
+    if mismatch is None:
+        return 1
+    print(
+        "compiler " + compiler_name + ", executable failed" + " on test " + program_root
+    )
+    print(mismatch)
+    return 0
 
 
 def trace_ast_and_concrete(ast):
-    trace("concrete syntax:")
-    trace(ast)
-    trace("")
-    trace("AST:")
-    trace(repr(ast))
-
+    trace("concrete syntax:", level=trace_debug)
+    trace(ast, level=trace_debug)
+    trace("", level=trace_debug)
+    trace("AST:", level=trace_debug)
+    trace(repr, ast, level=trace_debug)
+
+
+# This function compiles the program without any testing. With
+# stop_at, it stops after the pass of that name (and only writes the
+# .s file if it got to the end).
+def compile(
+    compiler,
+    compiler_name,
+    type_check_L,
+    type_check_C,
+    program_filename,
+    stop_at=None,
+):
+    from pass_pipeline import CheckInputHook, PassPipeline, TraceHook, find_passes
 
-# This function compiles the program without any testing
-def compile(compiler, compiler_name, type_check_L, type_check_C, program_filename):
     program_root = os.path.splitext(program_filename)[0]
     with open(program_filename) as source:
         program = parse(source.read())
@@ -1704,73 +1827,46 @@ def compile(compiler, compiler_name, type_check_L, type_check_C, program_filenam
     type_check_L(program)
     trace_ast_and_concrete(program)
 
-    if hasattr(compiler, "shrink"):
-        trace("\n# shrink\n")
-        program = compiler.shrink(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "uniquify"):
-        trace("\n# uniquify\n")
-        program = compiler.uniquify(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "reveal_functions"):
-        trace("\n# reveal functions\n")
-        type_check_L(program)
-        program = compiler.reveal_functions(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "convert_assignments"):
-        trace("\n# assignment conversion\n")
-        type_check_L(program)
-        program = compiler.convert_assignments(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "convert_to_closures"):
-        trace("\n# closure conversion\n")
-        type_check_L(program)
-        program = compiler.convert_to_closures(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "limit_functions"):
-        trace("\n# limit functions\n")
-        type_check_L(program)
-        program = compiler.limit_functions(program)
-        trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "expose_allocation"):
-        trace("\n# expose allocation\n")
-        type_check_L(program)
-        program = compiler.expose_allocation(program)
-        trace_ast_and_concrete(program)
-
-    trace("\n# remove complex\n")
-    program = compiler.remove_complex_operands(program)
-    trace_ast_and_concrete(program)
-
-    if hasattr(compiler, "explicate_control"):
-        trace("\n# explicate control\n")
-        program = compiler.explicate_control(program)
-        trace_ast_and_concrete(program)
-
+    checks = {
+        passname: type_check_L
+        for passname in [
+            "reveal_functions",
+            "convert_assignments",
+            "convert_to_closures",
+            "limit_functions",
+            "expose_allocation",
+        ]
+    }
     if type_check_C:
-        type_check_C(program)
-
-    trace("\n# select instructions\n")
-    pseudo_x86 = compiler.select_instructions(program)
-    trace_ast_and_concrete(pseudo_x86)
-
-    trace("\n# assign homes\n")
-    almost_x86 = compiler.assign_homes(pseudo_x86)
-    trace_ast_and_concrete(almost_x86)
-
-    trace("\n# patch instructions\n")
-    x86 = compiler.patch_instructions(almost_x86)
-    trace_ast_and_concrete(x86)
-
-    trace("\n# prelude and conclusion\n")
-    x86 = compiler.prelude_and_conclusion(x86)
-    trace_ast_and_concrete(x86)
+        checks["select_instructions"] = type_check_C
+    required = [
+        "remove_complex_operands",
+        "select_instructions",
+        "assign_homes",
+        "patch_instructions",
+        "prelude_and_conclusion",
+    ]
+    pipeline = PassPipeline(
+        find_passes(
+            [
+                "shrink",
+                "uniquify",
+                "reveal_functions",
+                "convert_assignments",
+                "convert_to_closures",
+                "limit_functions",
+                "expose_allocation",
+                "explicate_control",
+            ]
+            + required
+        ),
+        [TraceHook(trace_ast_and_concrete), CheckInputHook(checks)],
+        stop_at=stop_at,
+        required=required,
+    )
+    x86 = pipeline.run(compiler, program)
+    if pipeline.last_pass != "prelude_and_conclusion":
+        return
 
     # Output x86 program to the .s file
     x86_filename = program_root + ".s"
@@ -1783,10 +1879,84 @@ def compile(compiler, compiler_name, type_check_L, type_check_C, program_filenam
 # C intermediate language, run all the passes in the compiler,
 # checking that the resulting programs produce output that matches the
 # golden file.
-def run_one_test(test, lang, compiler, compiler_name, type_check_dict, interp_dict):
+def run_one_test(
+    test, lang, compiler, compiler_name, type_check_dict, interp_dict, **options
+):
     #    test_root = os.path.splitext(test)[0]
     #    test_name = os.path.basename(test_root)
-    return compile_and_test(compiler, compiler_name, type_check_dict, interp_dict, test)
+    return compile_and_test(
+        compiler, compiler_name, type_check_dict, interp_dict, test, **options
+    )
+
+
+# State of a worker process in the pool used by run_tests when jobs > 1.
+# Every worker links into its own scratch directory so that the
+# executables of tests running at the same time don't clobber each other.
+worker_config = None
+
+
+def init_test_worker(scratch_root, *config):
+    global worker_config
+    import tempfile
+
+    scratch = tempfile.mkdtemp(prefix="worker-", dir=scratch_root)
+    executable = os.path.join(scratch, "test-" + str(os.getpid()))
+    worker_config = config + (executable,)
+
+
+# Returns the result of the test together with the profile records
+# of the test, if profiling is enabled.
+def run_one_test_in_worker(test):
+    (
+        lang,
+        compiler,
+        compiler_name,
+        type_check_dict,
+        interp_dict,
+        options,
+        executable,
+    ) = worker_config
+    options = dict(options)
+    if options.get("profiler") is not None:
+        from pass_profiler import PassProfiler
+
+        options["profiler"] = PassProfiler()
+    result = run_one_test(
+        test,
+        lang,
+        compiler,
+        compiler_name,
+        type_check_dict,
+        interp_dict,
+        executable=executable,
+        **options
+    )
+    sys.stdout.flush()
+    if options.get("profiler") is not None:
+        options["profiler"].stop()
+        return (result, options["profiler"].records)
+    return (result, None)
+
+
+# The last phase of run_tests with batch_link=True: builds the
+# executables of all the compiled tests at once and runs them, adding
+# their verdicts to the results of compiling the tests.
+def link_and_run_tests(compiler_name, tests, results, cache_dir):
+    import tempfile
+    from build_cache import BuildCache
+
+    program_roots = [os.path.splitext(test)[0] for test in tests]
+    with tempfile.TemporaryDirectory(prefix="run_tests-") as scratch:
+        if cache_dir is not None:
+            build_cache = BuildCache(os.path.join(cache_dir, "builds"))
+        else:
+            build_cache = BuildCache(scratch)
+        executables = build_cache.build_all([root + ".s" for root in program_roots])
+        linked_results = []
+        for root, (succ_passes, tot_passes, _) in zip(program_roots, results):
+            succ_test = test_executable(compiler_name, root, executables[root + ".s"])
+            linked_results.append((succ_passes + succ_test, tot_passes, succ_test))
+    return linked_results
 
 
 # Given the name of a language, a compiler, the compiler's name, a
@@ -1794,7 +1964,25 @@ def run_one_test(test, lang, compiler, compiler_name, type_check_dict, interp_di
 # for the C intermediate language, test the compiler on all the tests
 # in the directory of for the given language, i.e., all the
 # python files in ./tests/<language>.
-def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
+# With jobs > 1 the tests are spread over a pool of that many worker
+# processes (jobs=None uses one worker per CPU). Passing a cache_dir
+# caches the output of the passes and the executables between runs
+# (see compile_and_test). With batch_link=True all the tests are
+# compiled first, then the assembly files that changed are assembled
+# by a single gcc invocation and linked, and finally the executables
+# are run. Passing a profile_report file name profiles every pass and
+# interpreter run (see PassProfiler) and writes the JSON report there.
+def run_tests(
+    lang,
+    compiler,
+    compiler_name,
+    type_check_dict,
+    interp_dict,
+    jobs=1,
+    cache_dir=None,
+    batch_link=False,
+    profile_report=None,
+):
     # Collect all the test programs for this language.
     homedir = os.getcwd()
     directory = homedir + "/tests/" + lang + "/"
@@ -1804,15 +1992,62 @@ def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
         tests = filter(is_python_extension, filenames)
         tests = [dirpath + t for t in tests]
         break
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    profiler = None
+    if profile_report is not None:
+        from pass_profiler import PassProfiler
+
+        profiler = PassProfiler()
+    options = {"cache_dir": cache_dir, "execute": not batch_link, "profiler": profiler}
     # Compile and run each test program, comparing output to the golden file.
+    if jobs > 1 and len(tests) > 1:
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        sys.stdout.flush()
+        with tempfile.TemporaryDirectory(prefix="run_tests-") as scratch_root:
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(tests)),
+                initializer=init_test_worker,
+                initargs=(
+                    scratch_root,
+                    lang,
+                    compiler,
+                    compiler_name,
+                    type_check_dict,
+                    interp_dict,
+                    options,
+                ),
+            ) as pool:
+                results = []
+                for result, records in pool.map(run_one_test_in_worker, tests):
+                    results.append(result)
+                    if records is not None:
+                        profiler.merge(records)
+    else:
+        results = [
+            run_one_test(
+                test,
+                lang,
+                compiler,
+                compiler_name,
+                type_check_dict,
+                interp_dict,
+                **options
+            )
+            for test in tests
+        ]
+    if batch_link and hasattr(compiler, "prelude_and_conclusion"):
+        results = link_and_run_tests(compiler_name, tests, results, cache_dir)
+    if profiler is not None:
+        profiler.stop()
+        profiler.write_report(profile_report)
     successful_passes = 0
     total_passes = 0
     successful_tests = 0
     total_tests = 0
-    for test in tests:
-        (succ_passes, tot_passes, succ_test) = run_one_test(
-            test, lang, compiler, compiler_name, type_check_dict, interp_dict
-        )
+    for succ_passes, tot_passes, succ_test in results:
         successful_passes += succ_passes
         total_passes += tot_passes
         successful_tests += succ_test
@@ -1839,3 +2074,4 @@ def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
         + " on language "
         + lang
     )
+    return (successful_tests, total_tests, successful_passes, total_passes)